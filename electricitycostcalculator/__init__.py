@@ -1,4 +1,21 @@
 __author__ = 'Olivier Van Cutsem'
 
-from electricitycostcalculator import electricity_rate_manager, openei_tariff
-__all__ = ["cost_calculator", "openei_tariff"]
+import importlib
+
+__all__ = ["electricity_rate_manager", "openei_tariff"]
+
+
+def __getattr__(name):
+    """
+    Load the sub-packages on first access, so that importing the package (e.g. in a worker process that only bills
+    precompiled tariffs) doesn't load the OpenEI client and its dependencies
+    """
+
+    if name in __all__:
+        return importlib.import_module('.' + name, __name__)
+
+    raise AttributeError("module {0!r} has no attribute {1!r}".format(__name__, name))
+
+
+def __dir__():
+    return sorted(set(globals().keys()) | set(__all__))
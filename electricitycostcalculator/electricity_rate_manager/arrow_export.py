@@ -0,0 +1,189 @@
+__author__ = 'Olivier Van Cutsem'
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+from .bill_structure import Bill
+
+# --------------- ARROW / PARQUET export --------------- #
+
+# The partition columns of the Parquet datasets
+PRICE_PARTITION_COLS = ['tariff', 'month']
+BILL_PARTITION_COLS = ['tariff', 'cycle']
+
+
+def price_signals_to_record_batch(prices, tariff=None):
+    """
+    Convert price signals, as returned by ElectricityRateManager.get_electricity_price(), to an Arrow record batch.
+    The dates and the prices of each label are wrapped without copy, when they are contiguous arrays (which is the case
+    of the price signals of the ElectricityRateManager).
+
+    The columns of the record batch are:
+     - 'date', a timestamp with the timezone of the index, if any
+     - 'tariff', the name of the tariff, if given (dictionary-encoded)
+     - 'month', "%Y-%m" (dictionary-encoded)
+     - one float column (float64 or float32, as in prices) per tariff label
+
+    :param prices: a pandas dataframe with a DatetimeIndex, one column per tariff label
+    :param tariff: [optional] the name of the tariff
+    :return: a pyarrow.RecordBatch
+    :raise ImportError: if pyarrow is not installed
+    """
+
+    require_pyarrow('price_signals_to_record_batch')
+
+    index = pd.DatetimeIndex(prices.index)
+
+    # The dates are stored in the time unit of the index, in UTC if they are timezone-aware
+    dates = index.values
+    time_unit = np.datetime_data(dates.dtype)[0]
+
+    columns = [pa.array(dates.view(np.int64), type=pa.timestamp(time_unit, tz=None if index.tz is None else str(index.tz)))]
+    names = ['date']
+
+    if tariff is not None:
+        columns.append(get_constant_dictionary_array(str(tariff), len(index)))
+        names.append('tariff')
+
+    columns.append(get_month_array(index))
+    names.append('month')
+
+    for i, label in enumerate(prices.columns):
+        columns.append(pa.array(np.asarray(prices.iloc[:, i].values)))
+        names.append(str(label))
+
+    return pa.RecordBatch.from_arrays(columns, names=names)
+
+
+def bill_to_record_batch(bill, tariff=None, meter=None):
+    """
+    Convert a Bill to an Arrow record batch, one row per bill line.
+
+    The columns of the record batch are:
+     - 'tariff' and 'meter', if given (dictionary-encoded)
+     - 'cycle', 'label' and 'charge_type' (dictionary-encoded)
+     - 'determinant', 'cost' and 'price' (float64)
+     - 'peak_date', a timestamp (ns) with the timezone of the bill, if any
+     - 'period_mask', the daily mask of the demand period as a string of 0 and 1
+
+    :param bill: a Bill
+    :param tariff: [optional] the name of the tariff
+    :param meter: [optional] the id of the meter
+    :return: a pyarrow.RecordBatch
+    :raise ImportError: if pyarrow is not installed
+    """
+
+    require_pyarrow('bill_to_record_batch')
+
+    lines = bill.lines
+    nb_lines = len(lines)
+
+    columns = []
+    names = []
+
+    if tariff is not None:
+        columns.append(get_constant_dictionary_array(str(tariff), nb_lines))
+        names.append('tariff')
+    if meter is not None:
+        columns.append(get_constant_dictionary_array(str(meter), nb_lines))
+        names.append('meter')
+
+    # The fields of the bill lines are strided views: they are copied once into contiguous arrays
+    columns.append(pa.DictionaryArray.from_arrays(np.ascontiguousarray(lines['cycle']), [str(c) for c in bill.cycles]))
+    columns.append(pa.DictionaryArray.from_arrays(np.ascontiguousarray(lines['label'], dtype=np.int32), bill.labels))
+    columns.append(pa.DictionaryArray.from_arrays(np.ascontiguousarray(lines['charge_type'], dtype=np.int32),
+                                                  [charge_type.name for charge_type in Bill.CHARGE_TYPES]))
+    names += ['cycle', 'label', 'charge_type']
+
+    for field in ['determinant', 'cost', 'price']:
+        columns.append(pa.array(np.ascontiguousarray(lines[field])))
+        names.append(field)
+
+    peak_dates = np.ascontiguousarray(lines['peak_date']).view(np.int64)
+    columns.append(pa.array(peak_dates, type=pa.timestamp('ns', tz=None if bill.tz is None else str(bill.tz)),
+                            mask=np.isnat(lines['peak_date'])))
+    names.append('peak_date')
+
+    columns.append(pa.array([Bill.get_mask_string(m, n) if n > 0 else None
+                             for m, n in zip(lines['period_mask'], lines['period_slots'])], type=pa.string()))
+    names.append('period_mask')
+
+    return pa.RecordBatch.from_arrays(columns, names=names)
+
+
+def write_parquet_dataset(batches, root_path, partition_cols=None):
+    """
+    Write record batches to a Parquet dataset, partitioned in directories (e.g. tariff=.../month=.../), readable by
+    Spark or DuckDB
+    :param batches: a list of pyarrow.RecordBatch with the same schema, e.g. from price_signals_to_record_batch() or
+    bill_to_record_batch()
+    :param root_path: the root directory of the dataset
+    :param partition_cols: [optional] the partition columns, PRICE_PARTITION_COLS by default (BILL_PARTITION_COLS for
+    bills). The columns missing from the batches are ignored
+    :return: /
+    :raise ImportError: if pyarrow is not installed
+    """
+
+    require_pyarrow('write_parquet_dataset')
+
+    if len(batches) == 0:
+        return
+
+    if partition_cols is None:
+        partition_cols = PRICE_PARTITION_COLS
+
+    table = pa.Table.from_batches(batches)
+    partition_cols = [col for col in partition_cols if col in table.column_names]
+
+    pq.write_to_dataset(table, root_path, partition_cols=partition_cols or None)
+
+
+def require_pyarrow(function_name):
+    """
+    Check that pyarrow, an optional dependency, is installed
+    :param function_name: the name of the function that requires it, for the error message
+    :return: /
+    :raise ImportError: if pyarrow is not installed
+    """
+
+    if pa is None or pq is None:
+        raise ImportError("{0}() requires the optional dependency pyarrow, which is not installed".format(function_name))
+
+
+def get_month_array(index):
+    """
+    Return the "%Y-%m" month of each date, in local time, dictionary-encoded
+    :param index: a pandas DatetimeIndex
+    :return: a pyarrow.DictionaryArray
+    """
+
+    if index.tz is not None:
+        index = index.tz_localize(None)
+
+    months = index.values.astype('datetime64[M]').astype(np.int64)
+    if len(months) == 0:
+        return pa.DictionaryArray.from_arrays(pa.array([], type=pa.int32()), pa.array([], type=pa.string()))
+
+    first_month = months.min()
+    codes = (months - first_month).astype(np.int32)
+    dictionary = np.arange(first_month, months.max() + 1).astype('datetime64[M]').astype(str)
+
+    return pa.DictionaryArray.from_arrays(codes, dictionary.tolist())
+
+
+def get_constant_dictionary_array(value, length):
+    """
+    Return an array repeating the same string, dictionary-encoded
+    :param value: a string
+    :param length: an int
+    :return: a pyarrow.DictionaryArray
+    """
+
+    return pa.DictionaryArray.from_arrays(np.zeros(length, dtype=np.int32), [value])
@@ -0,0 +1,234 @@
+__author__ = 'Olivier Van Cutsem'
+
+import numpy as np
+import pandas as pd
+
+from .rate_structure import ChargeType
+from .tariff_structure import TariffBlockIndex
+from .calendar_structure import BillingCycleCalendar
+from .bill_structure import Bill
+
+# --------------- STREAMING BILLING --------------- #
+
+
+class BillAccumulator(object):
+    """
+    This class computes the bill of a meter incrementally, as its data are received in chunks (e.g. hourly or daily),
+    so that the bill-to-date is available after each chunk without billing the past data again.
+
+    The accumulator keeps, for each billing cycle:
+     - the running energy and cost of each energy tariff block, the tiers of the BlockRate being applied on the running
+     energy
+     - the first date of the data of each fixed tariff block, the number of days being counted up to the last data
+     - the running maximum demand of each demand period, with its date, in a Bill.
+     The last data points of each chunk are kept for the rolling demand windows overlapping the next chunk.
+
+    The chunks must be sorted and received in order. Data that are not after the last data already received are
+    rejected and counted by nb_rejected. The state of the accumulator can be saved with get_state() and restored with from_state().
+    """
+
+    def __init__(self, rate_manager, column_data=None, billing_cycles=None):
+        """
+        Constructor
+        :param rate_manager: an ElectricityRateManager
+        :param column_data: [optional] the label of the column containing the energy consumption values, if the
+        chunks are dataframes with several columns
+        :param billing_cycles: [optional] a BillingCycleCalendar, the natural months by default
+        """
+
+        self.rate_manager = rate_manager
+        self.column_data = column_data
+
+        if billing_cycles is None:
+            billing_cycles = BillingCycleCalendar()
+        self.billing_cycles = billing_cycles
+
+        self.__type_tariffs_map = rate_manager.get_tariff_types()
+
+        self.__bill = Bill([], self.__type_tariffs_map)
+        self.__block_cycles = {}  # block and cycle key -> [first date (ns), running determinant, running cost]
+        self.__last_date = None  # the last date received, in ns
+        self.__tail = None  # the last data points received, as a pandas Series
+        self.__nb_rejected = 0  # the number of data points rejected, not being after the last date received
+
+    def update(self, chunk):
+        """
+        Add a chunk of data to the bill
+        :param chunk: a pandas dataframe or Series containing energy consumption (in Wh), with a sorted DatetimeIndex
+        :return: the Bill to date. The data points that are not after the last date received are not billed, and are
+        counted by nb_rejected
+        """
+
+        data = self.__get_series(chunk)
+
+        if self.__last_date is not None:
+            new_data = data.index.asi8 > self.__last_date
+            if not new_data.all():
+                self.__nb_rejected += int((~new_data).sum())
+                data = data[new_data]
+
+        if len(data) == 0:
+            return self.__bill
+
+        # The demand windows of the first data points span the last data points of the previous chunk
+        data_demand = data
+        if self.__tail is not None and len(self.__tail) > 0:
+            data_demand = pd.concat([self.__tail, data])
+
+        tariff_bills = []
+        tail_duration = 0
+        for label, charge_type in self.__type_tariffs_map.items():
+            if charge_type == ChargeType.DEMAND:
+                for tariff_block in self.rate_manager.get_tariff_struct_for_data(label, data_demand.index):
+                    tariff_bills.append((label, tariff_block.compute_bill(data_demand, None, self.billing_cycles)))
+                    tail_duration = max(tail_duration, tariff_block.demand_window.value)
+            else:
+                for tariff_block in self.rate_manager.get_tariff_struct_for_data(label, data.index):
+                    tariff_bills.append((label, self.__update_block_cycles(label, charge_type, tariff_block, data)))
+
+        cycle_labels, _ = self.billing_cycles.get_cycle_bounds(data_demand.index)
+
+        # The demand lines of the data of the previous chunk are merged again, which doesn't change their maximum
+        chunk_bill = Bill.from_tariff_bills(cycle_labels, self.__type_tariffs_map, tariff_bills, data.index.tz)
+        self.__bill = Bill.concatenate([self.__bill, chunk_bill]).merge()
+
+        self.__last_date = int(data.index.asi8[-1])
+        self.__tail = data_demand[data_demand.index.asi8 > self.__last_date - tail_duration]
+
+        return self.__bill
+
+    def __update_block_cycles(self, label, charge_type, tariff_block, data):
+        """
+        Compute the increase of the bill of a fixed or energy tariff block due to the data of a chunk
+        :return: a dict formatted as the output of TariffBase.compute_bill()
+        """
+
+        ret = {}
+
+        data, cycle_labels, bounds = tariff_block.get_cycles_in_window(data, self.billing_cycles)
+
+        for i, cycle_label in enumerate(cycle_labels):
+            if bounds[i] == bounds[i+1]:
+                continue
+
+            data_cycle = data.iloc[bounds[i]:bounds[i+1]]
+
+            key = self.get_block_cycle_key(label, tariff_block, cycle_label)
+            (first_date, determinant, cost) = self.__block_cycles.get(key, (int(data_cycle.index.asi8[0]), 0.0, 0.0))
+
+            if charge_type == ChargeType.FIXED:
+                # The number of days goes from the first data of the cycle to the last one
+                dates = pd.DatetimeIndex(np.array([first_date, data_cycle.index.asi8[-1]]).view('datetime64[ns]'))
+                if data_cycle.index.tz is not None:
+                    dates = dates.tz_localize('UTC').tz_convert(data_cycle.index.tz)
+                (new_determinant, new_cost) = tariff_block.compute_monthly_bill(pd.DataFrame(index=dates))
+            else:
+                (energy, energy_cost) = tariff_block.compute_monthly_bill(data_cycle, None, determinant)
+                (new_determinant, new_cost) = (determinant + energy, cost + energy_cost)
+
+            self.__block_cycles[key] = (first_date, float(new_determinant), float(new_cost))
+            ret[cycle_label] = (new_determinant - determinant, new_cost - cost)
+
+        return ret
+
+    def __get_series(self, chunk):
+        """
+        Get the consumption values of a chunk as a pandas Series
+        """
+
+        if isinstance(chunk, pd.DataFrame):
+            if self.column_data is not None:
+                chunk = chunk.loc[:, self.column_data]
+            else:
+                chunk = chunk.iloc[:, 0]
+
+        return chunk.astype(np.float64)
+
+    @staticmethod
+    def get_block_cycle_key(label, tariff_block, cycle_label):
+        """
+        Identify a tariff block and a billing cycle in the state of the accumulator
+        :return: a string
+        """
+
+        return '{0}|{1}|{2}|{3}'.format(label,
+                                        TariffBlockIndex.to_epoch_ns(tariff_block.startdate),
+                                        TariffBlockIndex.to_epoch_ns(tariff_block.enddate),
+                                        cycle_label)
+
+    @property
+    def bill(self):
+        """
+        GETTER of the bill to date
+        :return: a Bill
+        """
+
+        return self.__bill
+
+    @property
+    def last_date(self):
+        """
+        GETTER of the last date received
+        :return: a pandas Timestamp, or None if no data has been received
+        """
+
+        if self.__last_date is None:
+            return None
+
+        last_date = pd.Timestamp(self.__last_date)
+        if self.__bill.tz is not None:
+            last_date = last_date.tz_localize('UTC').tz_convert(self.__bill.tz)
+
+        return last_date
+
+    @property
+    def nb_rejected(self):
+        """
+        GETTER of the number of data points rejected by update() since the first chunk
+        :return: an int
+        """
+
+        return self.__nb_rejected
+
+    def get_state(self):
+        """
+        Return the state of the accumulator as plain python objects (lists, strings, numbers), e.g. to be saved in JSON
+        between two chunks
+        :return: a dict, see from_state()
+        """
+
+        tail = {'dates': [], 'values': []}
+        if self.__tail is not None:
+            tail = {'dates': self.__tail.index.asi8.tolist(),
+                    'values': self.__tail.values.tolist()}
+
+        return {'bill': self.__bill.get_state(),
+                'block_cycles': {key: list(v) for key, v in self.__block_cycles.items()},
+                'last_date': self.__last_date,
+                'nb_rejected': self.__nb_rejected,
+                'tail': tail}
+
+    @classmethod
+    def from_state(cls, rate_manager, state, column_data=None, billing_cycles=None):
+        """
+        Restore an accumulator from the output of get_state()
+        :param rate_manager: an ElectricityRateManager, with the tariffs the state was computed with
+        :param state: a dict, as returned by get_state()
+        :param column_data: [optional] see the constructor
+        :param billing_cycles: [optional] see the constructor
+        :return: a BillAccumulator
+        """
+
+        accumulator = cls(rate_manager, column_data, billing_cycles)
+        accumulator.__bill = Bill.from_state(state['bill'], accumulator.__type_tariffs_map)
+        accumulator.__block_cycles = {key: tuple(v) for key, v in state['block_cycles'].items()}
+        accumulator.__last_date = state['last_date']
+        accumulator.__nb_rejected = state.get('nb_rejected', 0)
+
+        tail = state['tail']
+        dates = pd.DatetimeIndex(np.asarray(tail['dates'], dtype=np.int64).view('datetime64[ns]'))
+        if accumulator.__bill.tz is not None:
+            dates = dates.tz_localize('UTC').tz_convert(accumulator.__bill.tz)
+        accumulator.__tail = pd.Series(np.asarray(tail['values'], dtype=np.float64), index=dates)
+
+        return accumulator
@@ -0,0 +1,499 @@
+__author__ = 'Olivier Van Cutsem'
+
+import numpy as np
+import pandas as pd
+
+from .rate_structure import ChargeType
+
+# --------------- BILL structure --------------- #
+
+
+def get_line_dtype(mask_words):
+    """
+    Return the dtype of the lines of a Bill whose daily masks are stored on mask_words words of 64 bits
+    :param mask_words: an int
+    :return: a numpy dtype
+    """
+
+    return np.dtype([('cycle', np.int32),
+                     ('label', np.int16),
+                     ('charge_type', np.int8),
+                     ('determinant', np.float64),
+                     ('cost', np.float64),
+                     ('price', np.float64),
+                     ('peak_date', 'datetime64[ns]'),
+                     ('period_mask', np.uint64, (mask_words,)),
+                     ('period_slots', np.uint16)])
+
+
+
+class Bill(object):
+    """
+    This class stores an electricity bill as a numpy record array, one line per (billing cycle, tariff label) and, for
+    the demand charges, per demand period:
+     - cycle: the position of the billing cycle in 'cycles'
+     - label: the position of the tariff label in 'labels'
+     - charge_type: the position of the ChargeType of the label in CHARGE_TYPES
+     - determinant: the metric the cost depends on, i.e. the number of days (fixed), the energy (energy) or the maximum
+     demand (demand)
+     - cost: the cost, in $
+     - price: the price of the demand period, NaN for the other charges
+     - peak_date: the date of the maximum demand, in ns since epoch (UTC if the bill has a timezone), NaT otherwise
+     - period_mask: the daily mask of the demand period, as a bitmask of MASK_WORDS x 64 bits (128 slots). The bills
+     with finer daily masks (e.g. 5 minutes slots) have wider lines, see get_line_dtype()
+     - period_slots: the number of slots in the daily mask
+
+    The lines of a same (cycle, label, period) are merged with a hash-keyed grouping: sum of the fixed and energy
+    charges, maximum of the demand charges.
+    The nested dictionaries returned by ElectricityRateManager.compute_bill() are available with to_dict().
+    """
+
+    CHARGE_TYPES = [ChargeType.FIXED, ChargeType.ENERGY, ChargeType.DEMAND]
+
+    MASK_WORDS = 2
+
+    LINE_DTYPE = get_line_dtype(MASK_WORDS)
+
+    def __init__(self, cycles, type_tariffs_map, lines=None, tz=None):
+        """
+        Constructor
+        :param cycles: a list of string, the labels of the billing cycles
+        :param type_tariffs_map: a dict mapping each tariff label to its ChargeType
+        :param lines: [optional] a numpy array of LINE_DTYPE, or of a wider dtype of get_line_dtype()
+        :param tz: [optional] the timezone of the peak dates
+        """
+
+        self.cycles = list(cycles)
+        self.labels = list(type_tariffs_map.keys())
+        self.type_tariffs_map = type_tariffs_map
+        self.tz = tz
+
+        if lines is None:
+            lines = np.zeros(0, dtype=self.LINE_DTYPE)
+        self.lines = lines
+
+    @classmethod
+    def from_tariff_bills(cls, cycles, type_tariffs_map, tariff_bills, tz=None):
+        """
+        Build a bill from the outputs of TariffBase.compute_bill(), merging the lines of the same (cycle, label, period)
+        :param cycles: a list of string, the labels of the billing cycles
+        :param type_tariffs_map: a dict mapping each tariff label to its ChargeType
+        :param tariff_bills: a list of tuples (tariff label, output of TariffBase.compute_bill()), in the order of the
+        tariff blocks
+        :param tz: [optional] the timezone of the peak dates
+        :return: a Bill
+        """
+
+        bill = cls(cycles, type_tariffs_map, tz=tz)
+
+        cycle_pos = {cycle_label: i for i, cycle_label in enumerate(bill.cycles)}
+        label_pos = {label: i for i, label in enumerate(bill.labels)}
+
+        rows = []
+        for (label, cost_per_cycle) in tariff_bills:
+            charge_type = type_tariffs_map[label]
+            for cycle_label, bill_data in cost_per_cycle.items():
+                rows.extend(bill.__get_rows(cycle_pos[cycle_label], label_pos[label], charge_type, bill_data))
+
+        # The masks are encoded once the longest one is known
+        mask_words = cls.get_mask_words(max([len(row[7]) for row in rows], default=0))
+        rows = [row[:7] + (cls.encode_mask(row[7], mask_words),) + row[8:] for row in rows]
+
+        bill.lines = np.array(rows, dtype=get_line_dtype(mask_words))
+
+        return bill.merge()
+
+    @classmethod
+    def from_dict(cls, bill_struct, type_tariffs_map, tz=None):
+        """
+        Build a bill from the dictionary returned by ElectricityRateManager.compute_bill()
+        :param bill_struct: a dict, detailed per billing cycle or not. If not, the bill has a single cycle labelled
+        'total'
+        :param type_tariffs_map: a dict mapping each tariff label to its ChargeType
+        :param tz: [optional] the timezone of the peak dates, found from the dates if not given
+        :return: a Bill
+        """
+
+        first_keys = list(bill_struct.keys())
+        if len(first_keys) > 0 and first_keys[0] in type_tariffs_map:
+            bill_struct = {'total': bill_struct}
+
+        tariff_bills = []
+        for cycle_label, bill_per_label in bill_struct.items():
+            for label, bill_data in bill_per_label.items():
+                tariff_bills.append((label, {cycle_label: bill_data}))
+
+                if tz is None and type_tariffs_map[label] == ChargeType.DEMAND:
+                    for data_demand in bill_data.values():
+                        tz = getattr(data_demand['max-demand-date'], 'tzinfo', None)
+                        break
+
+        return cls.from_tariff_bills(list(bill_struct.keys()), type_tariffs_map, tariff_bills, tz)
+
+    @classmethod
+    def concatenate(cls, bills):
+        """
+        Put the lines of several bills together, without merging them (see merge())
+        :param bills: a list of Bill, with the same tariff labels
+        :return: a Bill, whose cycles are the cycles of all the bills, in order of appearance
+        """
+
+        cycles = []
+        cycle_pos = {}
+        all_lines = []
+        tz = None
+
+        mask_words = max(bill.lines.dtype['period_mask'].shape[0] for bill in bills)
+
+        for bill in bills:
+            for cycle_label in bill.cycles:
+                if cycle_label not in cycle_pos:
+                    cycle_pos[cycle_label] = len(cycles)
+                    cycles.append(cycle_label)
+
+            lines = cls.widen_lines(bill.lines, mask_words)
+            remap = np.array([cycle_pos[cycle_label] for cycle_label in bill.cycles], dtype=np.int32)
+            if len(lines) > 0:
+                lines['cycle'] = remap[lines['cycle']]
+            all_lines.append(lines)
+
+            if tz is None:
+                tz = bill.tz
+
+        return cls(cycles, bills[0].type_tariffs_map, np.concatenate(all_lines), tz)
+
+    def __get_rows(self, cycle, label, charge_type, bill_data):
+
+        charge_code = self.CHARGE_TYPES.index(charge_type)
+
+        if charge_type != ChargeType.DEMAND:
+            (determinant, cost) = bill_data
+            return [(cycle, label, charge_code, determinant, cost, np.nan, np.datetime64('NaT'), [], 0)]
+
+        rows = []
+        for price, data_demand in bill_data.items():
+            mask = data_demand['mask']
+            peak_date = pd.Timestamp(data_demand['max-demand-date'])
+            if peak_date.tzinfo is not None:
+                peak_date = peak_date.tz_convert('UTC').tz_localize(None)
+
+            cost = data_demand.get('cost', price * data_demand['max-demand'])
+            rows.append((cycle, label, charge_code, data_demand['max-demand'], cost, price,
+                         peak_date.to_datetime64(), mask, len(mask)))
+
+        return rows
+
+    # --- Merges
+
+    def merge(self, ignore_cycles=False):
+        """
+        Merge the lines of the same (cycle, label, period): the fixed and energy charges are summed, and the demand
+        line with the highest maximum demand is kept (the first one in case of a tie)
+        :param ignore_cycles: [optional] if True, the lines of all the cycles are merged
+        :return: a Bill
+        """
+
+        lines = self.lines
+        cycles = lines['cycle'] if not ignore_cycles else np.zeros(len(lines), dtype=np.int32)
+
+        is_demand = lines['charge_type'] == self.CHARGE_TYPES.index(ChargeType.DEMAND)
+        merged = []
+        positions = []
+
+        # Sum of the fixed and energy charges
+        pos = np.flatnonzero(~is_demand)
+        if len(pos) > 0:
+            order = pos[np.lexsort((pos, lines['label'][pos], cycles[pos]))]
+            starts = self.__get_group_starts((cycles[order], lines['label'][order]))
+
+            summed = lines[order[starts]].copy()
+            summed['determinant'] = np.add.reduceat(lines['determinant'][order], starts)
+            summed['cost'] = np.add.reduceat(lines['cost'][order], starts)
+            merged.append(summed)
+            positions.append(order[starts])
+
+        # Maximum of the demand charges
+        pos = np.flatnonzero(is_demand)
+        if len(pos) > 0:
+            masks = lines['period_mask'][pos]
+            mask_keys = tuple(masks[:, w] for w in reversed(range(masks.shape[1])))
+            order = pos[np.lexsort((pos, -lines['determinant'][pos], lines['period_slots'][pos]) + mask_keys +
+                                   (lines['label'][pos], cycles[pos]))]
+            masks = lines['period_mask'][order]
+            starts = self.__get_group_starts((cycles[order], lines['label'][order], lines['period_slots'][order]) +
+                                             tuple(masks[:, w] for w in range(masks.shape[1])))
+            merged.append(lines[order[starts]].copy())
+            positions.append(order[starts])
+
+        # The merged lines are sorted by cycle and label, and then by the position of the line they were taken from
+        if len(merged) > 0:
+            lines = np.concatenate(merged)
+            positions = np.concatenate(positions)
+            lines = lines[np.lexsort((positions, lines['label'], cycles[positions]))]
+
+        cycle_labels = self.cycles
+        if ignore_cycles:
+            lines['cycle'] = 0
+            cycle_labels = ['total']
+
+        return Bill(cycle_labels, self.type_tariffs_map, lines, self.tz)
+
+    def aggregate(self):
+        """
+        Merge all the billing cycles into one, labelled 'total'
+        :return: a Bill
+        """
+
+        return self.merge(ignore_cycles=True)
+
+    @staticmethod
+    def __get_group_starts(sorted_keys):
+
+        new_group = np.zeros(len(sorted_keys[0]), dtype=bool)
+        new_group[0] = True
+        for key in sorted_keys:
+            new_group[1:] |= key[1:] != key[:-1]
+
+        return np.flatnonzero(new_group)
+
+    # --- Totals
+
+    def get_total_cost(self):
+        """
+        :return: a float, the total cost of the bill, in $
+        """
+
+        return float(self.lines['cost'].sum())
+
+    def get_cost_per_label(self):
+        """
+        :return: a dict mapping each tariff label to its cost, in $
+        """
+
+        costs = np.bincount(self.lines['label'], weights=self.lines['cost'], minlength=len(self.labels))
+
+        return {label: float(costs[i]) for i, label in enumerate(self.labels)}
+
+    def get_cost_per_charge_type(self):
+        """
+        :return: a dict mapping each ChargeType to its cost, in $
+        """
+
+        costs = np.bincount(self.lines['charge_type'], weights=self.lines['cost'], minlength=len(self.CHARGE_TYPES))
+
+        return {charge_type: float(costs[i]) for i, charge_type in enumerate(self.CHARGE_TYPES)}
+
+    def get_cost_per_cycle(self):
+        """
+        :return: a dict mapping each billing cycle to its cost, in $
+        """
+
+        costs = np.bincount(self.lines['cycle'], weights=self.lines['cost'], minlength=len(self.cycles))
+
+        return {cycle_label: float(costs[i]) for i, cycle_label in enumerate(self.cycles)}
+
+    # --- Conversions
+
+    def to_frame(self):
+        """
+        Return the lines of the bill as a pandas dataframe, one row per line
+        :return: a pandas dataframe
+        """
+
+        lines = self.lines
+
+        peak_dates = pd.DatetimeIndex(lines['peak_date'])
+        if self.tz is not None:
+            peak_dates = peak_dates.tz_localize('UTC').tz_convert(self.tz)
+
+        data = {'cycle': np.asarray(self.cycles, dtype=object)[lines['cycle']] if len(lines) > 0 else [],
+                'label': np.asarray(self.labels, dtype=object)[lines['label']] if len(lines) > 0 else [],
+                'charge_type': [self.CHARGE_TYPES[c].name for c in lines['charge_type']],
+                'determinant': lines['determinant'],
+                'cost': lines['cost'],
+                'price': lines['price'],
+                'peak_date': peak_dates,
+                'period_mask': [self.get_mask_string(m, n) for m, n in zip(lines['period_mask'], lines['period_slots'])]}
+
+        return pd.DataFrame(data=data)
+
+    def to_dict(self, monthly_detailed=True):
+        """
+        Return the bill in the format of ElectricityRateManager.compute_bill(). The demand charges are keyed by price,
+        each entry also giving its 'cost': the demand periods of a same label sharing a price (e.g. in two tariff blocks)
+        are merged into one entry, whose cost is the sum of their costs and whose 'max-demand' is the highest of them
+        :param monthly_detailed: [optional] if False, the billing cycles are aggregated
+        :return: a dict
+        """
+
+        if not monthly_detailed:
+            return self.aggregate().to_dict()['total']
+
+        ret = {}
+        for cycle_label in self.cycles:
+            ret[cycle_label] = {}
+            for label in self.labels:
+                if self.type_tariffs_map[label] == ChargeType.DEMAND:
+                    ret[cycle_label][label] = {}  # a dict of price -> (max, cost)
+                else:
+                    ret[cycle_label][label] = (0, 0)  # a tuple
+
+        for line in self.lines:
+            cycle_label = self.cycles[line['cycle']]
+            label = self.labels[line['label']]
+
+            if self.CHARGE_TYPES[line['charge_type']] != ChargeType.DEMAND:
+                ret[cycle_label][label] = (float(line['determinant']), float(line['cost']))
+            else:
+                peak_date = pd.Timestamp(line['peak_date'])
+                if self.tz is not None:
+                    peak_date = peak_date.tz_localize('UTC').tz_convert(self.tz)
+
+                data_demand = {'mask': self.decode_mask(line['period_mask'], line['period_slots']),
+                               'max-demand': float(line['determinant']),
+                               'max-demand-date': peak_date.to_pydatetime(),
+                               'cost': float(line['cost'])}
+
+                price = float(line['price'])
+                existing = ret[cycle_label][label].get(price)
+                if existing is not None:  # Another period with the same price: merged into one entry
+                    data_demand = self.__merge_demand_entries(existing, data_demand)
+                ret[cycle_label][label][price] = data_demand
+
+        return ret
+
+    @staticmethod
+    def __merge_demand_entries(data_a, data_b):
+        """
+        Merge the entries of to_dict() of two demand periods with the same price: the costs are summed, the maximum
+        demand (and its date) is the highest one, and the mask covers both periods
+        """
+
+        ret = dict(data_a if data_a['max-demand'] >= data_b['max-demand'] else data_b)
+        ret['cost'] = data_a['cost'] + data_b['cost']
+        if len(data_a['mask']) == len(data_b['mask']):
+            ret['mask'] = [a or b for a, b in zip(data_a['mask'], data_b['mask'])]
+
+        return ret
+
+    def get_state(self):
+        """
+        Return the content of the bill as plain python objects (lists, strings, numbers), e.g. to be saved in JSON
+        :return: a dict, see from_state()
+        """
+
+        lines = self.lines
+
+        return {'cycles': list(self.cycles),
+                'tz': str(self.tz) if self.tz is not None else None,
+                'lines': {'cycle': lines['cycle'].tolist(),
+                          'label': [self.labels[i] for i in lines['label']],
+                          'determinant': lines['determinant'].tolist(),
+                          'cost': lines['cost'].tolist(),
+                          'price': lines['price'].tolist(),
+                          'peak_date': lines['peak_date'].view(np.int64).tolist(),
+                          'period_mask': lines['period_mask'].tolist(),
+                          'period_slots': lines['period_slots'].tolist()}}
+
+    @classmethod
+    def from_state(cls, state, type_tariffs_map):
+        """
+        Build a bill from the output of get_state()
+        :param state: a dict, as returned by get_state()
+        :param type_tariffs_map: a dict mapping each tariff label to its ChargeType
+        :return: a Bill
+        """
+
+        bill = cls(state['cycles'], type_tariffs_map, tz=state['tz'])
+
+        data = state['lines']
+        masks = np.asarray(data['period_mask'], dtype=np.uint64)
+        mask_words = masks.shape[1] if len(masks) > 0 else cls.MASK_WORDS
+        lines = np.zeros(len(data['cycle']), dtype=get_line_dtype(mask_words))
+
+        label_pos = {label: i for i, label in enumerate(bill.labels)}
+        lines['label'] = [label_pos[label] for label in data['label']]
+        lines['charge_type'] = [cls.CHARGE_TYPES.index(type_tariffs_map[label]) for label in data['label']]
+
+        for field in ['cycle', 'determinant', 'cost', 'price', 'period_slots']:
+            lines[field] = data[field]
+        lines['peak_date'] = np.asarray(data['peak_date'], dtype=np.int64).view('datetime64[ns]')
+        if len(lines) > 0:
+            lines['period_mask'] = masks
+
+        bill.lines = lines
+
+        return bill
+
+    @classmethod
+    def encode_mask(cls, mask, mask_words=MASK_WORDS):
+        """
+        Encode a daily mask as a bitmask
+        :param mask: a list of bool
+        :param mask_words: [optional] the number of words of 64 bits of the bitmask, widened if the mask is longer
+        :return: a tuple of uint64, of length max(mask_words, get_mask_words(len(mask)))
+        """
+
+        bits = np.zeros(64 * max(mask_words, cls.get_mask_words(len(mask))), dtype=bool)
+        bits[:len(mask)] = mask
+        words = np.packbits(bits, bitorder='little').view('<u8')
+
+        return tuple(words)
+
+    @classmethod
+    def get_mask_words(cls, period_slots):
+        """
+        :return: the number of words of 64 bits storing a daily mask of period_slots slots, at least MASK_WORDS
+        """
+
+        return max(cls.MASK_WORDS, -(-int(period_slots) // 64))
+
+    @staticmethod
+    def widen_lines(lines, mask_words):
+        """
+        Return a copy of some lines, whose masks are stored on at least mask_words words of 64 bits
+        :param lines: a numpy array of a dtype of get_line_dtype()
+        :param mask_words: an int
+        :return: a numpy array
+        """
+
+        current_words = lines.dtype['period_mask'].shape[0]
+        if current_words >= mask_words:
+            return lines.copy()
+
+        ret = np.zeros(len(lines), dtype=get_line_dtype(mask_words))
+        for name in lines.dtype.names:
+            if name == 'period_mask':
+                ret[name][:, :current_words] = lines[name]
+            else:
+                ret[name] = lines[name]
+
+        return ret
+
+    @classmethod
+    def decode_mask(cls, period_mask, period_slots):
+        """
+        Decode a bitmask into a daily mask
+        :param period_mask: an array of uint64
+        :param period_slots: the number of slots in the daily mask
+        :return: a list of bool
+        """
+
+        words = np.asarray(period_mask, dtype='<u8')
+        bits = np.unpackbits(words.view(np.uint8), bitorder='little').astype(bool)
+
+        return bits[:int(period_slots)].tolist()
+
+    @classmethod
+    def get_mask_string(cls, period_mask, period_slots):
+        """
+        :return: the daily mask as a string of 0 and 1, e.g. '000011110000'
+        """
+
+        return ''.join('1' if b else '0' for b in cls.decode_mask(period_mask, period_slots))
+
+    def __len__(self):
+        return len(self.lines)
+
+    def __repr__(self):
+        return 'Bill({0} cycles, {1} lines, {2:.2f} $)'.format(len(self.cycles), len(self.lines), self.get_total_cost())
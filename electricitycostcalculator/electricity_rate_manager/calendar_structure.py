@@ -0,0 +1,579 @@
+__author__ = 'Olivier Van Cutsem'
+
+import warnings
+import weakref
+from collections import OrderedDict
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+from . import instrumentation
+
+# --------------- Calendar structures --------------- #
+
+
+class HolidayCalendar(object):
+    """
+    This structure maps each day of the calendar to a "day type", used to select the daily rates of a tariff:
+     - from 0 (monday) to 6 (sunday), following datetime.weekday()
+     - HOLIDAY, for the holidays of the country/state the calendar is built for
+
+    The day types of a whole year are computed once, as a uint8 array indexed by the day of the year, and kept in a
+    bounded LRU cache.
+    """
+
+    HOLIDAY = 7
+
+    DEFAULT_MAX_CACHED_YEARS = 32
+
+    def __init__(self, country='US', state=None, max_cached_years=DEFAULT_MAX_CACHED_YEARS):
+        """
+        Constructor
+        :param country: the country code, as understood by the 'holidays' package
+        :param state: [optional] the state/province code, as understood by the 'holidays' package
+        :param max_cached_years: [optional] the maximum number of years kept in memory
+        """
+
+        self.country = country
+        self.state = state
+        self.max_cached_years = max_cached_years
+
+        self.__years = OrderedDict()  # year -> uint8 array of day types
+
+    def get_year_day_types(self, year):
+        """
+        Return the day types of a whole year
+        :param year: an int
+        :return: a uint8 numpy array, whose i-th element is the day type of the (i+1)-th day of the year
+        """
+
+        year = int(year)
+
+        if year in self.__years:
+            self.__years.move_to_end(year)
+            return self.__years[year]
+
+        t_start = instrumentation.start()
+        instrumentation.count('holiday_year_miss')
+
+        import holidays  # loaded with the first year, as the precompiled tariffs don't need it
+
+        first_day = date(year, 1, 1)
+        nb_days = (date(year + 1, 1, 1) - first_day).days
+
+        # The weekday of January 1st, then one step per day
+        day_types = ((first_day.weekday() + np.arange(nb_days)) % 7).astype(np.uint8)
+
+        for holiday_date in holidays.CountryHoliday(self.country, state=self.state, years=[year]).keys():
+            if holiday_date.year == year:
+                day_types[holiday_date.timetuple().tm_yday - 1] = self.HOLIDAY
+
+        day_types.setflags(write=False)
+
+        self.__years[year] = day_types
+        if len(self.__years) > self.max_cached_years:
+            self.__years.popitem(last=False)
+
+        instrumentation.stop(t_start, instrumentation.STAGE_HOLIDAY_LOOKUP)
+
+        return day_types
+
+    def get_day_type(self, date_sel):
+        """
+        Return the day type of a single date
+        :param date_sel: a date or datetime
+        :return: an int, from 0 to HOLIDAY
+        """
+
+        return int(self.get_year_day_types(date_sel.year)[date_sel.timetuple().tm_yday - 1])
+
+    def get_day_types(self, dates):
+        """
+        Vectorized version of get_day_type()
+        :param dates: a pandas DatetimeIndex. If it is timezone-aware, its local dates are used
+        :return: a uint8 numpy array with the same length as 'dates'
+        """
+
+        return CalendarIndex.get(pd.DatetimeIndex(dates)).get_day_types(self)
+
+    def lookup_day_types(self, years, days_of_year):
+        """
+        Return the day types of dates given as (year, day of the year)
+        :param years: an int numpy array
+        :param days_of_year: an int numpy array with the same length as years, from 0 (January 1st)
+        :return: a uint8 numpy array with the same length as years
+        """
+
+        ret = np.empty(len(years), dtype=np.uint8)
+
+        if len(years) == 0:
+            return ret
+
+        first_year = years.min()
+        last_year = years.max()
+        if first_year == last_year:
+            ret[:] = self.get_year_day_types(first_year)[days_of_year]
+        else:
+            for year in range(first_year, last_year + 1):
+                mask_year = years == year
+                if mask_year.any():
+                    ret[mask_year] = self.get_year_day_types(year)[days_of_year[mask_year]]
+
+        return ret
+
+    def is_holiday(self, date_sel):
+        """
+        Check if a date is a holiday in this calendar
+        :param date_sel: a date or datetime
+        :return: a boolean
+        """
+
+        return self.get_day_type(date_sel) == self.HOLIDAY
+
+
+class BillingCycleCalendar(object):
+    """
+    This structure defines the billing cycles of an account, i.e. how the data are split into bills:
+     - by default, the natural months of the calendar, labelled "%Y-%m"
+     - or any sorted list of cycle boundaries (e.g. the meter-read dates), the i-th cycle going from the i-th boundary
+     (included) to the (i+1)-th boundary (excluded). These cycles are labelled by their starting date "%Y-%m-%d", unless
+     labels are given
+
+    The positions of the cycles in the data are found by binary search. The result for the last DatetimeIndex is cached,
+    so that all the tariffs billing the same data share one cycle table.
+    """
+
+    def __init__(self, boundaries=None, labels=None):
+        """
+        Constructor
+        :param boundaries: [optional] a sorted list of datetime, the limits of the billing cycles.
+        If None, the natural months of the calendar are used
+        :param labels: [optional] a list of string, the label of each cycle (one less than the boundaries)
+        :raise ValueError: if the boundaries are not strictly increasing, or if the number of labels doesn't match
+        """
+
+        self.__boundaries = None
+        self.__labels = None
+
+        if boundaries is not None:
+            self.__boundaries = pd.DatetimeIndex(boundaries)
+
+            if not (self.__boundaries.is_monotonic_increasing and self.__boundaries.is_unique):
+                raise ValueError("The boundaries of the billing cycles must be strictly increasing")
+
+            if labels is None:
+                labels = list(self.__boundaries[:-1].strftime("%Y-%m-%d"))
+            self.__labels = list(labels)
+
+            if len(self.__labels) != max(len(self.__boundaries) - 1, 0):
+                raise ValueError("{0} labels are given for {1} billing cycles".format(len(self.__labels),
+                                                                                  max(len(self.__boundaries) - 1, 0)))
+
+        # Cached cycle table: (index, labels, bounds)
+        self.__cached_table = None
+
+    def __getstate__(self):
+        # The cycle table of the last dates is not pickled, e.g. when the calendar is sent to other processes
+        state = self.__dict__.copy()
+        state['_BillingCycleCalendar__cached_table'] = None
+        return state
+
+    @classmethod
+    def from_read_day(cls, start_date, end_date, read_day):
+        """
+        Build the billing cycles of a meter read on the same day of each month, e.g. from the 17th to the 16th.
+        If the month is shorter than read_day, the meter is read on its last day.
+
+        :param start_date: a datetime, the first cycle contains this date
+        :param end_date: a datetime, the last cycle contains this date
+        :param read_day: an int, the day of the month starting each cycle
+        :return: a BillingCycleCalendar
+        """
+
+        start_date = pd.Timestamp(start_date)
+        end_date = pd.Timestamp(end_date)
+
+        # Start from the month before, to be sure the first cycle contains start_date
+        month_starts = pd.date_range(pd.Timestamp(year=start_date.year, month=start_date.month, day=1) - pd.DateOffset(months=1),
+                                     pd.Timestamp(year=end_date.year, month=end_date.month, day=1) + pd.DateOffset(months=1),
+                                     freq='MS')
+        read_days = np.minimum(read_day, np.asarray(month_starts.days_in_month)) - 1
+        boundaries = month_starts + pd.to_timedelta(read_days, unit='D')
+
+        if start_date.tzinfo is not None:
+            boundaries = boundaries.tz_localize(start_date.tzinfo)
+            start_date = start_date.tz_convert(boundaries.tz)
+            end_date = end_date.tz_convert(boundaries.tz)
+
+        first = boundaries.searchsorted(start_date, side='right') - 1
+        last = boundaries.searchsorted(end_date, side='right')
+
+        return cls(boundaries[first:last+1])
+
+    @property
+    def boundaries(self):
+        """
+        GETTER of the cycle boundaries
+        :return: a pandas DatetimeIndex, or None for the natural months
+        """
+
+        return self.__boundaries
+
+    @property
+    def labels(self):
+        """
+        GETTER of the cycle labels
+        :return: a list of string, or None for the natural months
+        """
+
+        return self.__labels
+
+    def get_cycle_bounds(self, index):
+        """
+        Split a sorted DatetimeIndex into the billing cycles that contain its data, from the cycle of its first date to
+        the cycle of its last date.
+        Data falling out of all the cycles are not part of any of them.
+
+        :param index: a sorted pandas DatetimeIndex
+        :return: a tuple (list, numpy array) -> (labels, bounds), where the data of the i-th cycle is at the positions
+        bounds[i] to bounds[i+1] (excluded)
+        """
+
+        if self.__cached_table is not None and self.__cached_table[0] is index:
+            return self.__cached_table[1], self.__cached_table[2]
+
+        if len(index) == 0:
+            return [], np.zeros(1, dtype=np.int64)
+
+        if self.__boundaries is None:
+            (labels, boundaries) = self.get_month_boundaries(index)
+        else:
+            boundaries = self.__boundaries
+            if index.tz is not None and boundaries.tz is None:
+                boundaries = boundaries.tz_localize(index.tz)
+            elif index.tz is None and boundaries.tz is not None:
+                boundaries = boundaries.tz_localize(None)
+
+            # Only keep the cycles overlapping the data
+            first = max(boundaries.searchsorted(index[0], side='right') - 1, 0)
+            last = min(boundaries.searchsorted(index[-1], side='right'), len(boundaries) - 1)
+
+            labels = self.__labels[first:last]
+            boundaries = boundaries[first:last+1]
+
+        bounds = np.asarray(index.searchsorted(boundaries, side='left'), dtype=np.int64)
+
+        self.__cached_table = (index, labels, bounds)
+
+        return labels, bounds
+
+    @staticmethod
+    def get_month_boundaries(index):
+        """
+        Return the natural months containing the data of a sorted DatetimeIndex
+        :param index: a sorted pandas DatetimeIndex
+        :return: a tuple (list, pandas DatetimeIndex) -> ("%Y-%m" labels, first instants of the months and of the
+        following month)
+        """
+
+        t_s = index[0]
+        t_e = index[-1]
+
+        nb_months = 12 * (t_e.year - t_s.year) + t_e.month - t_s.month + 1
+        first_day = pd.Timestamp(year=t_s.year, month=t_s.month, day=1, tz=index.tz)
+        month_starts = pd.date_range(first_day, periods=nb_months + 1, freq='MS')
+
+        return list(month_starts[:-1].strftime("%Y-%m")), month_starts
+
+
+class CalendarIndex(object):
+    """
+    This structure stores the calendar features of the dates of a DatetimeIndex, in the local (wall clock) time the
+    tariffs are defined in: the month, the year, the day of the year and the minute of the day of each date, as int
+    numpy arrays. The day types (see HolidayCalendar) and the slots of the day of a rate schedule are derived from them
+    on demand, and kept.
+
+    The features are computed once per index, and shared by all the tariff labels, blocks and billing cycles reading
+    the same dates: use CalendarIndex.get(), which is memoized on the numpy array holding the dates. The slices of an
+    index (e.g. the data of a tariff block or of a billing cycle) are views on the same array, and get a slice of the
+    same CalendarIndex. The memo only keeps weak references on the arrays, and at most MAX_CACHED_INDEXES of them.
+    """
+
+    MAX_CACHED_INDEXES = 16
+
+    NS_PER_MINUTE = 60 * 10**9
+    NS_PER_DAY = 24 * 60 * NS_PER_MINUTE
+
+    # (id of the array holding the dates, timezone) -> (weak reference on the array, first and last dates, CalendarIndex)
+    _cached_indexes = OrderedDict()
+
+    def __init__(self, local_dates_ns):
+        """
+        Constructor
+        :param local_dates_ns: an int64 numpy array, the local (wall clock) dates as nanoseconds since the epoch
+        """
+
+        days = local_dates_ns // self.NS_PER_DAY
+        months = days.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+        first_days_of_year = days.astype('datetime64[D]').astype('datetime64[Y]').astype('datetime64[D]').astype(np.int64)
+
+        self.months = (months % 12 + 1).astype(np.int8)
+        self.years = (months // 12 + 1970).astype(np.int32)
+        self.days_of_year = (days - first_days_of_year).astype(np.int16)
+        self.minutes = ((local_dates_ns - days * self.NS_PER_DAY) // self.NS_PER_MINUTE).astype(np.int16)
+
+        self.__day_types = {}  # id of the HolidayCalendar -> (HolidayCalendar, day types)
+        self.__slots = {}  # number of slots in a day -> slots
+
+    @classmethod
+    def get(cls, dates, tz=None):
+        """
+        Return the CalendarIndex of some dates, computed once for all the slices of the same DatetimeIndex
+        :param dates: a pandas DatetimeIndex (naive dates being in local time) or an array of epoch timestamps, in
+        seconds. Other arrays of dates are not memoized
+        :param tz: [optional] the timezone of the tariff, see to_local_datetime_index()
+        :return: a CalendarIndex
+        """
+
+        if not isinstance(dates, pd.DatetimeIndex):
+            return cls(to_local_datetime_index(dates, tz).asi8)
+
+        # The timezone whose wall clock is used
+        if dates.tz is None:
+            tz = None
+        elif tz is None:
+            tz = dates.tz
+
+        dates_ns = dates.asi8
+
+        # The array holding the dates: the index is one of its contiguous slices
+        root = dates_ns
+        while isinstance(root.base, np.ndarray):
+            root = root.base
+
+        if root.ndim != 1 or root.itemsize != 8 or not root.flags.c_contiguous or len(root) == 0 \
+                or dates_ns.strides != (8,):
+            return cls.__from_utc_ns(dates_ns, tz)
+
+        root_ns = root.view(np.int64)
+        offset = (dates_ns.__array_interface__['data'][0] - root.__array_interface__['data'][0]) // 8
+        key = (id(root), str(tz))
+
+        entry = cls._cached_indexes.get(key)
+        if entry is not None and entry[0]() is root and entry[1] == (root_ns[0], root_ns[-1]):
+            cls._cached_indexes.move_to_end(key)
+            instrumentation.count('calendar_cache_hit')
+            return entry[2][offset:offset+len(dates_ns)]
+        instrumentation.count('calendar_cache_miss')
+
+        calendar = cls.__from_utc_ns(root_ns, tz)
+        try:
+            root_ref = weakref.ref(root, lambda _, k=key: cls._cached_indexes.pop(k, None))
+        except TypeError:
+            return calendar[offset:offset+len(dates_ns)]
+
+        cls._cached_indexes[key] = (root_ref, (root_ns[0], root_ns[-1]), calendar)
+        if len(cls._cached_indexes) > cls.MAX_CACHED_INDEXES:
+            cls._cached_indexes.popitem(last=False)
+
+        return calendar[offset:offset+len(dates_ns)]
+
+    @classmethod
+    def __from_utc_ns(cls, dates_ns, tz):
+        """
+        Build the CalendarIndex of dates given as nanoseconds since the epoch, in UTC if tz is given, in local time
+        otherwise
+        """
+
+        t_start = instrumentation.start()
+
+        if tz is not None:
+            dates_ns = pd.DatetimeIndex(dates_ns.view('datetime64[ns]')).tz_localize('UTC').tz_convert(tz).tz_localize(None).asi8
+
+        calendar = cls(np.asarray(dates_ns, dtype=np.int64))
+
+        instrumentation.stop(t_start, instrumentation.STAGE_CALENDAR)
+
+        return calendar
+
+    def __getitem__(self, positions):
+        """
+        Return the CalendarIndex of a slice of the dates, sharing the features already computed
+        :param positions: a slice
+        :return: a CalendarIndex
+        """
+
+        if positions == slice(0, len(self)):
+            return self
+
+        return CalendarSlice(self, positions)
+
+    def __len__(self):
+        return len(self.months)
+
+    def get_day_types(self, holiday_calendar):
+        """
+        Return the day type of each date
+        :param holiday_calendar: a HolidayCalendar
+        :return: a uint8 numpy array
+        """
+
+        entry = self.__day_types.get(id(holiday_calendar))
+        if entry is None or entry[0] is not holiday_calendar:
+            t_start = instrumentation.start()
+            entry = (holiday_calendar, holiday_calendar.lookup_day_types(self.years, self.days_of_year))
+            self.__day_types[id(holiday_calendar)] = entry
+            instrumentation.stop(t_start, instrumentation.STAGE_CALENDAR)
+
+        return entry[1]
+
+    def get_slots(self, nb_slots):
+        """
+        Return the slot of the day of each date, the day being split in nb_slots slots of equal length
+        :param nb_slots: an int
+        :return: an int64 numpy array, from 0 to nb_slots-1
+        """
+
+        if nb_slots not in self.__slots:
+            self.__slots[nb_slots] = (self.minutes.astype(np.int64) * nb_slots) // 1440
+
+        return self.__slots[nb_slots]
+
+
+class CalendarSlice(CalendarIndex):
+    """
+    A slice of a CalendarIndex, whose features are views on the features of the whole CalendarIndex
+    """
+
+    def __init__(self, calendar, positions):
+
+        self.__calendar = calendar
+        self.__positions = positions
+
+        self.months = calendar.months[positions]
+        self.years = calendar.years[positions]
+        self.days_of_year = calendar.days_of_year[positions]
+        self.minutes = calendar.minutes[positions]
+
+    def __getitem__(self, positions):
+
+        (start, stop, _) = positions.indices(len(self))
+        (offset, _, _) = self.__positions.indices(len(self.__calendar))
+
+        return self.__calendar[offset+start:offset+max(start, stop)]
+
+    def get_day_types(self, holiday_calendar):
+        return self.__calendar.get_day_types(holiday_calendar)[self.__positions]
+
+    def get_slots(self, nb_slots):
+        return self.__calendar.get_slots(nb_slots)[self.__positions]
+
+
+# --- Time conversion
+
+
+def to_local_datetime_index(dates, tz=None):
+    """
+    Convert timestamps to a timezone-naive DatetimeIndex expressed in local (wall clock) time, which is the time the
+    tariffs are defined in.
+
+    :param dates: either a pandas DatetimeIndex (naive or timezone-aware), or an array of epoch timestamps in seconds
+    (int or float)
+    :param tz: [optional] the timezone of the tariff (e.g. 'America/Los_Angeles'). Epoch timestamps and timezone-aware
+    dates are converted to the wall clock of this timezone, which handles the DST. If not given, epoch timestamps are
+    read as UTC and timezone-aware dates keep their own wall clock. Naive dates are always taken as local time.
+    :return: a timezone-naive pandas DatetimeIndex
+    """
+
+    if not isinstance(dates, pd.DatetimeIndex):
+        dates = np.asarray(dates)
+        if np.issubdtype(dates.dtype, np.number):
+            dates = pd.to_datetime(dates, unit='s', utc=tz is not None)
+        dates = pd.DatetimeIndex(dates)
+
+    if dates.tz is not None:
+        if tz is not None:
+            dates = dates.tz_convert(tz)
+        dates = dates.tz_localize(None)
+
+    return dates
+
+
+def to_local_datetime64(date_sel):
+    """
+    Convert a single date to a numpy datetime64, expressed in local (wall clock) time like to_local_datetime_index()
+    :param date_sel: a datetime or pandas Timestamp, naive or timezone-aware
+    :return: a numpy datetime64[ns]
+    """
+
+    return np.datetime64(pd.Timestamp(date_sel).tz_localize(None), 'ns')
+
+
+# --- Calendars shared between all the tariffs
+
+# The location of some utilities, identified by their EIA id. The tariffs of any other utility use the
+# DEFAULT_HOLIDAY_CALENDAR (California) with a warning, unless register_utility_calendar() is called or the holiday
+# calendar is given explicitly
+UTILITY_HOLIDAY_CALENDARS = {'14328': ('US', 'CA'),  # Pacific Gas & Electric Co
+                             '17609': ('US', 'CA'),  # Southern California Edison Co
+                             }
+
+DEFAULT_HOLIDAY_CALENDAR = ('US', 'CA')
+
+_holiday_calendars = {}
+
+
+def get_holiday_calendar(country=None, state=None, utility_id=None):
+    """
+    Return the HolidayCalendar of a location, shared between all the callers so that the day types of each year are
+    computed once.
+    If the country is not given, the location is found from the utility id. Only the utilities of
+    UTILITY_HOLIDAY_CALENDARS (or registered with register_utility_calendar()) are known: any other utility falls back
+    to the DEFAULT_HOLIDAY_CALENDAR, the holidays of California, with a warning. Without country nor utility id, the
+    DEFAULT_HOLIDAY_CALENDAR is used.
+
+    :param country: [optional] the country code, as understood by the 'holidays' package
+    :param state: [optional] the state/province code
+    :param utility_id: [optional] the EIA id of the utility, see UTILITY_HOLIDAY_CALENDARS
+    :return: a HolidayCalendar
+    """
+
+    if country is None:
+        if utility_id is None:
+            (country, state) = DEFAULT_HOLIDAY_CALENDAR
+        elif is_known_utility(utility_id):
+            (country, state) = UTILITY_HOLIDAY_CALENDARS[str(utility_id)]
+        else:
+            (country, state) = DEFAULT_HOLIDAY_CALENDAR
+            warnings.warn("The location of the utility {0} is unknown: the holidays of {1} are used. Call "
+                          "register_utility_calendar() to set it".format(utility_id, '-'.join(DEFAULT_HOLIDAY_CALENDAR)),
+                          stacklevel=2)
+
+    key = (country, state)
+    if key not in _holiday_calendars:
+        _holiday_calendars[key] = HolidayCalendar(country, state)
+
+    return _holiday_calendars[key]
+
+
+def is_known_utility(utility_id):
+    """
+    Check if the location of a utility is known, see UTILITY_HOLIDAY_CALENDARS
+    :param utility_id: the EIA id of the utility
+    :return: a boolean
+    """
+
+    return str(utility_id) in UTILITY_HOLIDAY_CALENDARS
+
+
+def register_utility_calendar(utility_id, country, state=None):
+    """
+    Set the location of a utility, to be used by get_holiday_calendar()
+    :param utility_id: the EIA id of the utility
+    :param country: the country code, as understood by the 'holidays' package
+    :param state: [optional] the state/province code
+    :return: /
+    """
+
+    UTILITY_HOLIDAY_CALENDARS[str(utility_id)] = (country, state)
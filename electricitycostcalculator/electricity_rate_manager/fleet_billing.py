@@ -0,0 +1,337 @@
+__author__ = 'Olivier Van Cutsem'
+
+import atexit
+import copy
+import gc
+import os
+import pickle
+import traceback
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import numpy as np
+import pandas as pd
+
+try:
+    from multiprocessing import shared_memory  # python >= 3.8
+except ImportError:
+    shared_memory = None
+
+# --------------- FLEET BILLING --------------- #
+
+# Alignment of the arrays copied in shared memory
+SHM_ALIGNMENT = 64
+
+# Rate managers already loaded by a worker process: tariff key -> (ElectricityRateManager, SharedMemory)
+_worker_rate_managers = {}
+
+# Billing cycles already loaded by a worker process: name of the shared memory block -> BillingCycleCalendar
+_worker_billing_cycles = {}
+
+
+class FleetBillingError(Exception):
+    """
+    The error raised by compute_fleet_bills() when the bill of a job couldn't be computed. The error raised in the worker
+    is given by 'error' (and __cause__)
+    """
+
+    def __init__(self, job_id, error):
+        super(FleetBillingError, self).__init__("The bill of job '{0}' couldn't be computed: {1!r}".format(job_id, error))
+        self.job_id = job_id
+        self.error = error
+
+
+def compute_fleet_bills(jobs, nb_workers=None, max_in_flight=None, monthly_detailed=False, return_bill=False,
+                        billing_cycles=None, on_error='raise'):
+    """
+    Compute the bills of a fleet of meters on a pool of processes, and yield them as they are computed.
+
+    The meter data and the compiled tariffs are handed over to the workers through shared memory instead of being
+    pickled with each job, each job only carrying the name and the layout of the shared memory blocks:
+     - each distinct ElectricityRateManager is serialized once, the pickled payload and its numpy arrays (the compiled
+     rate schedules) being copied in a shared memory block, and each worker loads it once
+     - the billing cycles are serialized once as well, without the cycle table they keep for the last dates they split
+     - the dates and values of each meter are copied in a shared memory block, read by the worker without copy
+
+    At most max_in_flight jobs are submitted at the same time, which bounds the memory used by the meter data.
+    Without multiprocessing.shared_memory (python < 3.8), the data are pickled instead.
+
+    :param jobs: an iterable of tuples (job_id, meter_series, rate_manager), where meter_series is a pandas Series of
+    energy consumption (in Wh) with a sorted DatetimeIndex and rate_manager an ElectricityRateManager.
+    It may be a generator, consumed as the jobs are submitted
+    :param nb_workers: [optional] the number of worker processes, os.cpu_count() by default
+    :param max_in_flight: [optional] the maximum number of jobs submitted and not yielded yet, 4 per worker by default
+    :param monthly_detailed: [optional] see ElectricityRateManager.compute_bill()
+    :param return_bill: [optional] see ElectricityRateManager.compute_bill(). A Bill is sent back from the workers as a
+    few numpy arrays, much lighter than the nested dictionaries
+    :param billing_cycles: [optional] see ElectricityRateManager.compute_bill()
+    :param on_error: [optional] what to do when the bill of a job couldn't be computed:
+     - 'raise' (default): raise a FleetBillingError, after the jobs in flight are done
+     - 'yield': yield the exception raised in the worker instead of the bill, and carry on with the other jobs
+    :return: a generator of tuples (job_id, bill), in order of completion
+    """
+
+    if on_error not in ('raise', 'yield'):
+        raise ValueError("on_error must be 'raise' or 'yield', not {0!r}".format(on_error))
+
+    if nb_workers is None:
+        nb_workers = os.cpu_count() or 1
+
+    if max_in_flight is None:
+        max_in_flight = 4 * nb_workers
+
+    tariffs = {}  # id of the rate manager -> (tariff key, rate manager, shared tariff)
+    in_flight = {}  # future -> (job_id, shared meter data)
+    jobs = iter(jobs)
+
+    shared_cycles = None
+    if billing_cycles is not None:
+        shared_cycles = SharedData(pickle.dumps(billing_cycles), [])
+
+    try:
+        with ProcessPoolExecutor(max_workers=nb_workers) as executor:
+            while True:
+
+                # Fill the queue of jobs
+                while len(in_flight) < max_in_flight:
+                    job = next(jobs, None)
+                    if job is None:
+                        break
+
+                    (job_id, meter_series, rate_manager) = job
+
+                    if id(rate_manager) not in tariffs:
+                        tariffs[id(rate_manager)] = (len(tariffs), rate_manager, share_rate_manager(rate_manager))
+                    (tariff_key, _, shared_tariff) = tariffs[id(rate_manager)]
+
+                    shared_meter = share_meter_data(meter_series)
+                    future = executor.submit(_bill_meter, tariff_key, shared_tariff.descriptor,
+                                             shared_meter.descriptor, monthly_detailed, return_bill,
+                                             shared_cycles.descriptor if shared_cycles is not None else None)
+                    in_flight[future] = (job_id, shared_meter)
+
+                if len(in_flight) == 0:
+                    break
+
+                # Stream the results back as soon as they are computed
+                done, _ = wait(list(in_flight.keys()), return_when=FIRST_COMPLETED)
+                for future in done:
+                    (job_id, shared_meter) = in_flight.pop(future)
+                    shared_meter.release()
+
+                    try:
+                        bill = future.result()
+                    except Exception as e:
+                        if on_error == 'raise':
+                            raise FleetBillingError(job_id, e) from e
+                        bill = e
+
+                    yield job_id, bill
+    finally:
+        for (_, shared_meter) in list(in_flight.values()):
+            shared_meter.release()
+        for (_, _, shared_tariff) in list(tariffs.values()):
+            shared_tariff.release()
+        if shared_cycles is not None:
+            shared_cycles.release()
+
+
+def share_rate_manager(rate_manager):
+    """
+    Serialize an ElectricityRateManager for the workers, the pickled payload and its numpy arrays (out-of-band) being
+    stored in shared memory
+    :param rate_manager: an ElectricityRateManager
+    :return: a SharedData
+    """
+
+    if shared_memory is None:
+        return SharedData(pickle.dumps(rate_manager), [])
+
+    buffers = []
+    payload = pickle.dumps(rate_manager, protocol=5, buffer_callback=buffers.append)
+
+    return SharedData(payload, [b.raw() for b in buffers])
+
+
+def share_meter_data(meter_series):
+    """
+    Store the dates and values of a meter in shared memory
+    :param meter_series: a pandas Series with a DatetimeIndex
+    :return: a SharedData
+    """
+
+    index = pd.DatetimeIndex(meter_series.index)
+
+    dates = np.ascontiguousarray(index.asi8)
+    values = np.ascontiguousarray(meter_series.values, dtype=np.float64)
+
+    return SharedData(pickle.dumps((index.tz, meter_series.name)), [memoryview(dates).cast('B'), memoryview(values).cast('B')])
+
+
+class SharedData(object):
+    """
+    This structure stores a pickled payload and a list of binary buffers, all copied in one shared memory block. Its
+    descriptor, sent to the workers, is only made of the name of the block and the position of each buffer in it.
+    """
+
+    def __init__(self, payload, buffers):
+        """
+        Constructor
+        :param payload: bytes, e.g. a pickled object, copied in shared memory as the first buffer
+        :param buffers: a list of contiguous memoryviews (or bytes-like objects), copied in shared memory
+        """
+
+        self.__shm = None
+
+        buffers = [payload] + list(buffers)
+
+        # Position of each buffer in the shared block
+        layout = []
+        offset = 0
+        for buf in buffers:
+            nbytes = memoryview(buf).nbytes
+            layout.append((offset, nbytes))
+            offset += -(-nbytes // SHM_ALIGNMENT) * SHM_ALIGNMENT
+
+        if shared_memory is not None and offset > 0:
+            self.__shm = shared_memory.SharedMemory(create=True, size=offset)
+            for (pos, nbytes), buf in zip(layout, buffers):
+                self.__shm.buf[pos:pos+nbytes] = memoryview(buf).cast('B')
+            self.descriptor = (self.__shm.name, layout)
+        else:  # no shared memory: the buffers are pickled with the descriptor
+            self.descriptor = (None, [bytes(memoryview(buf).cast('B')) for buf in buffers])
+
+    def release(self):
+        """
+        Free the shared memory block
+        :return: /
+        """
+
+        if self.__shm is not None:
+            self.__shm.close()
+            self.__shm.unlink()
+            self.__shm = None
+
+
+def load_shared_data(descriptor):
+    """
+    Get back, in a worker process, the data of a SharedData
+    :param descriptor: the descriptor of a SharedData
+    :return: a tuple (payload, buffers, shm) where buffers are memoryviews on the shared memory block shm (None
+    without shared memory). shm must be kept open as long as the buffers are used
+    """
+
+    (shm_name, layout) = descriptor
+
+    if shm_name is None:
+        return layout[0], layout[1:], None
+
+    shm = attach_shared_memory(shm_name)
+
+    # The payload is copied: only the buffers are used in place
+    (pos, nbytes) = layout[0]
+    payload = bytes(shm.buf[pos:pos+nbytes])
+
+    return payload, [shm.buf[pos:pos+nbytes] for (pos, nbytes) in layout[1:]], shm
+
+
+def attach_shared_memory(shm_name):
+    """
+    Attach a shared memory block created by the parent process, which remains in charge of freeing it
+    :param shm_name: the name of the block
+    :return: a SharedMemory
+    """
+
+    try:
+        return shared_memory.SharedMemory(name=shm_name, track=False)  # python >= 3.13
+    except TypeError:
+        # The worker processes share the resource tracker of the parent process, which unregisters the block when
+        # unlinking it
+        return shared_memory.SharedMemory(name=shm_name)
+
+
+def _bill_meter(tariff_key, tariff_descriptor, meter_descriptor, monthly_detailed, return_bill, cycles_descriptor=None):
+    """
+    Worker task: compute the bill of one meter
+    """
+
+    # Load the rate manager once per worker
+    if len(_worker_rate_managers) == 0:
+        atexit.register(_release_worker_rate_managers)
+
+    if tariff_key not in _worker_rate_managers:
+        payload, buffers, shm_tariff = load_shared_data(tariff_descriptor)
+        if len(buffers) > 0:
+            rate_manager = pickle.loads(payload, buffers=buffers)
+        else:
+            rate_manager = pickle.loads(payload)
+        _worker_rate_managers[tariff_key] = (rate_manager, shm_tariff)
+    rate_manager = _worker_rate_managers[tariff_key][0]
+
+    payload, buffers, shm_meter = load_shared_data(meter_descriptor)
+    (tz, name) = pickle.loads(payload)
+
+    # The calendar caches the last dates it was given: a copy is used, released with the shared dates
+    billing_cycles = copy.copy(_load_billing_cycles(cycles_descriptor))
+
+    meter_series = None
+    try:
+        dates = np.frombuffer(buffers[0], dtype=np.int64).view('datetime64[ns]')
+        index = pd.DatetimeIndex(dates)
+        if tz is not None:
+            index = index.tz_localize('UTC').tz_convert(tz)
+
+        meter_series = pd.Series(np.frombuffer(buffers[1], dtype=np.float64), index=index, name=name)
+
+        return rate_manager.compute_bill(meter_series, monthly_detailed=monthly_detailed, billing_cycles=billing_cycles,
+                                         return_bill=return_bill)
+    except Exception as e:
+        # The frames of the traceback hold views on the shared block: their local variables are cleared
+        traceback.clear_frames(e.__traceback__)
+        raise
+    finally:
+        # The views on the shared block must be released before closing it
+        dates = index = meter_series = buffers = billing_cycles = None
+        if shm_meter is not None:
+            shm_meter.close()
+
+
+def _load_billing_cycles(cycles_descriptor):
+    """
+    Load the billing cycles in a worker, once per shared memory block
+    :param cycles_descriptor: the descriptor of the SharedData of the billing cycles, or None
+    :return: a BillingCycleCalendar, or None
+    """
+
+    if cycles_descriptor is None:
+        return None
+
+    shm_name = cycles_descriptor[0]
+    if shm_name is not None and shm_name in _worker_billing_cycles:
+        return _worker_billing_cycles[shm_name]
+
+    payload, _, shm_cycles = load_shared_data(cycles_descriptor)
+    if shm_cycles is not None:  # only the payload, already copied, is used
+        shm_cycles.close()
+
+    billing_cycles = pickle.loads(payload)
+    if shm_name is not None:
+        _worker_billing_cycles[shm_name] = billing_cycles
+
+    return billing_cycles
+
+
+def _release_worker_rate_managers():
+    """
+    Free the rate managers loaded by a worker before closing their shared memory blocks, that can't be closed while
+    their arrays are in use
+    """
+
+    shm_tariffs = [shm for (_, shm) in _worker_rate_managers.values() if shm is not None]
+    _worker_rate_managers.clear()
+    gc.collect()
+
+    for shm in shm_tariffs:
+        try:
+            shm.close()
+        except BufferError:
+            pass
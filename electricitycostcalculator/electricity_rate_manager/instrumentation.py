@@ -0,0 +1,283 @@
+__author__ = 'Olivier Van Cutsem'
+
+import contextvars
+import json
+import os
+import time
+
+# --------------- INSTRUMENTATION of the billing pipeline --------------- #
+
+# The stages timed in the billing pipeline. The stages are nested: e.g. 'block_bill' includes the 'price_gather' and
+# 'demand_reduction' of the block
+STAGE_BLOCK_LOOKUP = 'block_lookup'  # selection of the tariff blocks of a label
+STAGE_BLOCK_BILL = 'block_bill'  # bill of a tariff block
+STAGE_CALENDAR = 'calendar'  # derivation of the calendar features of dates, see CalendarIndex
+STAGE_HOLIDAY_LOOKUP = 'holiday_lookup'  # computation of the day types of a year, see HolidayCalendar
+STAGE_PRICE_GATHER = 'price_gather'  # rate codes and prices of dates
+STAGE_PRICE_SIGNAL = 'price_signal'  # price signal of a label, see ElectricityRateManager.get_price_signal()
+STAGE_DEMAND_REDUCTION = 'demand_reduction'  # maximum demand of each billing cycle and demand period
+STAGE_BILL_MERGE = 'bill_merge'  # assembly of the Bill from the bills of the tariff blocks
+
+# The collectors currently enabled in this context (thread or asyncio task), as a tuple, see Instrumentation
+_collectors = contextvars.ContextVar('elecprice_collectors', default=())
+
+# The tariff label being billed in this context, set by the ElectricityRateManager
+_current_label = contextvars.ContextVar('elecprice_label', default='')
+
+
+class Instrumentation(object):
+    """
+    This structure collects the time spent in each stage of the billing pipeline, and some counters, keyed by stage,
+    tariff label and tariff class. The collection is opt-in: it is enabled while the instrumentation is used as a
+    context manager, and costs a single test per stage otherwise.
+
+        with Instrumentation() as stats:
+            rate_manager.compute_bill(df)
+        stats.write_json('stats.json')
+
+    A callback can also be given, called with (stage, label, class name, seconds) for each timed stage.
+    The collection is specific to the current context: the bills computed in other threads, or in the workers of
+    compute_fleet_bills(), are not collected. The asyncio tasks created in the context manager inherit its collection.
+    """
+
+    def __init__(self, callback=None):
+        """
+        Constructor
+        :param callback: [optional] a function (stage, label, class_name, seconds) called for each timed stage
+        """
+
+        self.callback = callback
+
+        self.__timers = {}  # (stage, label, class name) -> [count, total seconds, max seconds]
+        self.__counters = {}  # (name, label, class name) -> count
+
+    def __enter__(self):
+        _collectors.set(_collectors.get() + (self,))
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _collectors.set(tuple(collector for collector in _collectors.get() if collector is not self))
+        return False
+
+    def record(self, stage, label, class_name, seconds):
+        """
+        Add the duration of a stage
+        :param stage: a string, e.g. STAGE_BLOCK_BILL
+        :param label: a string, the tariff label ('' if none)
+        :param class_name: a string, the class of the tariff ('' if none)
+        :param seconds: a float
+        :return: /
+        """
+
+        key = (stage, label, class_name)
+        timer = self.__timers.get(key)
+        if timer is None:
+            self.__timers[key] = [1, seconds, seconds]
+        else:
+            timer[0] += 1
+            timer[1] += seconds
+            timer[2] = max(timer[2], seconds)
+
+        if self.callback is not None:
+            self.callback(stage, label, class_name, seconds)
+
+    def add_count(self, name, label, class_name, value=1):
+        """
+        Increase a counter
+        :param name: a string, e.g. 'calendar_cache_hit'
+        :param label: a string, the tariff label ('' if none)
+        :param class_name: a string, the class of the tariff ('' if none)
+        :param value: [optional] the increment
+        :return: /
+        """
+
+        key = (name, label, class_name)
+        self.__counters[key] = self.__counters.get(key, 0) + value
+
+    def reset(self):
+        """
+        Drop all the timers and counters
+        :return: /
+        """
+
+        self.__timers.clear()
+        self.__counters.clear()
+
+    def get_timers(self):
+        """
+        :return: a dict mapping each (stage, label, class name) to a tuple (count, total seconds, max seconds)
+        """
+
+        return {key: tuple(timer) for key, timer in self.__timers.items()}
+
+    def get_counters(self):
+        """
+        :return: a dict mapping each (name, label, class name) to its count
+        """
+
+        return dict(self.__counters)
+
+    def get_total_per_stage(self):
+        """
+        :return: a dict mapping each stage to its total time, in seconds, over all the labels and classes
+        """
+
+        ret = {}
+        for (stage, _, _), (_, total, _) in self.__timers.items():
+            ret[stage] = ret.get(stage, 0.0) + total
+
+        return ret
+
+    # --- Export
+
+    def to_dict(self):
+        """
+        Return a snapshot of the timers and counters as plain python objects, e.g. to be saved in JSON
+        :return: a dict {'timestamp': float, 'timers': [...], 'counters': [...]}
+        """
+
+        timers = [{'stage': stage, 'label': label, 'class': class_name, 'count': count, 'total_seconds': total,
+                   'max_seconds': max_seconds}
+                  for (stage, label, class_name), (count, total, max_seconds) in sorted(self.__timers.items())]
+        counters = [{'name': name, 'label': label, 'class': class_name, 'count': count}
+                    for (name, label, class_name), count in sorted(self.__counters.items())]
+
+        return {'timestamp': time.time(), 'timers': timers, 'counters': counters}
+
+    def write_json(self, path):
+        """
+        Write a snapshot of the timers and counters in a JSON file, see to_dict()
+        :param path: the path of the file
+        :return: /
+        """
+
+        write_atomically(path, json.dumps(self.to_dict(), indent=2))
+
+    def to_prometheus_text(self, prefix='elecprice'):
+        """
+        Return the timers and counters in the Prometheus text format
+        :param prefix: [optional] the prefix of the metric names
+        :return: a string
+        """
+
+        lines = ['# HELP {0}_stage_seconds_total Time spent in each stage of the billing pipeline.'.format(prefix),
+                 '# TYPE {0}_stage_seconds_total counter'.format(prefix)]
+        for key, (_, total, _) in sorted(self.__timers.items()):
+            lines.append('{0}_stage_seconds_total{{{1}}} {2!r}'.format(prefix, get_prometheus_labels('stage', key), total))
+
+        lines += ['# HELP {0}_stage_calls_total Number of times each stage of the billing pipeline ran.'.format(prefix),
+                  '# TYPE {0}_stage_calls_total counter'.format(prefix)]
+        for key, (count, _, _) in sorted(self.__timers.items()):
+            lines.append('{0}_stage_calls_total{{{1}}} {2}'.format(prefix, get_prometheus_labels('stage', key), count))
+
+        lines += ['# HELP {0}_events_total Counters of the billing pipeline.'.format(prefix),
+                  '# TYPE {0}_events_total counter'.format(prefix)]
+        for key, count in sorted(self.__counters.items()):
+            lines.append('{0}_events_total{{{1}}} {2}'.format(prefix, get_prometheus_labels('name', key), count))
+
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus_textfile(self, path, prefix='elecprice'):
+        """
+        Write the timers and counters in a file read by the textfile collector of the Prometheus node exporter. The
+        file is replaced atomically
+        :param path: the path of the file, ending with '.prom'
+        :param prefix: [optional] the prefix of the metric names
+        :return: /
+        """
+
+        write_atomically(path, self.to_prometheus_text(prefix))
+
+
+# --- Hooks of the billing pipeline
+
+
+def is_enabled():
+    """
+    :return: True if an Instrumentation is collecting in this context
+    """
+
+    return len(_collectors.get()) > 0
+
+
+def start():
+    """
+    Start timing a stage
+    :return: the starting time, or None if no Instrumentation is collecting
+    """
+
+    if not _collectors.get():
+        return None
+
+    return time.perf_counter()
+
+
+def stop(t_start, stage, class_name=''):
+    """
+    Stop timing a stage, and record its duration for the current tariff label
+    :param t_start: the output of start()
+    :param stage: a string, e.g. STAGE_BLOCK_BILL
+    :param class_name: [optional] the class of the tariff
+    :return: /
+    """
+
+    if t_start is None:
+        return
+
+    seconds = time.perf_counter() - t_start
+    label = _current_label.get()
+    for collector in _collectors.get():
+        collector.record(stage, label, class_name, seconds)
+
+
+def count(name, class_name='', value=1):
+    """
+    Increase a counter for the current tariff label
+    :param name: a string
+    :param class_name: [optional] the class of the tariff
+    :param value: [optional] the increment
+    :return: /
+    """
+
+    collectors = _collectors.get()
+    if not collectors:
+        return
+
+    label = _current_label.get()
+    for collector in collectors:
+        collector.add_count(name, label, class_name, value)
+
+
+def set_label(label):
+    """
+    Set the tariff label the next stages of this context are recorded for
+    :param label: a string ('' for none)
+    :return: /
+    """
+
+    _current_label.set(label)
+
+
+# --- Utils
+
+
+def get_prometheus_labels(first_name, key):
+    """
+    Format a (name, label, class name) key as Prometheus labels
+    """
+
+    values = [(first_name, key[0]), ('label', key[1]), ('class', key[2])]
+
+    return ','.join('{0}="{1}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                    for name, value in values)
+
+
+def write_atomically(path, text):
+    """
+    Write a text file through a temporary file, so that its readers never see a partial file
+    """
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as output_file:
+        output_file.write(text)
+    os.replace(tmp_path, path)
@@ -0,0 +1,106 @@
+__author__ = 'Olivier Van Cutsem'
+
+import numpy as np
+
+# --------------- LINEAR OPTIMIZATION coefficients --------------- #
+
+
+class LinearCostCoefficients(object):
+    """
+    This structure stores the cost of electricity over a period as the coefficients of a linear optimization problem,
+    the decision variables being the energy consumed at each time step (in Wh):
+
+     cost = fixed_cost + energy_cost . e + sum_g demand_prices[g] * d_g, with d_g >= demand_coeffs[k] * e[demand_cols[k]]
+     for each k such that demand_rows[k] == g
+
+    where:
+     - energy_cost is a dense vector, the cost of 1 Wh consumed at each time step ($/Wh), summed over the energy tariffs
+     - each demand group g is a (tariff label, billing cycle, demand period), whose demand d_g is the maximum power over
+     its time steps. The incidence of the time steps in the groups is given as a sparse matrix in COO format (rows,
+     cols, coeffs), demand_coeffs[k] being the power (kW) due to 1 Wh consumed during the time step
+     - demand_prices[g] is the price of the demand of group g ($/kW)
+     - fixed_cost is the fixed charges over the period ($)
+    """
+
+    def __init__(self, dates, energy_cost, demand_rows, demand_cols, demand_coeffs, demand_prices, demand_groups,
+                 fixed_cost=0.0):
+        """
+        Constructor
+        :param dates: a pandas DatetimeIndex, the time steps
+        :param energy_cost: a float64 numpy array with the same length as dates, in $/Wh
+        :param demand_rows: an int numpy array, the demand group of each non-zero coefficient
+        :param demand_cols: an int numpy array, the time step of each non-zero coefficient
+        :param demand_coeffs: a float64 numpy array, the non-zero coefficients, in kW/Wh
+        :param demand_prices: a float64 numpy array with one price per demand group, in $/kW
+        :param demand_groups: a list of tuples (tariff label, billing cycle label, demand period), one per demand group,
+        the demand period being its daily mask as a string of 0 and 1 (e.g. '000011110000', see Bill.get_mask_string())
+        :param fixed_cost: [optional] a float, in $
+        """
+
+        self.dates = dates
+        self.energy_cost = energy_cost
+
+        # The coefficients are sorted by group, then by time step
+        order = np.lexsort((demand_cols, demand_rows))
+        self.demand_rows = demand_rows[order]
+        self.demand_cols = demand_cols[order]
+        self.demand_coeffs = demand_coeffs[order]
+
+        self.demand_prices = demand_prices
+        self.demand_groups = demand_groups
+        self.fixed_cost = fixed_cost
+
+    @property
+    def nb_steps(self):
+        return len(self.dates)
+
+    @property
+    def nb_demand_groups(self):
+        return len(self.demand_prices)
+
+    def get_incidence_matrix(self):
+        """
+        Return the incidence of the time steps in the demand groups as a scipy sparse matrix
+        :return: a scipy.sparse.csr_matrix of shape (nb_demand_groups, nb_steps)
+        :raise ImportError: if scipy, an optional dependency, is not installed. The matrix is also given in COO format
+        by demand_rows, demand_cols and demand_coeffs
+        """
+
+        # scipy is only loaded here: importing it takes longer than importing the rest of the library
+        try:
+            from scipy import sparse
+        except ImportError as e:
+            raise ImportError("get_incidence_matrix() requires the optional dependency scipy: use demand_rows, "
+                              "demand_cols and demand_coeffs without it") from e
+
+        return sparse.csr_matrix((self.demand_coeffs, (self.demand_rows, self.demand_cols)),
+                                 shape=(self.nb_demand_groups, self.nb_steps))
+
+    def get_demands(self, energy):
+        """
+        Compute the demand of each group for a consumption profile
+        :param energy: a float64 numpy array with one value per time step, in Wh
+        :return: a float64 numpy array with one demand per group, in kW (0 for the groups without time step)
+        """
+
+        demands = np.zeros(self.nb_demand_groups)
+
+        if len(self.demand_rows) == 0:
+            return demands
+
+        power = self.demand_coeffs * np.asarray(energy, dtype=np.float64)[self.demand_cols]
+        group_starts = np.flatnonzero(np.r_[True, self.demand_rows[1:] != self.demand_rows[:-1]])
+        demands[self.demand_rows[group_starts]] = np.maximum.reduceat(power, group_starts)
+
+        return demands
+
+    def get_cost(self, energy):
+        """
+        Evaluate the cost of a consumption profile, i.e. the objective of the optimization problem
+        :param energy: a float64 numpy array with one value per time step, in Wh
+        :return: a float, in $
+        """
+
+        energy = np.asarray(energy, dtype=np.float64)
+
+        return float(self.fixed_cost + np.dot(self.energy_cost, energy) + np.dot(self.demand_prices, self.get_demands(energy)))
@@ -0,0 +1,119 @@
+__author__ = 'Olivier Van Cutsem'
+
+from collections import OrderedDict
+
+# --------------- PRICE SIGNAL cache --------------- #
+
+
+class PriceSignalCache(object):
+    """
+    This structure keeps the last price signals computed by an ElectricityRateManager, so that the same signal asked
+    again (same labels, period and timestep) is not computed again.
+
+    The entries are evicted in least-recently-used order when their total size exceeds max_bytes.
+    Each entry is computed for a version of the tariffs: when the version changes (a tariff block is added), all the
+    entries are dropped. The cached numpy arrays are read-only, so that the callers can't alter the cached data, while
+    the arrays of the data that are not stored remain writeable.
+    """
+
+    DEFAULT_MAX_BYTES = 64 * 2**20
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        """
+        Constructor
+        :param max_bytes: [optional] the maximum size of the cached arrays, in bytes. 0 disables the cache
+        """
+
+        self.max_bytes = max_bytes
+
+        self.__entries = OrderedDict()  # key -> (data, nbytes)
+        self.__version = None
+        self.__nbytes = 0
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, version):
+        """
+        Return the data cached for a key
+        :param key: a hashable object
+        :param version: the current version of the tariffs
+        :return: the data, or None if they are not in the cache
+        """
+
+        self.__check_version(version)
+
+        entry = self.__entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.__entries.move_to_end(key)
+        self.hits += 1
+
+        return entry[0]
+
+    def put(self, key, version, data, arrays):
+        """
+        Store the data of a key. Data larger than max_bytes are not stored, and their arrays are left writeable.
+        :param key: a hashable object
+        :param version: the version of the tariffs the data were computed with
+        :param data: the data to store
+        :param arrays: the list of numpy arrays held by data, counted in the cache size and made read-only if stored
+        :return: True if the data are stored
+        """
+
+        self.__check_version(version)
+
+        nbytes = sum(array.nbytes for array in arrays)
+        if nbytes > self.max_bytes:
+            return False
+
+        for array in arrays:
+            array.setflags(write=False)
+
+        if key in self.__entries:
+            self.__nbytes -= self.__entries.pop(key)[1]
+
+        self.__entries[key] = (data, nbytes)
+        self.__nbytes += nbytes
+
+        while self.__nbytes > self.max_bytes:
+            (_, (_, evicted_nbytes)) = self.__entries.popitem(last=False)
+            self.__nbytes -= evicted_nbytes
+
+        return True
+
+    def clear(self):
+        """
+        Drop all the entries
+        :return: /
+        """
+
+        self.__entries.clear()
+        self.__nbytes = 0
+
+    def __check_version(self, version):
+
+        if version != self.__version:
+            self.clear()
+            self.__version = version
+
+    @property
+    def nbytes(self):
+        """
+        GETTER of the size of the cached arrays
+        :return: an int, in bytes
+        """
+
+        return self.__nbytes
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def __getstate__(self):
+        # The cached data are not pickled, e.g. with the rate manager sent to the workers of compute_fleet_bills()
+        return {'max_bytes': self.max_bytes}
+
+    def __setstate__(self, state):
+        self.__init__(state['max_bytes'])
@@ -1,10 +1,15 @@
 __author__ = 'Olivier Van Cutsem'
 
 from .rate_structure import *
-from .tariff_structure import TariffType
-from dateutil.relativedelta import relativedelta
+from .tariff_structure import TariffType, TariffBlockIndex
+from .bill_structure import Bill
+from .price_cache import PriceSignalCache
+from .lp_coefficients import LinearCostCoefficients
+from .calendar_structure import BillingCycleCalendar, CalendarIndex, to_local_datetime_index, to_local_datetime64
+from . import instrumentation
+import warnings
+import numpy as np
 import pandas as pd
-import pytz
 
 
 class ElectricityRateManager(object):
@@ -12,7 +17,7 @@ class ElectricityRateManager(object):
     This class is used to manipulate the building electricity cost:
         - Bill calculation given a Smart Meter energy timeseries
         - Electricity price timeseries between two dates
-        - Cost coefficients over a given period, for a linear optimization problem
+        - Cost coefficients over a given period, for a linear optimization problem (see get_linear_cost_coefficients())
         - Metrics related to the tariff maximum demand
 
     The main component of this class is called the "tariff_structure".
@@ -32,12 +37,14 @@ class ElectricityRateManager(object):
                           str(TariffType.PDP_DEMAND_CREDIT.value): ChargeType.DEMAND,
                           }
 
-    def __init__(self, type_tariffs_map=None):
+    def __init__(self, type_tariffs_map=None, price_cache_size=PriceSignalCache.DEFAULT_MAX_BYTES):
         """
         Initialize the class instance
 
         :param type_tariffs_map: [optional] a dictionary that map the main type of tariffs used to describe the whole
         billing logic to their type. DEFAULT_TARIFF_TYPE_LIST is used if type_tariffs_list is not specified.
+        :param price_cache_size: [optional] the maximum size of the price signals kept in memory, in bytes.
+        0 disables the cache
 
         Note: the method 'add_tariff' is used to build the core "tariff_structure" object structure.
         """
@@ -45,6 +52,11 @@ class ElectricityRateManager(object):
         # This is the main structure, listing all the "tariff blocks" making up the whole tariff logic
         self.__tariffstructures = {}
 
+        # The version of the tariff structure, increased when a tariff block is added, and the price signals computed
+        # for the current version
+        self.__tariff_version = 0
+        self.price_cache = PriceSignalCache(price_cache_size)
+
         if type_tariffs_map is None:  # The "basic" tariff types as the default ones
             self.type_tariffs_map = self.DEFAULT_TARIFF_MAP
         else:
@@ -63,10 +75,8 @@ class ElectricityRateManager(object):
 
     # --- Useful methods
 
-    def compute_bill(self, df, column_data=None, monthly_detailed=False):
+    def compute_bill(self, df, column_data=None, monthly_detailed=False, billing_cycles=None, return_bill=False):
         """
-        #TODO: create a class for the bill !
-
         Return the bill corresponding to the electricity data in a data frame:
 
         {
@@ -79,7 +89,7 @@ class ElectricityRateManager(object):
          - keys label_i corresponds to a type of tariff in the Enum TariffType and the values
          - values cost_detail_i has one of the following form:
             - if ENERGY or FIX tariff: cost_detail_i = (metric, cost) where metric is either the total energy or the period
-            - if DEMAND: cost_detail_i is dict where the keys are the price per kW and the values are tuples: (period-mask, max-power-value, max-power-date)
+            - if DEMAND: cost_detail_i is dict where the keys are the price per kW and the values are dicts: {'mask': period-mask, 'max-demand': max-power-value, 'max-demand-date': max-power-date, 'cost': cost}. The periods sharing a price are merged, see Bill.to_dict()
 
         if monthly_detailed is set to True, the bill is detailed for each month:
 
@@ -97,39 +107,250 @@ class ElectricityRateManager(object):
         :param column_data: [optional] the label of the column containing the energy consumption values
         :param monthly_detailed: [optional] if False, it is assumed that the df contains values for ONE billing period.
         if True, the bill is detailed for each month of the calendar. Set to False by default.
-        :return: a dictionary representing the bill as described above
+        :param billing_cycles: [optional] a BillingCycleCalendar, defining the billing periods used instead of the months
+        of the calendar when monthly_detailed is True (e.g. meter-read cycles from the 17th to the 16th)
+        :param return_bill: [optional] if True, a Bill is returned instead of the dictionary, detailed per billing cycle
+        :return: a dictionary representing the bill as described above, or a Bill
         """
 
-        ret = {}
+        # The cycle table is computed once on df, and shared by all the tariff blocks
+        if billing_cycles is None:
+            billing_cycles = BillingCycleCalendar()
 
-        # Initialize the returned structure
+        cycle_labels, _ = billing_cycles.get_cycle_bounds(df.index)
 
-        t_s = df.index[0]
-        t_i = datetime(year=t_s.year, month=t_s.month, day=1, tzinfo=t_s.tzinfo)
-        while t_i <= df.index[-1]:
-            ret[t_i.strftime("%Y-%m")] = {}
-            for k in list(self.__tariffstructures.keys()):
-                if self.type_tariffs_map[k] == ChargeType.DEMAND:
-                    ret[t_i.strftime("%Y-%m")][k] = {}  # a dict of price -> (max, cost)
-                else:
-                    ret[t_i.strftime("%Y-%m")][k] = (0, 0)  # a tuple
+        # Compute the bill for each of the tariff type, for each billing cycle
+        tariff_bills = []
+        for label, tariff_data in list(self.__tariffstructures.items()):
+            instrumentation.set_label(label)
 
-            t_i += relativedelta(months=+1)
+            t_start = instrumentation.start()
+            l_blocks = self.get_tariff_struct_for_data(label, df.index)  # get all the tariff blocks for this period and this tariff type
+            instrumentation.stop(t_start, instrumentation.STAGE_BLOCK_LOOKUP)
 
-        # Compute the bill for each of the tariff type, for each month
-        for label, tariff_data in list(self.__tariffstructures.items()):
-            l_blocks = self.get_tariff_struct(label, (df.index[0], df.index[-1]))  # get all the tariff blocks for this period and this tariff type
             for tariff_block in l_blocks:
-                tariff_cost_list = tariff_block.compute_bill(df, column_data)  # this returns a dict of time-period pointing to tuple that contains both the metric of the bill and the cost
-                for time_label, bill_data in list(tariff_cost_list.items()):
-                    self.update_bill_structure(ret[time_label], label, bill_data)
+                t_start = instrumentation.start()
+                tariff_cost_list = tariff_block.compute_bill(df, column_data, billing_cycles)  # this returns a dict of time-period pointing to tuple that contains both the metric of the bill and the cost
+                instrumentation.stop(t_start, instrumentation.STAGE_BLOCK_BILL, type(tariff_block).__name__)
+                tariff_bills.append((label, tariff_cost_list))
+
+        instrumentation.set_label('')
 
-        if monthly_detailed is False:  # Aggregate all the months
-            return self.aggregate_monthly_bill(ret)
+        t_start = instrumentation.start()
+        bill = Bill.from_tariff_bills(cycle_labels, self.get_tariff_types(), tariff_bills, df.index.tz)
+        ret = bill if return_bill else bill.to_dict(monthly_detailed)
+        instrumentation.stop(t_start, instrumentation.STAGE_BILL_MERGE)
+
+        return ret
+
+    def compute_bill_per_column(self, df, columns=None, monthly_detailed=False, billing_cycles=None, return_bill=False):
+        """
+        Compute the bill of each column of df, e.g. the sub-meters of a site sharing the same dates.
+        This is equivalent to calling compute_bill() for each column, but the selection of the tariff blocks, the
+        billing cycles and the prices are computed once and all the columns are billed together.
+
+        :param df: a pandas dataframe containing energy consumption (in Wh), one column per meter
+        :param columns: [optional] the list of column labels to bill. All the columns of df by default
+        :param monthly_detailed: [optional] see compute_bill()
+        :param billing_cycles: [optional] see compute_bill()
+        :param return_bill: [optional] see compute_bill()
+        :return: a dictionary mapping each column label to its bill, formatted as the output of compute_bill()
+        """
+
+        if columns is None:
+            columns = list(df.columns)
         else:
-            return ret
+            columns = list(columns)
+
+        if billing_cycles is None:
+            billing_cycles = BillingCycleCalendar()
+
+        cycle_labels, _ = billing_cycles.get_cycle_bounds(df.index)
+
+        # Compute the bill for each of the tariff type, for each billing cycle, for all the columns
+        tariff_bills = {col: [] for col in columns}
+        for label, tariff_data in list(self.__tariffstructures.items()):
+            instrumentation.set_label(label)
+
+            t_start = instrumentation.start()
+            l_blocks = self.get_tariff_struct_for_data(label, df.index)
+            instrumentation.stop(t_start, instrumentation.STAGE_BLOCK_LOOKUP)
+
+            for tariff_block in l_blocks:
+                t_start = instrumentation.start()
+                tariff_cost_per_column = tariff_block.compute_bill_columns(df, columns, billing_cycles)
+                instrumentation.stop(t_start, instrumentation.STAGE_BLOCK_BILL, type(tariff_block).__name__)
+                for col in columns:
+                    tariff_bills[col].append((label, tariff_cost_per_column[col]))
+
+        instrumentation.set_label('')
+
+        t_start = instrumentation.start()
+        ret = {}
+        for col in columns:
+            bill = Bill.from_tariff_bills(cycle_labels, self.get_tariff_types(), tariff_bills[col], df.index.tz)
+            ret[col] = bill if return_bill else bill.to_dict(monthly_detailed)
+        instrumentation.stop(t_start, instrumentation.STAGE_BILL_MERGE)
+
+        return ret
+
+    def compute_scenario_costs(self, dates, scenarios, billing_cycles=None):
+        """
+        Compute the cost of many candidate consumption profiles sharing the same dates (e.g. battery dispatch plans),
+        without building a dataframe and a bill for each of them.
+        The prices, the demand periods and the billing cycles are computed once, and applied to all the profiles:
+         - the energy cost of each profile is a matrix-vector product with the prices
+         - the maximum demands of all the profiles are found in one grouped reduction, grouped by billing cycle and
+         demand period as in compute_bill()
+        Only the dates within the billing cycles are charged, as in compute_bill().
+
+        :param dates: a sorted pandas DatetimeIndex, shared by all the profiles
+        :param scenarios: a 2-D numpy array of energy consumption (in Wh), with one row per profile and one column per
+        date
+        :param billing_cycles: [optional] a BillingCycleCalendar, the natural months by default
+        :return: a tuple (numpy array, dict) -> (total_costs, costs_per_label), total_costs being the total cost of each
+        profile (in $) and costs_per_label mapping each tariff label to the cost of each profile
+        """
+
+        if billing_cycles is None:
+            billing_cycles = BillingCycleCalendar()
+
+        scenarios = np.atleast_2d(np.asarray(scenarios, dtype=np.float64))
+        nb_scenarios = scenarios.shape[0]
+
+        # One column per profile, without copy
+        df = pd.DataFrame(scenarios.T, index=dates, copy=False)
+        columns = list(df.columns)
+
+        # Billing cycle of each date
+        cycle_labels, cycle_bounds = billing_cycles.get_cycle_bounds(df.index)
+        cycle_codes = np.full(len(dates), -1, dtype=np.int64)
+        for i in range(len(cycle_labels)):
+            cycle_codes[cycle_bounds[i]:cycle_bounds[i+1]] = i
+
+        costs_per_label = {}
+        for label_tariff, tariff_type in list(self.get_tariff_types().items()):
+            costs = np.zeros(nb_scenarios)
+
+            if len(dates) == 0:
+                costs_per_label[label_tariff] = costs
+                continue
+
+            l_blocks = self.get_tariff_struct_for_data(label_tariff, df.index)
 
-    def get_electricity_price(self, range_date, timestep):
+            if tariff_type == ChargeType.FIXED:  # the same for all the profiles
+                for tariff_block in l_blocks:
+                    for (_, cost) in list(tariff_block.compute_bill(df.iloc[:, :0], None, billing_cycles).values()):
+                        costs += cost
+
+            elif tariff_type == ChargeType.ENERGY:
+                for tariff_block in l_blocks:
+                    if tariff_block.rate_schedule.compiled.tiered:  # the tiers depend on the consumption of each cycle
+                        for col, cost_per_cycle in list(tariff_block.compute_bill_columns(df, columns, billing_cycles).items()):
+                            costs[col] += sum(cost for (_, cost) in list(cost_per_cycle.values()))
+                        continue
+
+                    # Only the dates of the billing cycles are charged
+                    (idx_start, idx_end) = tariff_block.get_window_bounds(df.index)
+                    prices = tariff_block.get_prices(df.index[idx_start:idx_end])
+                    prices[cycle_codes[idx_start:idx_end] < 0] = np.nan
+                    priced = ~np.isnan(prices)
+                    costs += float(tariff_block.unit_cost.value) / float(tariff_block.unit_metric.value) * \
+                        np.dot(scenarios[:, idx_start:idx_end][:, priced], prices[priced])
+
+            else:
+                costs = self.get_scenario_demand_costs(df, l_blocks, cycle_codes)
+
+            costs_per_label[label_tariff] = costs
+
+        total_costs = np.zeros(nb_scenarios)
+        for costs in list(costs_per_label.values()):
+            total_costs += costs
+
+        return total_costs, costs_per_label
+
+    @staticmethod
+    def get_scenario_demand_costs(df, l_blocks, cycle_codes):
+        """
+        Compute the demand cost of each column of df, for the demand tariff blocks of a label, grouping the demands as
+        compute_bill() does:
+         - the maximum demand of each (tariff block, billing cycle, demand period) is found for all the columns in one
+         grouped reduction, with the daily mask of its period on the day of the maximum
+         - the maxima of the blocks with the same (billing cycle, mask) are merged: the highest one is charged, at the
+         price of its block
+        :param df: a pandas dataframe, one column per consumption profile
+        :param l_blocks: a list of TouDemandChargeTariff, the blocks of the label
+        :param cycle_codes: an int numpy array with the same length as df, the billing cycle of each date (-1 if none)
+        :return: a float64 numpy array, the cost of each column
+        """
+
+        nb_columns = len(df.columns)
+        calendar = CalendarIndex.get(df.index)
+
+        mask_ids = {}  # daily mask -> id
+        (line_cycles, line_masks, line_demands, line_prices) = ([], [], [], [])
+
+        for tariff_block in l_blocks:
+            (idx_start, idx_end) = tariff_block.get_window_bounds(df.index)
+            if idx_start == idx_end:
+                continue
+
+            # The demand is computed on all the data, for the rolling windows of the first data of the tariff window
+            power = tariff_block.get_demand_values(df, list(df.columns))[idx_start:idx_end]
+            (prices, rate_codes) = tariff_block.get_prices(df.index[idx_start:idx_end], return_codes=True)
+            rate_codes = rate_codes.astype(np.int64)
+
+            positions = idx_start + np.flatnonzero(~np.isnan(prices) & (cycle_codes[idx_start:idx_end] >= 0))
+            if len(positions) == 0:
+                continue
+
+            # Sort the dates by (cycle, period): the maximum of each group and column is taken at its first date
+            compiled_schedule = tariff_block.rate_schedule.compiled
+            keys = cycle_codes[positions] * len(compiled_schedule.rates) + rate_codes[positions - idx_start]
+            order = np.argsort(keys, kind='stable')
+            (keys, positions) = (keys[order], positions[order])
+            power = power[positions - idx_start]
+            power[np.isnan(power)] = -np.inf
+
+            starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+            max_demands = np.maximum.reduceat(power, starts, axis=0)
+            is_max = power == np.repeat(max_demands, np.diff(np.r_[starts, len(keys)]), axis=0)
+            max_rows = np.minimum.reduceat(np.where(is_max, np.arange(len(keys))[:, np.newaxis], len(keys)), starts,
+                                           axis=0)
+            max_positions = positions[np.minimum(max_rows, len(keys) - 1)]
+
+            # The daily mask of each maximum
+            group_codes = keys[starts] % len(compiled_schedule.rates)
+            day_types = calendar.get_day_types(tariff_block.rate_schedule.holiday_calendar)
+            group_masks = np.zeros(max_positions.shape, dtype=np.int64)
+            for (i, j), pos in np.ndenumerate(max_positions):
+                mask = tuple(compiled_schedule.get_period_mask(group_codes[i], calendar.months[pos], day_types[pos]))
+                group_masks[i, j] = mask_ids.setdefault(mask, len(mask_ids))
+
+            line_cycles.append(np.repeat(keys[starts] // len(compiled_schedule.rates), nb_columns))
+            line_masks.append(group_masks.ravel())
+            line_demands.append(max_demands.ravel())
+            line_prices.append(np.repeat(float(tariff_block.unit_cost.value) * compiled_schedule.rates[group_codes],
+                                         nb_columns))
+
+        if len(line_cycles) == 0:
+            return np.zeros(nb_columns)
+
+        # Merge the lines of the same (column, cycle, mask), keeping the highest demand (the first line in case of tie)
+        line_cycles = np.concatenate(line_cycles)
+        line_masks = np.concatenate(line_masks)
+        line_demands = np.concatenate(line_demands)
+        line_prices = np.concatenate(line_prices)
+        line_columns = np.tile(np.arange(nb_columns), len(line_cycles) // nb_columns)
+
+        keys = (line_columns * (int(line_cycles.max()) + 1) + line_cycles) * len(mask_ids) + line_masks
+        order = np.lexsort((np.arange(len(keys)), -line_demands, keys))
+        kept = order[np.flatnonzero(np.r_[True, keys[order][1:] != keys[order][:-1]])]
+        kept = kept[~np.isinf(line_demands[kept])]
+
+        return np.bincount(line_columns[kept], weights=line_prices[kept] * line_demands[kept], minlength=nb_columns)
+
+    def get_electricity_price(self, range_date, timestep, dtype=np.float64):
         """
 
         This function creates the electricity price signal for the specified time frame 'range_date', sampled at 'timestep'
@@ -139,55 +360,290 @@ class ElectricityRateManager(object):
         :param range_date: a tuple (t_start, t_end) of type 'datetime', representing the period
         :param timestep: an element of TariffElemPeriod enumeration (1h, 30min or 15min), representing the sampling
         period
+        :param dtype: [optional] the type of the prices, np.float64 or np.float32 (half the memory, e.g. for long periods)
 
         :return: a tuple (pd_prices, map_prices) containing:
             - pd_prices: a pandas dataframe whose index is a datetime index and containing as many cols as there are
-        type_tariffs_map elements, i.e. the same keys as in __tariffstructures
+        type_tariffs_map elements, i.e. the same keys as in __tariffstructures. Its values are read-only, as they are
+        shared with the price cache
             - map_prices: a mapping between the cols label and the type of tariff (fix, energy or demand), being of type 'ChargeType'
         """
 
-        # Prepare the Pandas dataframe
-        (start_date_price, end_date_price) = range_date
+        labels = [label_tariff for label_tariff in list(self.__tariffstructures.keys())
+                  if self.type_tariffs_map[label_tariff] != ChargeType.FIXED]  # fixed charges not in the elec price signal
+
+        if len(labels) == 0:
+            return None, self.type_tariffs_map
+
+        (date_list, prices) = self.get_cached_price_signals(labels, range_date, timestep, dtype)
+
+        return pd.DataFrame(prices, index=date_list, columns=labels, copy=False), self.type_tariffs_map
+
+    def get_price_in_range(self, label_tariff, date_range, timestep, dtype=np.float64):
+        """
+        Generate a dataframe of the price of a tariff label, sampled at 'timestep' period
+        remark: doesn't work with timestep > 1h ..
+
+        :param label_tariff: the label of the tariff
+        :param date_range: a tuple (t_start, t_end) of type 'datetime', representing the period
+        :param timestep: an element of TariffElemPeriod enumeration
+        :param dtype: [optional] the type of the prices, see get_electricity_price()
+        :return: a pandas dataframe with one float column named label_tariff, NaN where no tariff block is effective.
+        Its values are read-only, as they are shared with the price cache
+        """
+
+        (date_list, prices) = self.get_cached_price_signals([label_tariff], date_range, timestep, dtype)
+
+        return pd.DataFrame(prices, index=date_list, columns=[label_tariff], copy=False)
+
+    def get_cached_price_signals(self, labels, date_range, timestep, dtype=np.float64):
+        """
+        Compute the price signals of several tariff labels, sampled at 'timestep' period, or get them from the price
+        cache if they were already computed for the current tariffs
+        :param labels: a list of tariff labels
+        :param date_range: a tuple (t_start, t_end) of type 'datetime', representing the period
+        :param timestep: an element of TariffElemPeriod enumeration
+        :param dtype: [optional] the type of the prices, np.float64 or np.float32
+        :return: a tuple (pandas DatetimeIndex, numpy array) -> (dates, prices), prices being an array with one row per
+        date and one column per label, read-only if it is kept in the price cache. The array is in column-major order: the prices of each label are
+        contiguous, e.g. to be exported without copy
+        """
+
+        dtype = np.dtype(dtype)
+
+        (start_date_price, end_date_price) = date_range
+        key = (tuple(labels), pd.Timestamp(start_date_price), pd.Timestamp(end_date_price), timestep, dtype.str)
+
+        cached = self.price_cache.get(key, self.__tariff_version)
+        if cached is not None:
+            instrumentation.count('price_cache_hit')
+            return cached
+        instrumentation.count('price_cache_miss')
+
+        # Prepare the price array: one row per date, one column per label
         date_list = pd.date_range(start=start_date_price, end=end_date_price, freq=str(timestep.value))
+        prices = np.full((len(date_list), len(labels)), np.nan, dtype=dtype, order='F')
+
+        # Populate the array for each label, for each period
+        for i, label_tariff in enumerate(labels):
+            instrumentation.set_label(label_tariff)
+            t_start = instrumentation.start()
+            self.get_price_signal(label_tariff, date_list, timestep, out=prices[:, i])
+            instrumentation.stop(t_start, instrumentation.STAGE_PRICE_SIGNAL)
+        instrumentation.set_label('')
+
+        self.price_cache.put(key, self.__tariff_version, (date_list, prices), [prices, date_list.asi8])
+
+        return date_list, prices
+
+    def get_price_signal(self, label_tariff, dates, timestep, out=None):
+        """
+        Compute the price signal of a tariff label at regularly sampled dates.
+        Each day is priced with the first tariff block effective at its first period (see get_blocks_per_date()). The
+        prices of each block are then gathered from its compiled schedule.
+
+        :param label_tariff: the label of the tariff
+        :param dates: a sorted pandas DatetimeIndex, sampled at 'timestep' period
+        :param timestep: an element of TariffElemPeriod enumeration
+        :param out: [optional] a float numpy array with the same length as dates, to fill with the prices
+        :return: a float64 numpy array of the prices, NaN where no tariff block is effective
+        """
+
+        if out is None:
+            out = np.full(len(dates), np.nan, dtype=np.float64)
+
+        if len(dates) == 0:
+            return out
+
+        (list_blocks, block_per_date, local_dates) = self.get_blocks_per_date(label_tariff, dates, timestep)
+
+        for b_i in np.unique(block_per_date[block_per_date >= 0]):
+            mask_block = block_per_date == b_i
+            out[mask_block] = list_blocks[b_i].get_price_from_timestamps(local_dates[mask_block])
+
+        return out
+
+    def get_blocks_per_date(self, label_tariff, dates, timestep):
+        """
+        Find the tariff block applied at each of regularly sampled dates: each day is priced with the first tariff
+        block effective at its first period, as found from the block boundaries for all the days at once.
+
+        :param label_tariff: the label of the tariff
+        :param dates: a sorted, non-empty pandas DatetimeIndex, sampled at 'timestep' period
+        :param timestep: an element of TariffElemPeriod enumeration
+        :return: a tuple (list, numpy array, pandas DatetimeIndex) -> (blocks, block_per_date, local_dates), where
+        block_per_date is the position in blocks of the block of each date (-1 if no tariff block is effective), and
+        local_dates the dates in local time
+        """
+
+        local_dates = to_local_datetime_index(dates).values
+
+        # First period of each day
+        days = local_dates.astype('datetime64[D]')
+        day_starts = np.flatnonzero(np.r_[True, days[1:] != days[:-1]])
+        period_start = local_dates[day_starts]
+        period_end = period_start + pd.Timedelta(str(timestep.value)).to_timedelta64()
+
+        # Block of each day, the first added block having the priority
+        list_blocks = self.get_tariff_struct(label_tariff, (pd.Timestamp(period_start[0]), pd.Timestamp(period_end[-1])))
+        block_per_day = np.full(len(day_starts), -1, dtype=np.int64)
+        for b_i in range(len(list_blocks) - 1, -1, -1):
+            block_start = to_local_datetime64(list_blocks[b_i].startdate)
+            block_end = to_local_datetime64(list_blocks[b_i].enddate)
+            effective = ((block_start <= period_start) & (period_start <= block_end)) | ((period_start <= block_start) & (block_start <= period_end))
+            block_per_day[effective] = b_i
 
-        # Populate the dataframe for each label, for each period
-        ret_df = None
-        for label_tariff in list(self.__tariffstructures.keys()):
+        block_per_date = np.repeat(block_per_day, np.diff(np.r_[day_starts, len(local_dates)]))
 
-            if self.type_tariffs_map[label_tariff] == ChargeType.FIXED:  # fixed charges not in the elec price signal
+        return list_blocks, block_per_date, pd.DatetimeIndex(local_dates)
+
+    def get_price_from_timestamps(self, timestamps, labels=None, tz=None):
+        """
+        Return the price of each tariff label at each of the given instants, like calling get_price_from_timestamp() on
+        the effective tariff block of every instant, but in vectorized passes.
+        When several blocks are effective at the same instant, the first one added to the structure is used.
+
+        :param timestamps: a pandas DatetimeIndex or an array of epoch timestamps (in seconds), in any order.
+        Naive dates are in local time, like the data given to compute_bill().
+        :param labels: [optional] the list of tariff labels to price. All the labels are priced by default.
+        :param tz: [optional] the timezone of the tariff, to read epoch timestamps and timezone-aware dates in local
+        time, see to_local_datetime_index()
+        :return: a dictionary mapping each tariff label to a float64 numpy array with the same length as 'timestamps',
+        NaN where no tariff block is effective
+        """
+
+        dates = to_local_datetime_index(timestamps, tz)
+        dates_values = dates.values
+
+        # Sort the instants once, to find the instants covered by each block with a binary search
+        order = np.argsort(dates_values, kind='stable')
+        sorted_dates = dates_values[order]
+
+        if labels is None:
+            labels = list(self.__tariffstructures.keys())
+
+        ret = {}
+        for label_tariff in labels:
+            prices = np.full(len(dates), np.nan, dtype=np.float64)
+            if len(dates) == 0:
+                ret[label_tariff] = prices
                 continue
 
-            df_for_label = self.get_price_in_range(label_tariff, range_date, timestep)
+            list_blocks = self.get_tariff_struct(label_tariff, (pd.Timestamp(sorted_dates[0]), pd.Timestamp(sorted_dates[-1])))
 
-            if ret_df is None:
-                ret_df = df_for_label
-            else:
-                ret_df = pd.concat([ret_df, df_for_label], axis=1)
+            # Position of the block effective at each instant, the first added block having the priority
+            block_pos = np.full(len(dates), -1, dtype=np.int64)
+            for b_i in range(len(list_blocks) - 1, -1, -1):
+                tariff_block = list_blocks[b_i]
+                idx_start = np.searchsorted(sorted_dates, to_local_datetime64(tariff_block.startdate), side='left')
+                idx_end = np.searchsorted(sorted_dates, to_local_datetime64(tariff_block.enddate), side='right')
+                block_pos[order[idx_start:idx_end]] = b_i
 
-        return ret_df, self.type_tariffs_map
+            for b_i in np.unique(block_pos[block_pos >= 0]):
+                mask_block = block_pos == b_i
+                prices[mask_block] = list_blocks[b_i].get_price_from_timestamps(dates[mask_block])
 
-    def get_price_in_range(self, label_tariff, date_range, timestep):
+            ret[label_tariff] = prices
+
+        return ret
+
+    def get_linear_cost_coefficients(self, range_date, timestep, billing_cycles=None):
         """
-        Generate a dataframe of the price of
-        remark: doesn't work with timestep > 1h ..
+        Compute the cost of electricity in the specified time frame as the coefficients of a linear optimization
+        problem, whose variables are the energy consumed at each time step, see LinearCostCoefficients.
+        Each day is priced with the first tariff block effective at its first period, as in get_electricity_price().
+
+        The demand of a time step is its average power, which is the demand of the tariffs when the timestep is at
+        least their demand window (15 minutes by default), a warning being issued otherwise. The tiered energy rates
+        (BlockRate) are not linear: the rate of their first block is used.
+
+        :param range_date: a tuple (t_start, t_end) of type 'datetime', representing the period
+        :param timestep: an element of TariffElemPeriod enumeration (1h, 30min or 15min), the time step of the problem
+        :param billing_cycles: [optional] a BillingCycleCalendar, defining the periods of the demand charges. By
+        default, the natural months of the calendar
+        :return: a LinearCostCoefficients
         """
 
-        # Prepare the Pandas dataframe
-        (start_date_price, end_date_price) = date_range
-        date_range = pd.date_range(start=start_date_price, end=end_date_price, freq=str(timestep.value))
-        ret_df = pd.DataFrame(index=date_range, columns=[label_tariff])
+        if billing_cycles is None:
+            billing_cycles = BillingCycleCalendar()
+
+        (start_date, end_date) = range_date
+        dates = pd.date_range(start=start_date, end=end_date, freq=str(timestep.value))
+        timestep_seconds = pd.Timedelta(str(timestep.value)).total_seconds()
+
+        energy_cost = np.zeros(len(dates), dtype=np.float64)
+        fixed_cost = 0.0
+        (demand_rows, demand_cols, demand_coeffs, demand_prices, demand_groups) = ([], [], [], [], [])
 
-        # # Select the corresponding blocks for each day and generate the time dataframe
-        for idx_day, df_day in ret_df.groupby(ret_df.index.date):
-            date_range_period = pd.date_range(start=df_day.index[0], periods=2, freq=str(timestep.value))
-            tariff_block = self.get_tariff_struct(label_tariff, (date_range_period[0], date_range_period[1]))
+        if len(dates) == 0:
+            return LinearCostCoefficients(dates, energy_cost, np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64),
+                                          np.zeros(0), np.zeros(0), [])
 
-            if len(tariff_block) > 0:
-                daily_rate = tariff_block[0].rate_schedule.get_daily_rate(df_day.index[0])
-                rate_df = tariff_block[0].get_daily_price_dataframe(daily_rate, df_day)
-                ret_df.loc[df_day.index[:], label_tariff] = rate_df['price'].values
+        # Billing cycle of each time step
+        cycle_labels, cycle_bounds = billing_cycles.get_cycle_bounds(dates)
+        cycle_codes = np.full(len(dates), -1, dtype=np.int64)
+        for i in range(len(cycle_labels)):
+            cycle_codes[cycle_bounds[i]:cycle_bounds[i+1]] = i
 
-        return ret_df
+        for label_tariff, tariff_type in list(self.get_tariff_types().items()):
+
+            if tariff_type == ChargeType.FIXED:
+                for tariff_block in self.get_tariff_struct_for_data(label_tariff, dates):
+                    for (_, cost) in list(tariff_block.compute_bill(pd.DataFrame(index=dates), None, billing_cycles).values()):
+                        fixed_cost += cost
+                continue
+
+            (list_blocks, block_per_date, local_dates) = self.get_blocks_per_date(label_tariff, dates, timestep)
+
+            for b_i in np.unique(block_per_date[block_per_date >= 0]):
+                tariff_block = list_blocks[b_i]
+                steps = np.flatnonzero(block_per_date == b_i)
+                prices, rate_codes = tariff_block.get_prices(local_dates[steps], return_codes=True)
+                priced = ~np.isnan(prices)
+                unit_cost = float(tariff_block.unit_cost.value)
+                unit_metric = float(tariff_block.unit_metric.value)
+
+                if tariff_type == ChargeType.ENERGY:
+                    energy_cost[steps[priced]] += prices[priced] * unit_cost / unit_metric
+                    continue
+
+                if tariff_block.demand_window.total_seconds() > timestep_seconds:
+                    warnings.warn("The demand window of '{0}' is longer than the timestep: the demand is the average "
+                                  "power of each time step".format(label_tariff), stacklevel=2)
+
+                # One demand group per (billing cycle, demand period) of this block, the demand period of a time step
+                # being the code of its rate
+                in_group = priced & (cycle_codes[steps] >= 0)
+                steps = steps[in_group]
+                rate_codes = rate_codes[in_group].astype(np.int64)
+
+                compiled_schedule = tariff_block.rate_schedule.compiled
+                group_keys = cycle_codes[steps] * len(compiled_schedule.rates) + rate_codes
+                (keys, first_steps, group_pos) = np.unique(group_keys, return_index=True, return_inverse=True)
+
+                demand_rows.append(len(demand_prices) + group_pos)
+                demand_cols.append(steps)
+                demand_coeffs.append(np.full(len(steps), 3600 / (timestep_seconds * unit_metric)))
+
+                # The demand period is identified by its daily mask, on the day of its first time step
+                calendar = CalendarIndex.get(local_dates[steps[first_steps]])
+                day_types = calendar.get_day_types(tariff_block.rate_schedule.holiday_calendar)
+
+                for i, (first_step, rate_code) in enumerate(zip(first_steps, rate_codes[first_steps])):
+                    mask = compiled_schedule.get_period_mask(rate_code, calendar.months[i], day_types[i])
+                    demand_prices.append(unit_cost * float(compiled_schedule.rates[rate_code]))
+                    demand_groups.append((label_tariff, cycle_labels[cycle_codes[steps[first_step]]],
+                                          ''.join('1' if b else '0' for b in mask)))
+
+        if len(demand_rows) > 0:
+            (demand_rows, demand_cols, demand_coeffs) = (np.concatenate(demand_rows), np.concatenate(demand_cols),
+                                                         np.concatenate(demand_coeffs))
+        else:
+            (demand_rows, demand_cols, demand_coeffs) = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64),
+                                                         np.zeros(0))
+
+        return LinearCostCoefficients(dates, energy_cost, demand_rows, demand_cols, demand_coeffs,
+                                      np.array(demand_prices, dtype=np.float64), demand_groups, fixed_cost)
 
     def print_aggregated_bill(self, bill_struct, verbose=True):
         """
@@ -197,7 +653,7 @@ class ElectricityRateManager(object):
          - tt is the total cost per type of tariff (energy, fix, demand)
          - ttt is the cost for each tariff label
 
-        :param bill_struct: the dictionary returned by compute_bill()
+        :param bill_struct: the dictionary or the Bill returned by compute_bill()
         :param verbose: [optional, default is True] print details
         :return:
         """
@@ -205,11 +661,18 @@ class ElectricityRateManager(object):
         monthly_detailed = False
 
         # If the first keys of the dict point to smth that is not the tariff type, this is a monthly bill
-        first_keys_bill_struct = list(bill_struct.keys())
-        if first_keys_bill_struct[0] not in list(self.__tariffstructures.keys()):
-            monthly_detailed = True
+        if not isinstance(bill_struct, Bill):
+            first_keys_bill_struct = list(bill_struct.keys())
+            if first_keys_bill_struct[0] not in list(self.__tariffstructures.keys()):
+                monthly_detailed = True
 
-        if monthly_detailed is True:  # This supposes the bill is calculated per natural month of the calendar
+        if isinstance(bill_struct, Bill):  # The totals are computed on the lines of the bill
+
+            acc_tot = bill_struct.get_total_cost()
+            acc_per_chargetype = bill_struct.get_cost_per_charge_type()
+            acc_per_label = bill_struct.get_cost_per_label()
+
+        elif monthly_detailed is True:  # This supposes the bill is calculated per natural month of the calendar
 
             # Aggregation of all the months
 
@@ -226,7 +689,7 @@ class ElectricityRateManager(object):
                     else:
                         cost_per_tariff = 0.0
                         for p, data_demand in list(data.items()):
-                            cost_per_tariff += p * data_demand['max-demand']
+                            cost_per_tariff += data_demand.get('cost', p * data_demand['max-demand'])
                     acc_tot += cost_per_tariff  # second item in data is in dollar
                     acc_per_chargetype[self.type_tariffs_map[lab_tariff]] += cost_per_tariff
                     acc_per_label[lab_tariff] += cost_per_tariff
@@ -243,7 +706,7 @@ class ElectricityRateManager(object):
                 else:
                     cost_per_tariff = 0.0
                     for p, data_demand in list(data.items()):
-                        cost_per_tariff += p * data_demand['max-demand']
+                        cost_per_tariff += data_demand.get('cost', p * data_demand['max-demand'])
 
                 acc_tot += cost_per_tariff  # second item in data is in dollar
                 acc_per_chargetype[self.type_tariffs_map[lab_tariff]] += cost_per_tariff
@@ -294,6 +757,10 @@ class ElectricityRateManager(object):
             self.__tariffstructures[tariff_label] = self.generate_type_tariff(tariff_type)
 
         self.__tariffstructures[tariff_label]['list_blocks'].append(tariff_obj)
+        self.__tariffstructures[tariff_label]['index_blocks'].add(tariff_obj)
+
+        # The price signals computed so far are not valid anymore
+        self.__tariff_version += 1
 
     def get_tariff_struct(self, label_tariff, dates=None):
         """
@@ -310,15 +777,42 @@ class ElectricityRateManager(object):
             return list_struct
         else:
             (start_sel, end_sel) = dates
-            if start_sel.tzinfo is None and len(list_struct) > 0:
-                first_block = list_struct[0]
-                start_sel = start_sel.replace(tzinfo=pytz.timezone('UTC'))
 
-            if end_sel.tzinfo is None and len(list_struct) > 0:
-                first_block = list_struct[0]
-                end_sel = end_sel.replace(tzinfo=pytz.timezone('UTC'))
-                
-            return [obj for obj in list_struct if ((obj.startdate <= start_sel <= obj.enddate) or (start_sel <= obj.startdate <= end_sel))]
+            # Binary search in the blocks sorted by date. Naive dates are taken as UTC
+            return self.__tariffstructures[label_tariff]['index_blocks'].get_blocks_in_range(start_sel, end_sel)
+
+    def get_tariff_struct_for_data(self, label_tariff, index):
+        """
+        Get the list of "tariff blocks" effective during the data of a DatetimeIndex. The blocks are selected on the
+        local (wall clock) time of the data, which is the time their window is applied on (see
+        TariffBase.get_window_bounds()), so that timezone-aware data are billed like their local time
+        :param label_tariff: a string pointing to the type of tariff
+        :param index: a sorted pandas DatetimeIndex, naive or timezone-aware
+        :return: a list of TariffBase (or children) describing the tariffs
+        """
+
+        if len(index) == 0:
+            return []
+
+        return self.get_tariff_struct(label_tariff, (to_local_datetime_index(index[:1])[0],
+                                                     to_local_datetime_index(index[-1:])[0]))
+
+    @property
+    def tariff_version(self):
+        """
+        GETTER of the version of the tariff structure, increased each time a tariff block is added
+        :return: an int
+        """
+
+        return self.__tariff_version
+
+    def get_tariff_types(self):
+        """
+        Get the type of each tariff label, including the labels without tariff blocks
+        :return: a dict mapping each tariff label to its ChargeType, in the order the labels were added
+        """
+
+        return {label: tariff_data['type'] for label, tariff_data in self.__tariffstructures.items()}
 
     def update_bill_structure(self, intermediate_monthly_bill, label_tariff, new_data):
         """
@@ -356,38 +850,39 @@ class ElectricityRateManager(object):
 
     def aggregate_monthly_bill(self, monthly_bill):
         """
+        Aggregate a bill detailed per billing cycle:
+         - In case of "demand charge per (k)W", apply MAX for each period
+         - In case of "energy charge per (k)Wh or fixed cost per month", apply SUM
+        :param monthly_bill: the dict structure as return by the compute_bill() method with monthly_detailed set to True
+        :return: the dict structure as return by the compute_bill() method with monthly_detailed set to False
+        """
 
-        :param monthly_bill:
-        :return: /
+        if len(monthly_bill) == 0:
+            return None
+
+        return Bill.from_dict(monthly_bill, self.get_tariff_types()).to_dict(monthly_detailed=False)
+
+    def generate_bill_structure(self, cycle_labels):
+        """
+        Create an empty bill, detailed per billing cycle
+        :param cycle_labels: a list of string, the labels of the billing cycles
+        :return: a dict formatted as the output of compute_bill() with monthly_detailed set to True
         """
 
-        data_merge = None
-        for m, data_per_label in list(monthly_bill.items()):
-            if data_merge is None:
-                data_merge = data_per_label
-            else:
-                for label_tariff, data_tariff in list(data_per_label.items()):
-                    if self.type_tariffs_map[label_tariff] == ChargeType.DEMAND:  # take max
-                        for p, data in list(data_tariff.items()):  # For each price -> dict (mask, max, date)
-                            this_mask = data['mask']  # get the new data mask
-                            existing_mask_price = [k for k, v in list(data_merge[label_tariff].items()) if v['mask'] == this_mask]
-
-                            if len(existing_mask_price) > 0:  # this mask has already been seen: APPLY MAX
-                                existing_mask_price = existing_mask_price[0]
-                                if data['max-demand'] > data_merge[label_tariff][existing_mask_price]['max-demand']:
-                                    #print("Demand rate update: for mask {1}, {0} is greater than {2}".format(this_mask, data, data_merge[label_tariff][p]))  # debug
-                                    del data_merge[label_tariff][existing_mask_price]
-                                    data_merge[label_tariff][p] = data
-                            else:  # This is the first time this price has been seen: store it
-                                data_merge[label_tariff][p] = data
-                    else:  # sum
-                        data_merge[label_tariff] = (data_merge[label_tariff][0] + data_tariff[0],
-                                                    data_merge[label_tariff][1] + data_tariff[1])
-
-        return data_merge
+        ret = {}
+
+        for cycle_label in cycle_labels:
+            ret[cycle_label] = {}
+            for k in list(self.__tariffstructures.keys()):
+                if self.type_tariffs_map[k] == ChargeType.DEMAND:
+                    ret[cycle_label][k] = {}  # a dict of price -> (max, cost)
+                else:
+                    ret[cycle_label][k] = (0, 0)  # a tuple
 
+        return ret
 
     @staticmethod
     def generate_type_tariff(type_tariff):
         return {'type': type_tariff,
-                'list_blocks': []}
+                'list_blocks': [],
+                'index_blocks': TariffBlockIndex()}
@@ -3,7 +3,10 @@ __author__ = 'Olivier Van Cutsem'
 from enum import Enum
 from datetime import datetime
 
-import holidays
+import numpy as np
+
+from .calendar_structure import HolidayCalendar, CalendarIndex, get_holiday_calendar
+from . import instrumentation
 
 # --------------- Schedule structures --------------- #
 
@@ -28,7 +31,7 @@ class TouRateSchedule:
                 "daily_label1:
                 {
                     "days_list": [d1, d2, ...],
-                    "rates": list OR float
+                    "rates": list OR float (each rate being a float or a BlockRate)
                 },
                 ...
             }
@@ -40,24 +43,31 @@ class TouRateSchedule:
 
     """
 
-    # TODO: use BlockRate instead of assuming it's a float !
-
     # Keys used internally
     MONTHLIST_KEY = 'months_list'
     DAILY_RATE_KEY = 'daily_rates'
     DAYSLIST_KEY = 'days_list'
     RATES_KEY = 'rates'
 
-    def __init__(self, rates_schedule):
+    def __init__(self, rates_schedule, holiday_calendar=None):
         """
         Constructor
         :param rates_schedule: a dict formatted as explain in the class description
+        :param holiday_calendar: [optional] the HolidayCalendar used to find the holidays. The calendar of California is
+        used by default.
         """
 
         # TODO: assert the format is correct
 
         self.__rates = rates_schedule
 
+        if holiday_calendar is None:
+            holiday_calendar = get_holiday_calendar()
+        self.__holiday_calendar = holiday_calendar
+
+        # The dense version of the dict above, used for all the lookups
+        self.__compiled = CompiledRateSchedule.from_rates_schedule(rates_schedule)
+
     def get_from_timestamp(self, date):
         """
         Return the rate corresponding to a given timestamp
@@ -71,14 +81,36 @@ class TouRateSchedule:
         else:
             date_struct = date
 
-        m_date = date_struct.month
-        d_date = date_struct.weekday()
-        h_date = date_struct.hour
-        min_date = date_struct.minute
+        return self.__compiled.get_rate_at(date_struct.month, date_struct.weekday(), (date_struct.hour, date_struct.minute))
+
+    def get_from_timestamps(self, dates):
+        """
+        Vectorized version of get_from_timestamp().
+        Unlike get_from_timestamp(), the holidays are taken into account, as in get_daily_rate().
+
+        :param dates: a pandas DatetimeIndex or an array of epoch timestamps (in seconds, UTC), in any order
+        :return: a float64 numpy array of the rates, NaN if there is no associated rate
+        """
+
+        return self.__compiled.rates[self.get_rate_codes(dates)]
+
+    def get_rate_codes(self, dates, tz=None):
+        """
+        Return, for each date, the position of its rate in the 'rates' vector of the compiled schedule
+        :param dates: a pandas DatetimeIndex or an array of epoch timestamps (in seconds, UTC), in any order
+        :param tz: [optional] the timezone of the tariff, see to_local_datetime_index()
+        :return: an unsigned int numpy array
+        """
+
+        t_start = instrumentation.start()
 
-        rates = self.get_rate(m_date, d_date)
+        calendar = CalendarIndex.get(dates, tz)
+        rate_codes = self.__compiled.lookup_codes(calendar.months, calendar.get_day_types(self.__holiday_calendar),
+                                                  calendar.get_slots(self.__compiled.slots))
 
-        return self.get_rate_in_day(rates, (h_date, min_date))
+        instrumentation.stop(t_start, instrumentation.STAGE_PRICE_GATHER)
+
+        return rate_codes
 
     def get_daily_rate(self, date):
         """
@@ -93,7 +125,7 @@ class TouRateSchedule:
             date_struct = date
 
         m_date = date_struct.month
-        d_date = self.get_day_in_the_week(date_struct)
+        d_date = self.__holiday_calendar.get_day_type(date_struct)
 
         rate_struct = self.get_rate(m_date, d_date)
 
@@ -104,18 +136,24 @@ class TouRateSchedule:
 
     # --- private
     @staticmethod
-    def get_day_in_the_week(date_sel):
+    def get_day_in_the_week(date_sel, holiday_calendar=None):
         """
-        TODO write description
+        Return the day in the week used to select the daily rates of a date
 
-        :param date_sel:
-        :return:
+        :param date_sel: a date or datetime
+        :param holiday_calendar: [optional] the HolidayCalendar used to find the holidays, California by default
+        :return: an int, from 0 to 6
         """
 
-        if date_sel in holidays.US(state='CA', years=date_sel.year):
+        if holiday_calendar is None:
+            holiday_calendar = get_holiday_calendar()
+
+        day_type = holiday_calendar.get_day_type(date_sel)
+
+        if day_type == HolidayCalendar.HOLIDAY:
             return 0  # Hardcoded: holidays are like Sundays ...
         else:
-            return date_sel.weekday()
+            return day_type
 
     def get_rate_in_day(self, rate_struct, time_select):
         """
@@ -135,19 +173,14 @@ class TouRateSchedule:
 
     def get_rate(self, m_date, d_date):
         """
-        TODO write description
+        Return the rate(s) of a given day, as stored in the schedule
 
-        :param self:
-        :param m_date:
-        :param d_date:
-        :return:
+        :param m_date: the month, from 1 to 12
+        :param d_date: the day in the week, from 0 to 6, or HolidayCalendar.HOLIDAY
+        :return: a list of float, a float if the rate is flat over the day, or None if there is no associated rate
         """
 
-        for m_lab, m_data in list(self.__rates.items()):
-            if m_date in m_data[self.MONTHLIST_KEY]:
-                for d_lab, d_data in list(m_data[self.DAILY_RATE_KEY].items()):
-                    if d_date in d_data[self.DAYSLIST_KEY]:
-                        return d_data[self.RATES_KEY]
+        return self.__compiled.get_rate(m_date, d_date)
 
     @property
     def periods_in_day(self):
@@ -169,6 +202,232 @@ class TouRateSchedule:
         """
         return self.__rates
 
+    @property
+    def compiled(self):
+        """
+        The dense lookup table built from the raw tariff rates, see CompiledRateSchedule
+        """
+        return self.__compiled
+
+    @property
+    def holiday_calendar(self):
+        """
+        The HolidayCalendar used to find the holidays
+        """
+        return self.__holiday_calendar
+
+
+class CompiledRateSchedule(object):
+    """
+    This structure is the dense form of a TouRateSchedule, built once from its dict:
+     - 'rates' is a float64 vector of the distinct rates of the schedule. A NaN stands for "no associated rate".
+     - 'index' is an array of shape (12, NB_DAY_TYPES, slots) mapping each (month, day type, slot of the day) to a
+     position in 'rates'. The day is split in 'slots' slots of equal length.
+     - 'native_slots' is an array of shape (12, NB_DAY_TYPES) storing, for each (month, day type), the number of rates
+     given in the schedule for that day (1 for a flat rate)
+     - 'block_rates' is None if all the rates are floats. Otherwise, it is a list with the same length as 'rates',
+     pointing to the BlockRate of each tiered rate (None for the flat ones). For a tiered rate, 'rates' stores the rate
+     of its first block.
+
+    Remark: the months are stored from 0 (january) to 11 (december) ; the day types follow datetime.weekday(), from 0
+    (monday) to 6 (sunday), and the last row is dedicated to holidays
+    """
+
+    __slots__ = ('rates', 'index', 'native_slots', 'block_rates')
+
+    NB_DAY_TYPES = 8
+    HOLIDAY = HolidayCalendar.HOLIDAY  # Holidays are priced like the day type 0
+
+    def __init__(self, rates, index, native_slots, block_rates=None):
+        """
+        Constructor
+        :param rates: a float64 numpy array, the distinct rates
+        :param index: an unsigned int numpy array of shape (12, NB_DAY_TYPES, slots), pointing to 'rates'
+        :param native_slots: an int numpy array of shape (12, NB_DAY_TYPES)
+        :param block_rates: [optional] a list of BlockRate or None, see the class description
+        """
+
+        self.rates = rates
+        self.index = index
+        self.native_slots = native_slots
+        self.block_rates = block_rates
+
+    @classmethod
+    def from_rates_schedule(cls, rates_schedule):
+        """
+        Compile the dict of a TouRateSchedule
+        :param rates_schedule: a dict formatted as explained in TouRateSchedule
+        :return: a CompiledRateSchedule
+        """
+
+        # The rates of each (month, day type), following the dict order
+        daily_rates = {}
+        for m_i in range(12):
+            for d_i in range(cls.NB_DAY_TYPES):
+                daily_rates[(m_i, d_i)] = cls.__find_daily_rate(rates_schedule, m_i + 1, d_i if d_i != cls.HOLIDAY else 0)
+
+        native_slots = np.ones((12, cls.NB_DAY_TYPES), dtype=np.int32)
+        for (m_i, d_i), rate in list(daily_rates.items()):
+            if type(rate) is list and len(rate) > 0:
+                native_slots[m_i, d_i] = len(rate)
+
+        slots = int(np.lcm.reduce(native_slots.ravel()))
+
+        # Map each distinct rate to its position in the rates vector
+        rates_pos = {}
+        rates_list = []
+        block_rates = []
+        index = np.zeros((12, cls.NB_DAY_TYPES, slots), dtype=np.int64)
+        for (m_i, d_i), rate in list(daily_rates.items()):
+            if type(rate) is not list or len(rate) == 0:
+                rate = [rate]
+            day_pos = []
+            for r in rate:
+                block_r = None
+                if isinstance(r, BlockRate):
+                    block_r = r
+                    r = float(r.get_rate())
+                    key = block_r
+                else:
+                    r = float('nan') if r is None else float(r)
+                    key = 'nan' if r != r else r
+                if key not in rates_pos:
+                    rates_pos[key] = len(rates_list)
+                    rates_list.append(r)
+                    block_rates.append(block_r)
+                day_pos.append(rates_pos[key])
+            index[m_i, d_i, :] = np.repeat(day_pos, slots // len(day_pos))
+
+        index_dtype = np.uint8 if len(rates_list) <= np.iinfo(np.uint8).max + 1 else np.uint16
+
+        if all(b is None for b in block_rates):
+            block_rates = None
+
+        return cls(np.array(rates_list, dtype=np.float64), index.astype(index_dtype), native_slots, block_rates)
+
+    @staticmethod
+    def __find_daily_rate(rates_schedule, m_date, d_date):
+        """
+        Walk the dict of a TouRateSchedule to find the rate(s) of a given day
+        :return: the raw rates of the day (list or float), or None if there is no associated rate
+        """
+
+        for m_lab, m_data in list(rates_schedule.items()):
+            if m_date in m_data[TouRateSchedule.MONTHLIST_KEY]:
+                for d_lab, d_data in list(m_data[TouRateSchedule.DAILY_RATE_KEY].items()):
+                    if d_date in d_data[TouRateSchedule.DAYSLIST_KEY]:
+                        return d_data[TouRateSchedule.RATES_KEY]
+
+        return None
+
+    @property
+    def slots(self):
+        """
+        The number of slots in a day
+        """
+        return self.index.shape[2]
+
+    def get_rate(self, m_date, d_date):
+        """
+        Return the rate(s) of a given day, in their native resolution
+        :param m_date: the month, from 1 to 12
+        :param d_date: the day type, from 0 to NB_DAY_TYPES-1
+        :return: a list of float, a float if the rate is flat over the day, or None if there is no associated rate
+        """
+
+        nb_rates = self.native_slots[m_date - 1, d_date]
+        rates = self.rates[self.index[m_date - 1, d_date, ::self.slots // nb_rates]]
+
+        if np.isnan(rates).any():
+            rates = [None if r != r else r for r in rates.tolist()]
+        else:
+            rates = rates.tolist()
+
+        if nb_rates == 1:
+            return rates[0]
+        else:
+            return rates
+
+    def get_period_mask(self, code, m_date, d_date):
+        """
+        Return the daily mask of a rate on a given day, in the native resolution of the day
+        :param code: the position of the rate in 'rates'
+        :param m_date: the month, from 1 to 12
+        :param d_date: the day type, from 0 to NB_DAY_TYPES-1
+        :return: a list of bool, one per rate of the day
+        """
+
+        step = self.slots // self.native_slots[m_date - 1, d_date]
+
+        return (self.index[m_date - 1, d_date, ::step] == code).tolist()
+
+    def get_rate_at(self, m_date, d_date, time_select):
+        """
+        Return the rate at a given instant
+        :param m_date: the month, from 1 to 12
+        :param d_date: the day type, from 0 to NB_DAY_TYPES-1
+        :param time_select: a tuple (h, m) representing the hour and minute to select
+        :return: a float, or None if there is no associated rate
+        """
+
+        (h, m) = time_select
+        rate = self.rates[self.index[m_date - 1, d_date, ((60 * h + m) * self.slots) // 1440]]
+
+        return None if np.isnan(rate) else float(rate)
+
+    def lookup(self, months, day_types, slots):
+        """
+        Vectorized lookup of the rates
+        :param months: an int array of months, from 1 to 12
+        :param day_types: an int array of day types, from 0 to NB_DAY_TYPES-1
+        :param slots: an int array of slots, from 0 to self.slots-1
+        :return: a float64 numpy array
+        """
+
+        return self.rates[self.lookup_codes(months, day_types, slots)]
+
+    def lookup_codes(self, months, day_types, slots):
+        """
+        Vectorized lookup of the positions of the rates in the 'rates' vector
+        :param months: an int array of months, from 1 to 12
+        :param day_types: an int array of day types, from 0 to NB_DAY_TYPES-1
+        :param slots: an int array of slots, from 0 to self.slots-1
+        :return: an unsigned int numpy array
+        """
+
+        return self.index[np.asarray(months) - 1, day_types, slots]
+
+    @property
+    def tiered(self):
+        """
+        True if some of the rates are BlockRate
+        """
+        return self.block_rates is not None
+
+    def get_cost(self, codes, consumption, initial_consumption=0.0):
+        """
+        Compute the cost of consuming 'consumption' at each position, given the positions 'codes' of the rates.
+        The tiered rates are applied on the consumption accumulated from the first position.
+
+        :param codes: an int array, positions in the 'rates' vector as returned by lookup_codes()
+        :param consumption: a float64 array with the same length as 'codes'
+        :param initial_consumption: [optional] the consumption already accumulated before the first position
+        :return: a float64 numpy array, the cost at each position
+        """
+
+        cost = self.rates[codes] * consumption
+
+        if self.block_rates is not None:
+            acc_end = initial_consumption + np.cumsum(consumption)
+            acc_start = acc_end - consumption
+            for code in np.unique(codes):
+                block_r = self.block_rates[code]
+                if block_r is not None:
+                    mask_code = codes == code
+                    cost[mask_code] = block_r.get_cumulative_cost(acc_end[mask_code]) - block_r.get_cumulative_cost(acc_start[mask_code])
+
+        return cost
+
 
 class BlockRate:
     """
@@ -176,6 +435,12 @@ class BlockRate:
     """
 
     def __init__(self, cost_base, block_rate=None):
+        """
+        Constructor
+        :param cost_base: the rate of the first block, starting at 0
+        :param block_rate: [optional] a tuple (costs, thresholds) of lists of the same length, where the i-th cost is
+        applied from the i-th threshold of accumulated consumption
+        """
 
         self.__rates = [cost_base]
         self.__thresholds = [0]
@@ -188,15 +453,68 @@ class BlockRate:
 
         self.__thresholds.append(float('inf'))
 
+        # Arrays used for the vectorized methods: the lower bound of each block and the cost accumulated until it
+        self.__rates_array = np.array(self.__rates, dtype=np.float64)
+        self.__lower_bounds = np.array(self.__thresholds[:-1], dtype=np.float64)
+        self.__cost_at_bounds = np.concatenate(([0.0], np.cumsum(self.__rates_array[:-1] * np.diff(self.__lower_bounds))))
+
     def get_rate(self, acc=None):
         """
-
-        :param acc:
-        :return:
+        Return the rate applied once 'acc' has been consumed
+        :param acc: [optional] the accumulated consumption. If None, the rate of the first block is returned.
+        :return: a float
         """
 
         if acc is None:
             return self.__rates[0]
         else:
-            return [self.__rates[i] for i in range(len(self.__rates)) if self.__thresholds[i] <= acc < self.__thresholds[i+1]][0]
+            return self.__rates[self.__get_blocks(acc)]
+
+    def get_rates(self, acc):
+        """
+        Vectorized version of get_rate()
+        :param acc: a numpy array of accumulated consumption
+        :return: a float64 numpy array
+        """
+
+        return self.__rates_array[self.__get_blocks(acc)]
+
+    def get_cumulative_cost(self, acc):
+        """
+        Return the cost of consuming 'acc' from 0, each part of it being priced at the rate of its block.
+        The cost of consuming from acc_0 to acc_1 is therefore get_cumulative_cost(acc_1) - get_cumulative_cost(acc_0).
+
+        :param acc: a float, or a numpy array of accumulated consumption
+        :return: a float or a float64 numpy array
+        """
+
+        idx_block = self.__get_blocks(acc)
+
+        return self.__cost_at_bounds[idx_block] + self.__rates_array[idx_block] * (acc - self.__lower_bounds[idx_block])
+
+    def __get_blocks(self, acc):
+        """
+        Return the block(s) in which 'acc' falls, with a binary search over the thresholds
+        """
+
+        return np.maximum(np.searchsorted(self.__lower_bounds, acc, side='right') - 1, 0)
+
+    @property
+    def rates(self):
+        return list(self.__rates)
+
+    @property
+    def thresholds(self):
+        return list(self.__thresholds)
+
+    def __eq__(self, other):
+        return isinstance(other, BlockRate) and self.__rates == other.rates and self.__thresholds == other.thresholds
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash((tuple(self.__rates), tuple(self.__thresholds)))
 
+    def __repr__(self):
+        return 'BlockRate({0}, {1})'.format(self.__rates, self.__thresholds[1:-1])
@@ -0,0 +1,226 @@
+__author__ = 'Olivier Van Cutsem'
+
+import numpy as np
+import pandas as pd
+
+from .calendar_structure import BillingCycleCalendar
+from .tariff_structure import TouDemandChargeTariff
+from .fleet_billing import compute_fleet_bills
+
+# --------------- TARIFF COMPARISON --------------- #
+
+# The window over which the peak demand of a meter is measured, for the eligibility of the tariffs: the default demand
+# window of TouDemandChargeTariff
+ELIGIBILITY_DEMAND_WINDOW = pd.Timedelta(minutes=15)
+
+
+class MeterProfile(object):
+    """
+    This structure stores the aggregates of a meter used to check the eligibility of the tariffs, computed once for
+    all the tariffs compared: the peak demand (kW) and the energy consumption (kWh) of each billing cycle.
+    """
+
+    def __init__(self, meter_series, billing_cycles=None, demand_window=ELIGIBILITY_DEMAND_WINDOW):
+        """
+        Constructor
+        :param meter_series: a pandas Series of energy consumption (in Wh), with a sorted DatetimeIndex
+        :param billing_cycles: [optional] a BillingCycleCalendar, the natural months by default
+        :param demand_window: [optional] the window over which the peak demand is measured, ELIGIBILITY_DEMAND_WINDOW by
+        default
+        """
+
+        if billing_cycles is None:
+            billing_cycles = BillingCycleCalendar()
+
+        self.cycle_labels, bounds = billing_cycles.get_cycle_bounds(meter_series.index)
+
+        values = np.asarray(meter_series.values, dtype=np.float64)
+        demand = self.get_demand_values(meter_series, demand_window)
+
+        self.peak_kw = np.zeros(len(self.cycle_labels))
+        self.energy_kwh = np.zeros(len(self.cycle_labels))
+        for i in range(len(self.cycle_labels)):
+            if bounds[i] == bounds[i+1]:
+                continue
+            self.energy_kwh[i] = np.nansum(values[bounds[i]:bounds[i+1]]) / 1000.0
+            demand_cycle = demand[bounds[i]:bounds[i+1]]
+            if not np.isnan(demand_cycle).all():
+                self.peak_kw[i] = np.nanmax(demand_cycle)
+
+    @property
+    def max_peak_kw(self):
+        """
+        GETTER of the highest peak demand of the billing cycles
+        :return: a float, in kW
+        """
+
+        if len(self.peak_kw) == 0:
+            return 0.0
+
+        return float(self.peak_kw.max())
+
+    @property
+    def max_energy_kwh(self):
+        """
+        GETTER of the highest energy consumption of the billing cycles
+        :return: a float, in kWh
+        """
+
+        if len(self.energy_kwh) == 0:
+            return 0.0
+
+        return float(self.energy_kwh.max())
+
+    def check_eligibility(self, rate_manager):
+        """
+        Check the limits of a tariff (tariff_min_kw, tariff_max_kw, tariff_min_kwh, tariff_max_kwh) against the
+        highest monthly peak demand and energy consumption of the meter
+        :param rate_manager: an ElectricityRateManager
+        :return: a tuple (bool, str) -> (eligible, reason), reason being an empty string if the meter is eligible
+        """
+
+        limits = [('peak demand', self.max_peak_kw, 'kW', rate_manager.tariff_min_kw, rate_manager.tariff_max_kw),
+                  ('energy', self.max_energy_kwh, 'kWh', rate_manager.tariff_min_kwh, rate_manager.tariff_max_kwh)]
+
+        for (name, value, unit, min_value, max_value) in limits:
+            if min_value is not None and value < float(min_value):
+                return False, '{0} {1:.1f} {2} < {3} {2}'.format(name, value, unit, min_value)
+            if max_value is not None and value > float(max_value):
+                return False, '{0} {1:.1f} {2} > {3} {2}'.format(name, value, unit, max_value)
+
+        return True, ''
+
+    @staticmethod
+    def get_demand_values(meter_series, demand_window=ELIGIBILITY_DEMAND_WINDOW):
+        """
+        Convert the energy of each data point into a demand, as the demand charges do (see
+        TouDemandChargeTariff.get_demand_values()): the windows that miss some data have no demand
+        :param meter_series: a pandas Series of energy consumption (in Wh)
+        :param demand_window: [optional] a pandas Timedelta, ELIGIBILITY_DEMAND_WINDOW by default
+        :return: a float64 numpy array, in kW (NaN if undefined)
+        """
+
+        return TouDemandChargeTariff.compute_demand_values(meter_series.to_frame(), None, demand_window)
+
+
+def compare_tariffs(tariffs, meters, billing_cycles=None, nb_workers=None, check_eligibility=True):
+    """
+    Bill one or several meters against a library of tariffs, and rank the tariffs of each meter by cost.
+
+    The peak demand and energy consumption of each meter are computed once (see MeterProfile), and the tariffs the
+    meter is not eligible for are dropped before billing. The remaining (meter, tariff) pairs are billed:
+     - on a pool of nb_workers processes (see compute_fleet_bills()), by default
+     - in this process if nb_workers is 0, the meters sharing the same dates being billed together for each tariff
+     (see ElectricityRateManager.compute_bill_per_column()). This avoids starting the processes for small comparisons
+
+    :param tariffs: a dict mapping each tariff name to its ElectricityRateManager, see read_tariff_library()
+    :param meters: the energy consumption (in Wh) of the meters: a pandas Series, a dataframe with one column per
+    meter, or a dict mapping each meter id to a pandas Series
+    :param billing_cycles: [optional] a BillingCycleCalendar, the natural months by default
+    :param nb_workers: [optional] the number of worker processes, os.cpu_count() by default. 0 to bill in this process
+    :param check_eligibility: [optional] if False, all the tariffs are billed
+    :return: a pandas dataframe with one row per meter and tariff, sorted by meter and rank. The columns are:
+     - 'meter', 'tariff'
+     - 'eligible' and 'reason', the limit of the tariff that the meter exceeds, or the error raised by its bill
+     - 'total_cost', 'fixed_cost', 'energy_cost', 'demand_cost', in $ (NaN if not eligible)
+     - 'rank', an integer, 1 for the cheapest tariff of the meter (<NA> if not eligible)
+    """
+
+    if billing_cycles is None:
+        billing_cycles = BillingCycleCalendar()
+
+    meters = get_meters_dict(meters)
+
+    # Eligibility, from the aggregates of each meter
+    eligibility = {}
+    for meter_id, meter_series in list(meters.items()):
+        profile = MeterProfile(meter_series, billing_cycles) if check_eligibility else None
+        for tariff_name, rate_manager in list(tariffs.items()):
+            eligibility[(meter_id, tariff_name)] = profile.check_eligibility(rate_manager) if check_eligibility else (True, '')
+
+    pairs = [pair for pair in list(eligibility.keys()) if eligibility[pair][0]]
+
+    if nb_workers == 0:
+        bills = bill_pairs_in_process(tariffs, meters, pairs, billing_cycles)
+    else:
+        jobs = ((pair, meters[pair[0]], tariffs[pair[1]]) for pair in pairs)
+        bills = dict(compute_fleet_bills(jobs, nb_workers=nb_workers, return_bill=True, billing_cycles=billing_cycles,
+                                         on_error='yield'))
+
+    # The ranked table
+    rows = []
+    for (meter_id, tariff_name), (eligible, reason) in list(eligibility.items()):
+        row = {'meter': meter_id, 'tariff': tariff_name, 'eligible': eligible, 'reason': reason,
+               'total_cost': np.nan, 'fixed_cost': np.nan, 'energy_cost': np.nan, 'demand_cost': np.nan}
+
+        bill = bills.get((meter_id, tariff_name))
+        if isinstance(bill, Exception):
+            row['reason'] = 'the bill could not be computed: {0!r}'.format(bill)
+        elif bill is not None:
+            row['total_cost'] = bill.get_total_cost()
+            for charge_type, cost in list(bill.get_cost_per_charge_type().items()):
+                row[charge_type.name.lower() + '_cost'] = cost
+
+        rows.append(row)
+
+    columns = ['meter', 'tariff', 'eligible', 'reason', 'total_cost', 'fixed_cost', 'energy_cost', 'demand_cost']
+    table = pd.DataFrame(rows, columns=columns)
+
+    table['rank'] = table.groupby('meter', sort=False)['total_cost'].rank(method='first').astype('Int64')
+    table['meter_order'] = table['meter'].map({meter_id: i for i, meter_id in enumerate(meters.keys())})
+
+    table = table.sort_values(['meter_order', 'rank'], na_position='last', kind='mergesort')
+
+    return table.drop(columns='meter_order').reset_index(drop=True)
+
+
+def bill_pairs_in_process(tariffs, meters, pairs, billing_cycles):
+    """
+    Bill (meter, tariff) pairs in this process, the meters sharing the same dates being billed together
+    :return: a dict mapping each pair to its Bill
+    """
+
+    # Group the meters by dates
+    groups = []  # list of (index, [meter ids])
+    for meter_id, meter_series in list(meters.items()):
+        for (index, group) in groups:
+            if index is meter_series.index or index.equals(meter_series.index):
+                group.append(meter_id)
+                break
+        else:
+            groups.append((meter_series.index, [meter_id]))
+
+    to_bill = set(pairs)
+    bills = {}
+    for tariff_name, rate_manager in list(tariffs.items()):
+        for (index, group) in groups:
+            meter_ids = [meter_id for meter_id in group if (meter_id, tariff_name) in to_bill]
+            if len(meter_ids) == 0:
+                continue
+
+            columns = list(range(len(meter_ids)))
+            df = pd.DataFrame(np.column_stack([np.asarray(meters[m].values, dtype=np.float64) for m in meter_ids]),
+                              index=index, columns=columns)
+
+            bills_group = rate_manager.compute_bill_per_column(df, columns, billing_cycles=billing_cycles,
+                                                               return_bill=True)
+            for i, meter_id in enumerate(meter_ids):
+                bills[(meter_id, tariff_name)] = bills_group[i]
+
+    return bills
+
+
+def get_meters_dict(meters):
+    """
+    Get the meters as a dict mapping each meter id to a pandas Series
+    :param meters: a pandas Series, a dataframe with one column per meter, or a dict
+    :return: a dict
+    """
+
+    if isinstance(meters, pd.Series):
+        return {meters.name: meters}
+
+    if isinstance(meters, pd.DataFrame):
+        return {col: meters[col] for col in meters.columns}
+
+    return dict(meters)
@@ -1,11 +1,15 @@
 __author__ = 'Olivier Van Cutsem'
 
 from abc import abstractmethod
+import bisect
 from enum import Enum
 from datetime import datetime
-import calendar
+import numpy as np
 import pandas as pd
 
+from .calendar_structure import BillingCycleCalendar, CalendarIndex
+from . import instrumentation
+
 # --------------- TARIFF structures --------------- #
 
 
@@ -56,9 +60,9 @@ class TariffBase(object):
         self.name = name
         self.unit_cost = unit_cost
 
-    def compute_bill(self, df, data_col=None):
+    def compute_bill(self, df, data_col=None, billing_cycles=None):
         """
-        Compute the bill due to the power/energy consumption in df, for each billing period specified in billing_periods
+        Compute the bill due to the power/energy consumption in df, for each billing cycle of billing_cycles
 
         It outputs a dictionary formatted as follow:
         {
@@ -66,51 +70,112 @@ class TariffBase(object):
             ...
         }
 
-        :param df: a pandas dataframe containing power consumption timeseries
-        :param billing_periods: a dictionary mapping the billing periods label to a tuple (t_start, t_end) of datetime,
-        defining the period related to the billing label
+        :param df: a pandas dataframe containing power consumption timeseries, with a sorted index
+        :param data_col: the column label containing the data
+        :param billing_cycles: [optional] a BillingCycleCalendar defining the billing periods and their labels.
+        By default, the natural months of the calendar
         :return: a dictionary formatted as in this method signature
         """
 
         ret = {}
 
-        # Select only the data in this tariff window
-        start_sel = self.startdate
-        start_sel = start_sel.replace(tzinfo=df.index[0].tzinfo)
+        # Select only the data in this tariff window, each billing cycle being a positional slice of it
+        df, labels, bounds = self.get_cycles_in_window(df, billing_cycles)
 
-        end_sel = self.enddate
-        end_sel = end_sel.replace(tzinfo=df.index[0].tzinfo)
+        for i, cycle_label in enumerate(labels):
+            df_cycle = df.iloc[bounds[i]:bounds[i+1]]
+            ret[cycle_label] = self.compute_monthly_bill(df_cycle, data_col)
 
-        mask = (df.index >= start_sel) & (df.index <= end_sel)
-        df = df.loc[mask]
+        return ret
 
-        # Loop over the months
-        t_s = df.index[0]
-        last_day_of_month = calendar.monthrange(t_s.year, t_s.month)[1]  # The last day of this month
-        t_e = datetime(t_s.year, t_s.month, last_day_of_month, hour=23, minute=59, second=59, tzinfo=t_s.tzinfo)  # end of the current month
-        t_e = min(df.index[-1], t_e)
+    def compute_bill_columns(self, df, data_cols, billing_cycles=None):
+        """
+        Compute the bill of several columns of df (e.g. several meters sharing the same dates), see compute_bill().
+        The data window and the billing cycles are found once for all the columns.
 
-        while t_s <= t_e:
-            mask = (df.index >= t_s) & (df.index <= t_e)
-            df_month = df.loc[mask]
-            monthly_bill = self.compute_monthly_bill(df_month, data_col)
-            ret[t_s.strftime("%Y-%m")] = monthly_bill
+        :param df: a pandas dataframe containing power consumption timeseries, with a sorted index
+        :param data_cols: a list of column labels of df
+        :param billing_cycles: [optional] a BillingCycleCalendar, the natural months by default
+        :return: a dictionary mapping each label of data_cols to the output of compute_bill() for this column
+        """
 
-            # Prepare the next billing month
-            month = t_e.month + 1
-            year = t_e.year
-            if month >= 13:
-                month = 1
-                year += 1
+        ret = {col: {} for col in data_cols}
 
-            t_s = datetime(year, month, 1, hour=0, minute=0, second=0, tzinfo=t_s.tzinfo)
+        df, labels, bounds = self.get_cycles_in_window(df, billing_cycles)
 
-            last_day_of_month = calendar.monthrange(year, month)[1]
-            t_e = datetime(year, month, last_day_of_month, hour=23, minute=59, second=59, tzinfo=t_s.tzinfo)
-            t_e = min(df.index[-1], t_e)
+        for i, cycle_label in enumerate(labels):
+            df_cycle = df.iloc[bounds[i]:bounds[i+1]]
+            for col in data_cols:
+                ret[col][cycle_label] = self.compute_monthly_bill(df_cycle, col)
 
         return ret
 
+    def get_cycles_in_window(self, df, billing_cycles=None):
+        """
+        Select the data of df that falls in this tariff window, and split them into billing cycles.
+        The cycle table is computed on the whole index of df, so that it is shared between all the tariffs billing df.
+
+        :param df: a pandas dataframe, with a sorted index
+        :param billing_cycles: [optional] a BillingCycleCalendar, the natural months by default
+        :return: a tuple (pandas dataframe, list, numpy array) -> (df_window, labels, bounds), where the data of the
+        i-th billing cycle are at the positions bounds[i] to bounds[i+1] (excluded) of df_window
+        """
+
+        if billing_cycles is None:
+            billing_cycles = BillingCycleCalendar()
+
+        (idx_start, idx_end) = self.get_window_bounds(df.index)
+
+        labels, bounds = billing_cycles.get_cycle_bounds(df.index)
+        bounds = np.clip(bounds, idx_start, idx_end)
+
+        # Only keep the cycles from the first to the last one with data in this window
+        non_empty = np.flatnonzero(np.diff(bounds) > 0)
+        if len(non_empty) == 0:
+            return df.iloc[0:0], [], np.zeros(1, dtype=np.int64)
+
+        first = non_empty[0]
+        last = non_empty[-1]
+
+        return df.iloc[idx_start:idx_end], labels[first:last+1], bounds[first:last+2] - idx_start
+
+    def get_data_in_window(self, df):
+        """
+        Select the data of df that falls between the starting and ending dates of this tariff.
+        The index of df must be sorted: the window bounds are found by binary search and the selection is a slice of df
+
+        :param df: a pandas dataframe
+        :return: a pandas dataframe
+        """
+
+        (idx_start, idx_end) = self.get_window_bounds(df.index)
+
+        return df.iloc[idx_start:idx_end]
+
+    def get_window_bounds(self, index):
+        """
+        Find the positions of the data of a sorted DatetimeIndex that fall between the starting and ending dates of
+        this tariff
+        :param index: a sorted pandas DatetimeIndex
+        :return: a tuple (int, int) -> (first position, last position + 1)
+        """
+
+        if len(index) == 0:
+            return 0, 0
+
+        # The window is applied on the wall clock of the data: with timezone-aware data, the bounds are localized in
+        # their timezone, each one with its own DST offset
+        start_sel = pd.Timestamp(self.startdate).tz_localize(None)
+        end_sel = pd.Timestamp(self.enddate).tz_localize(None)
+        if index.tz is not None:
+            start_sel = start_sel.tz_localize(index.tz, ambiguous=True, nonexistent='shift_forward')
+            end_sel = end_sel.tz_localize(index.tz, ambiguous=False, nonexistent='shift_backward')
+
+        idx_start = index.searchsorted(start_sel, side='left')
+        idx_end = index.searchsorted(end_sel, side='right')
+
+        return idx_start, max(idx_start, idx_end)
+
     @abstractmethod
     def compute_monthly_bill(self, df, data_col=None):
         """
@@ -148,6 +213,16 @@ class TariffBase(object):
     def get_price_from_timestamp(self, timestamp):
         pass
 
+    @abstractmethod
+    def get_price_from_timestamps(self, dates):
+        """
+        Vectorized version of get_price_from_timestamp()
+        :param dates: a pandas DatetimeIndex or an array of epoch timestamps (in seconds, UTC), in any order
+        :return: a float64 numpy array
+        """
+
+        pass
+
 
 # --------------- FIXED TARIFF --------------- #
 
@@ -177,10 +252,8 @@ class FixedTariff(TariffBase):
         :param df: a pandas dataframe
         :return: a tuple (float, float), representing the bill and the duration (in months)
         """
-        first_day = df.index[0].day
-        last_day = df.index[-1].day
-
-        nb_days = last_day - first_day + 1
+        # The billing period may overlap two months of the calendar
+        nb_days = (df.index[-1].date() - df.index[0].date()).days + 1
         nb_days_per_month = 365/12
 
         bill = 0
@@ -198,6 +271,9 @@ class FixedTariff(TariffBase):
     def get_price_from_timestamp(self, timestamp):
         return self.__rate_value
 
+    def get_price_from_timestamps(self, dates):
+        return np.full(len(dates), self.__rate_value, dtype=np.float64)
+
 # --------------- TOU TARIFFs --------------- #
 
 
@@ -252,19 +328,46 @@ class TimeOfUseTariff(TariffBase):
     def get_price_from_timestamp(self, timestamp):
         return self.__schedule.get_from_timestamp(timestamp)
 
+    def get_price_from_timestamps(self, dates):
+        return self.__schedule.get_from_timestamps(dates)
+
+    def get_prices(self, dates, return_codes=False, tz=None):
+        """
+        Return the price at each date of a whole range, in one call
+        :param dates: a pandas DatetimeIndex (naive dates being in local time) or an array of epoch timestamps, in seconds
+        :param return_codes: [optional] if True, also return the code of the rate of each date, i.e. the position of
+        its price in the rates of the compiled schedule
+        :param tz: [optional] the timezone of the tariff, see to_local_datetime_index()
+        :return: a float64 numpy array of the prices (NaN if there is no associated rate), or a tuple (prices, codes) if
+        return_codes is True
+        """
+
+        rate_codes = self.__schedule.get_rate_codes(dates, tz)
+        prices = self.__schedule.compiled.rates[rate_codes]
+
+        if return_codes:
+            return prices, rate_codes
+
+        return prices
+
     @staticmethod
     def get_daily_price_dataframe(daily_rate, df_day):
+        """
+        Return a dataframe of the price at each date of df_day, from the rates of the day.
+        Prefer get_prices(), that gets the prices of a whole range without building a dataframe
 
-        # Constructing the dataframe for an easier manipulation of time
-        period_rate = len(daily_rate) / 24.0
+        :param daily_rate: a list of float, the rates of the day
+        :param df_day: a pandas dataframe whose index contains the dates of the day
+        :return: a pandas dataframe with the columns 'date' and 'price'
+        """
 
         # In some cases the day might not be full: missing data or DST
-        daily_prices = [daily_rate[int((df_day.index[i].hour + df_day.index[i].minute / 60.0) * period_rate)] for i in range(len(df_day.index))]
+        slots = ((60 * np.asarray(df_day.index.hour) + np.asarray(df_day.index.minute)) * len(daily_rate)) // 1440
+        daily_prices = np.asarray(daily_rate)[slots]
+
         data = {'date': df_day.index[:], 'price': daily_prices}
-        df_prices = pd.DataFrame(data=data)
-        df_prices.set_index('date')
 
-        return df_prices
+        return pd.DataFrame(data=data)
 
 
 class TouDemandChargeTariff(TimeOfUseTariff):
@@ -272,125 +375,290 @@ class TouDemandChargeTariff(TimeOfUseTariff):
     This class represents a Time Of Use Demand Charge tariff
     """
 
-    def __init__(self, dates, time_schedule, unit_metric=TariffElemMetricUnit.DEMAND_KW, unit_cost=TariffElemCostUnit.DOLLAR, name=None):
+    def __init__(self, dates, time_schedule, unit_metric=TariffElemMetricUnit.DEMAND_KW, unit_cost=TariffElemCostUnit.DOLLAR, name=None,
+                 demand_window=TariffElemPeriod.QUARTERLY):
         """
         Constructor
         :param dates: see FixedTariff init
         :param rate_list: TODO
         :param time_schedule: TODO
         :param name: see FixedTariff init
+        :param demand_window: [optional] the period the power is averaged over to define the demand, as a
+        TariffElemPeriod or a pandas Timedelta. Data with a shorter timestep are averaged over a rolling window of this
+        length. 15 minutes by default
         """
 
         super(TouDemandChargeTariff, self).__init__(dates, time_schedule, unit_metric, unit_cost, name)
 
+        if isinstance(demand_window, TariffElemPeriod):
+            demand_window = demand_window.value
+        self.__demand_window = pd.Timedelta(demand_window)
+
+    def compute_bill(self, df, data_col=None, billing_cycles=None):
+        """
+        Compute the demand bill of each billing cycle, see TariffBase.compute_bill().
+        All the cycles are computed together, in one grouped reduction.
+        """
+
+        # The demand is computed on all the data, so that the rolling windows of the first data of the tariff window
+        # include the data preceding them
+        demand = self.get_demand_values(df, data_col)
+        (idx_start, _) = self.get_window_bounds(df.index)
+
+        df, labels, bounds = self.get_cycles_in_window(df, billing_cycles)
+
+        if len(df) == 0:
+            return {}
+
+        # Label each data point with the position of its billing cycle, the data out of the cycles being dropped
+        demand = demand[idx_start+bounds[0]:idx_start+bounds[-1]]
+        df = df.iloc[bounds[0]:bounds[-1]]
+        cycle_codes = np.repeat(np.arange(len(labels)), np.diff(bounds))
+
+        max_per_cycle = self.compute_max_demands(df, data_col, cycle_codes, demand)
+
+        return {cycle_label: max_per_cycle.get(i, {}) for i, cycle_label in enumerate(labels)}
+
     def compute_monthly_bill(self, df, data_col=None):
         """
         Compute the bill due to a TOU tariff
         :param df: a pandas dataframe
-        :return: a tuple (dict, float) -> ({p1: (max_power_p1, time_max_p1), p2: (max_power_p2, time_max_p2), cost)
+        :return: a dict {p1: {'mask': mask_p1, 'max-demand': max_power_p1, 'max-demand-date': time_max_p1}, p2: ...},
+        where p_i is a price, mask_p_i is the daily mask of the period where it applies (a list of bool, one per rate
+        of the day), max_power_p_i is the maximum demand in this period and time_max_p_i the date of the maximum
+        """
+
+        if len(df) == 0:
+            return {}
+
+        return self.compute_max_demands(df, data_col, np.zeros(len(df), dtype=np.int64)).get(0, {})
+
+    def compute_bill_columns(self, df, data_cols, billing_cycles=None):
+        """
+        Compute the demand bill of several columns of df, see TariffBase.compute_bill_columns().
+        The maximum demands of all the columns and billing cycles are found in one grouped reduction.
+        """
+
+        demand = self.get_demand_values(df, list(data_cols))
+        (idx_start, _) = self.get_window_bounds(df.index)
+
+        df, labels, bounds = self.get_cycles_in_window(df, billing_cycles)
+
+        if len(df) == 0:
+            return {col: {} for col in data_cols}
+
+        # The data out of the billing cycles are dropped
+        demand = demand[idx_start+bounds[0]:idx_start+bounds[-1], :]
+        df = df.iloc[bounds[0]:bounds[-1]]
+        cycle_codes = np.repeat(np.arange(len(labels)), np.diff(bounds))
+
+        max_per_column = self.get_max_demands(df.index, cycle_codes, demand)
+
+        return {col: {cycle_label: max_per_column[j].get(i, {}) for i, cycle_label in enumerate(labels)}
+                for j, col in enumerate(data_cols)}
+
+    def compute_max_demands(self, df, data_col, group_codes, power=None):
+        """
+        Compute the maximum demand of each group of data (e.g. each month), for each demand period.
+
+        :param df: a pandas dataframe
+        :param data_col: the column label containing the data
+        :param group_codes: an int numpy array with the same length as df, the group of each data point
+        :param power: [optional] the demand of each data point, as returned by get_demand_values()
+        :return: a dict mapping each group code to a dict formatted as the output of compute_monthly_bill()
         """
 
-        # Scaling the power unit and cost
-        metric_unit_mult = float(self.unit_metric.value)
+        if power is None:
+            power = self.get_demand_values(df, data_col)
+
+        return self.get_max_demands(df.index, group_codes, np.reshape(power, (-1, 1)))[0]
+
+    def get_max_demands(self, index, group_codes, power):
+        """
+        Find the maximum demand of each (column, group, demand period).
+        Each data point is labelled with the integer code of its demand period, i.e. the position of its price in the
+        compiled schedule, and the maximum of each (column, group, period) is found in one pass, from a lexicographic
+        sort.
+
+        :param index: the DatetimeIndex of the data
+        :param group_codes: an int numpy array with the same length as index, the group of each data point
+        :param power: a 2-D float64 numpy array, the demand of each data point (rows) for each column
+        :return: a list with one dict per column, mapping each group code to a dict formatted as the output of
+        compute_monthly_bill()
+        """
+
+        t_start = instrumentation.start()
+
+        ret = self.__get_max_demands(index, group_codes, power)
+
+        instrumentation.stop(t_start, instrumentation.STAGE_DEMAND_REDUCTION, type(self).__name__)
+
+        return ret
+
+    def __get_max_demands(self, index, group_codes, power):
+        """
+        See get_max_demands()
+        """
+
+        # Scaling the cost
         metric_price_mult = float(self.unit_cost.value)
 
-        max_per_set = {}
+        nb_columns = power.shape[1]
+        ret = [{} for _ in range(nb_columns)]
+
+        compiled_schedule = self.rate_schedule.compiled
+        rate_codes = self.rate_schedule.get_rate_codes(index).astype(np.int64)
+        group_codes = np.asarray(group_codes, dtype=np.int64)
+
+        # Only the data with both a price and a value define a maximum
+        valid = ~np.isnan(compiled_schedule.rates[rate_codes])[:, np.newaxis] & ~np.isnan(power)
+        (positions, columns) = np.nonzero(valid)
+
+        if len(positions) == 0:
+            return ret
+
+        # Sort by (column, group, period), then by decreasing power and increasing date: the first element of each
+        # (column, group, period) is its maximum
+        nb_groups = int(group_codes.max()) + 1
+        keys = (columns * nb_groups + group_codes[positions]) * len(compiled_schedule.rates) + rate_codes[positions]
+        order = np.lexsort((positions, -power[positions, columns], keys))
+        first_of_key = order[np.flatnonzero(np.r_[True, keys[order][1:] != keys[order][:-1]])]
+        max_positions = positions[first_of_key]
+        max_columns = columns[first_of_key]
+
+        calendar = CalendarIndex.get(index)
+        day_types = calendar.get_day_types(self.rate_schedule.holiday_calendar)[max_positions]
+        months = calendar.months[max_positions]
+
+        for pos, col, day_type, month in zip(max_positions, max_columns, day_types, months):
+            code = rate_codes[pos]
+            group = int(group_codes[pos])
+
+            # The daily mask of this period, on the day of the maximum
+            mask_price24h = compiled_schedule.get_period_mask(code, month, day_type)
+
+            price_key = metric_price_mult * float(compiled_schedule.rates[code])
+            ret[col].setdefault(group, {})[price_key] = {'mask': mask_price24h,
+                                                         'max-demand': float(power[pos, col]),
+                                                         'max-demand-date': index[pos].to_pydatetime()}
+
+        return ret
+
+    def get_demand_values(self, df, data_col=None):
+        """
+        Convert the energy of each data point into a demand, i.e. the average power over the demand window ending with
+        this data point.
+         - if the data timestep is at least the demand window, the demand is the average power over the timestep
+         - otherwise, the energy is summed over a rolling window made of the last data points, computed on the whole
+         series from its cumulative sum. Windows that miss some data (NaN or missing dates) have no demand
+
+        :param df: a pandas dataframe, with a sorted index
+        :param data_col: the column label containing the data, or a list of column labels
+        :return: a float64 numpy array with the same length as df, the demand in kW (NaN if undefined). If data_col is
+        a list, a 2-D array with one column per label
+        """
+
+        return self.compute_demand_values(df, data_col, self.__demand_window, float(self.unit_metric.value))
+
+    @classmethod
+    def compute_demand_values(cls, df, data_col, demand_window, metric_unit_mult=TariffElemMetricUnit.DEMAND_KW.value):
+        """
+        Convert the energy of each data point into a demand over a given window, see get_demand_values()
+        :param df: a pandas dataframe, with a sorted index
+        :param data_col: the column label containing the data, a list of column labels, or None if df has one column
+        :param demand_window: a pandas Timedelta, the period the power is averaged over
+        :param metric_unit_mult: [optional] the scale of the demand unit, in W (kW by default)
+        :return: see get_demand_values()
+        """
+
+        if data_col is not None:
+            values = df.loc[:, data_col].values
+        else:
+            values = df.values
+
+        if isinstance(data_col, list):
+            values = np.asarray(values, dtype=np.float64).reshape(len(df), len(data_col))
+        else:
+            values = np.asarray(values, dtype=np.float64).ravel()
 
         # df is in kWh and demand in kW: convert to Power
-        timestep_data = self.get_pd_timestep_data(df)
-
-        for idx, df_day in df.groupby(df.index.date):
-            daily_rate = self.rate_schedule.get_daily_rate(df_day.index[0])
-
-            set_of_daily_prices = set(daily_rate)
-            df_prices = self.get_daily_price_dataframe(daily_rate, df_day)
-
-            power_coeff = 1
-            if timestep_data == '15T':
-                power_coeff = 4
-            elif timestep_data == '30T':
-                power_coeff = 2
-            elif timestep_data == '60T' or timestep_data == 'H':
-                power_coeff = 1
-
-            for day_p in set_of_daily_prices:
-
-                # Create the mask in the day for this price
-                mask_price = df_prices['price'] == day_p
-                mask_price = mask_price.tolist()
-
-                date_max_period = None
-                if data_col is not None:
-                    df_masked = df_day.loc[mask_price, data_col]
-                    if len(df_masked) > 0:
-                        date_max_period = df_masked.idxmax()
-                else:
-                    df_masked = df_day.loc[mask_price]
-                    if len(df_masked) > 0:
-                        date_max_period = df_masked.idxmax()
-
-                if date_max_period is None:
-                    continue
-
-                if data_col is not None:
-                    max_power_period = df_day.loc[date_max_period, data_col] / metric_unit_mult
-                else:
-                    max_power_period = df_day[date_max_period] / metric_unit_mult
-
-                max_power_period *= power_coeff  # from kWh to kW
-
-                # Search for the same mask and update the value if a new mask
-                mask_price24h = mask_price
-                if len(mask_price) != len(daily_rate):  # if this price is already in the list, take the corresponding mask ...
-                    price_key = metric_price_mult * day_p
-                    if price_key in list(max_per_set.keys()):
-                        mask_price24h = max_per_set[price_key]['mask']
-
-                add_this_demand = True
-                existing_mask_price = [k for k, v in list(max_per_set.items()) if v['mask'] == mask_price24h]
-                if len(existing_mask_price) > 0:  # Find the identical mask over the day
-                    existing_mask_price = existing_mask_price[0]
-                    if max_power_period > max_per_set[existing_mask_price]['max-demand']:  # Check if the corresponding demand is greater
-                        del max_per_set[existing_mask_price]  # delete the former value, and add it (after)
-                    else:
-                        add_this_demand = False
-
-                # This is the first time this mask is seen OR this new demand is higher than the corresponding former: add it
-                if add_this_demand:
-
-                    if type(date_max_period) is not pd.Timestamp:
-                        max_power_date = date_max_period[data_col].to_pydatetime()
-                    else:
-                        max_power_date = date_max_period.to_pydatetime()
-
-                    # The mask must be 24 hour long:
-                    # it might not be the case for the first and last day, and the DST
-                    price_key = metric_price_mult * day_p
-
-                    max_per_set[price_key] = {'mask': mask_price24h, 'max-demand': max_power_period, 'max-demand-date': max_power_date}
-
-        return max_per_set
+        timestep = cls.get_data_timestep(df.index)
+        window = pd.Timedelta(demand_window).total_seconds()
+
+        if timestep is None or timestep > 3600:
+            return values / metric_unit_mult  # unknown or coarse data: the values are taken as the demand
+
+        if timestep >= window:
+            power_coeff = 3600 / timestep
+            return values / metric_unit_mult * power_coeff  # from kWh to kW
+
+        # Rolling window of nb_steps data points, computed on each column
+        values_2d = values.reshape(len(df), -1)
+        nb_steps = max(int(round(window / timestep)), 1)
+        nb_data = len(values_2d)
+
+        power = np.full(values_2d.shape, np.nan)
+        if nb_data < nb_steps:
+            return power.reshape(values.shape)
+
+        missing = np.isnan(values_2d)
+        no_data = np.zeros((1, values_2d.shape[1]))
+        acc_energy = np.concatenate((no_data, np.cumsum(np.where(missing, 0.0, values_2d), axis=0)))
+        acc_missing = np.concatenate((no_data, np.cumsum(missing, axis=0)))
+
+        window_energy = acc_energy[nb_steps:] - acc_energy[:-nb_steps]
+        complete = acc_missing[nb_steps:] - acc_missing[:-nb_steps] == 0
+
+        # The window must span exactly nb_steps timesteps
+        t_ns = df.index.asi8
+        complete &= ((t_ns[nb_steps-1:] - t_ns[:nb_data-nb_steps+1]) == int(round((nb_steps - 1) * timestep * 1e9)))[:, np.newaxis]
+
+        power[nb_steps-1:] = np.where(complete, window_energy / metric_unit_mult * (3600 / (nb_steps * timestep)), np.nan)
+
+        return power.reshape(values.shape)
+
+    @staticmethod
+    def get_data_timestep(index):
+        """
+        Return the most likely timestep of the data: the frequency of the index if it is set, the median interval
+        between two consecutive dates otherwise
+        :param index: a sorted pandas DatetimeIndex
+        :return: a float, the timestep in seconds, or None if it can't be found
+        """
+
+        if index.freq is not None:
+            try:
+                return pd.Timedelta(index.freq).total_seconds()
+            except ValueError:  # not a fixed frequency, e.g. monthly
+                return None
+
+        if len(index) < 2:
+            return None
+
+        intervals = np.diff(index.asi8)
+        intervals = intervals[intervals > 0]
+
+        if len(intervals) == 0:
+            return None
+
+        return float(np.median(intervals)) / 1e9
 
     def get_pd_timestep_data(self, df):
         """
         Return the most likely data frequency
-        :return:
+        :return: a pandas offset, or 1 if it can't be found
         """
 
-        freq = 1
+        timestep = self.get_data_timestep(df.index)
 
-        # Dataframe is complete
-        if df.index.freq is not None:
-            return df.index.freq
+        if timestep is None:
+            return 1
 
-        # Days are missing: loop through the day until getting a frequency
-        for idx, df_day in df.groupby(df.index.date):
-            if df_day.index.freq is not None:
-                return df_day.index.freq
-            elif len(df_day.index) > 2:  # need at least 3 dates
-                return pd.infer_freq(df_day.index)
+        return pd.tseries.frequencies.to_offset(pd.Timedelta(seconds=timestep))
 
-        return 1
+    @property
+    def demand_window(self):
+        return self.__demand_window
 
 
 class TouEnergyChargeTariff(TimeOfUseTariff):
@@ -408,39 +676,197 @@ class TouEnergyChargeTariff(TimeOfUseTariff):
 
         super(TouEnergyChargeTariff, self).__init__(dates, time_schedule, unit_metric, unit_cost, name)
 
-    def compute_monthly_bill(self, df, data_col=None):
+    def compute_bill_columns(self, df, data_cols, billing_cycles=None):
         """
-        Compute the bill due to a TOU tariff
-        :param df: a pandas dataframe
-        :return: a tuple (float, float) -> (cost, tot_energy)
+        Compute the energy bill of several columns of df, see TariffBase.compute_bill_columns().
+        The prices are gathered once for all the columns, and the bill of each billing cycle is a matrix-vector product.
         """
 
-        # Iterates over the days
-        energy = 0.0
-        cost = 0.0
+        ret = {col: {} for col in data_cols}
+
+        df, labels, bounds = self.get_cycles_in_window(df, billing_cycles)
 
-        # TODO: check for blockrate instead of assuming it's a float !
+        if len(df) == 0:
+            return ret
 
-        for idx, df_day in df.groupby(df.index.date):
+        # Unit and cost scale
+        mult_energy_unit = float(self.unit_metric.value)
+        mult_cost_unit = float(self.unit_cost.value)
 
-            daily_rate = self.rate_schedule.get_daily_rate(df_day.index[0])
-            df_prices = self.get_daily_price_dataframe(daily_rate, df_day)
+        values = np.asarray(df.loc[:, list(data_cols)].values, dtype=np.float64)
 
-            # Unit and cost scale
-            mult_energy_unit = float(self.unit_metric.value)
-            mult_cost_unit = float(self.unit_cost.value)
+        compiled_schedule = self.rate_schedule.compiled
+        rate_codes = self.rate_schedule.get_rate_codes(df.index)
+        prices = compiled_schedule.rates[rate_codes]
 
-            # Cumulate the energy over the month
+        for i, cycle_label in enumerate(labels):
+            values_cycle = values[bounds[i]:bounds[i+1], :]
+            energy = values_cycle.sum(axis=0) / mult_energy_unit
 
-            if data_col is not None:
-                df_values_in_day = df_day.loc[:, data_col]
+            if compiled_schedule.tiered:
+                codes_cycle = rate_codes[bounds[i]:bounds[i+1]]
+                cost = np.array([compiled_schedule.get_cost(codes_cycle, values_cycle[:, j] / mult_energy_unit).sum()
+                                 for j in range(len(data_cols))])
             else:
-                df_values_in_day = df_day[:]
+                cost = np.dot(prices[bounds[i]:bounds[i+1]], values_cycle) / mult_energy_unit
+
+            for j, col in enumerate(data_cols):
+                ret[col][cycle_label] = (energy[j], mult_cost_unit * cost[j])
+
+        return ret
+
+    def compute_monthly_bill(self, df, data_col=None, initial_consumption=0.0):
+        """
+        Compute the bill due to a TOU tariff.
+        The price of each data point is gathered from the compiled rate schedule in one pass over the month.
+
+        If some rates are BlockRate, the consumption is accumulated over the month, each part of it being priced at
+        the rate of the block it falls in.
+
+        :param df: a pandas dataframe
+        :param initial_consumption: [optional] the energy already consumed in the month before df, in the unit of the
+        returned energy. Only used by the BlockRate
+        :return: a tuple (float, float) -> (tot_energy, cost)
+        """
+
+        # Unit and cost scale
+        mult_energy_unit = float(self.unit_metric.value)
+        mult_cost_unit = float(self.unit_cost.value)
 
-            energy += sum(df_values_in_day) / mult_energy_unit
+        if data_col is not None:
+            values = df.loc[:, data_col].values
+        else:
+            values = df.values
+
+        values = np.asarray(values, dtype=np.float64).ravel()
+
+        compiled_schedule = self.rate_schedule.compiled
+        rate_codes = self.rate_schedule.get_rate_codes(df.index)
+
+        energy = values.sum() / mult_energy_unit
+
+        if compiled_schedule.tiered:
+            cost = compiled_schedule.get_cost(rate_codes, values / mult_energy_unit, initial_consumption).sum()
+        else:
+            cost = np.dot(values, compiled_schedule.rates[rate_codes]) / mult_energy_unit
 
-            # Cumulate the bill over the month
-            cost += sum(mult_cost_unit * df_values_in_day.multiply(df_prices.loc[:, 'price'].tolist())) / mult_energy_unit
+        return energy, mult_cost_unit * cost
 
-        return energy, cost
 
+# --------------- TARIFF BLOCKS index --------------- #
+
+
+class TariffBlockIndex(object):
+    """
+    This structure indexes the "tariff blocks" of a label by their effective period, for range and point queries in
+    O(log n) instead of a scan of all the blocks.
+
+    The blocks are kept sorted by starting date on insertion, and the running maximum of their ending dates bounds the
+    candidates of a query with a binary search. The blocks returned by a query are in insertion order.
+    Naive dates are taken as UTC, like the dates of the blocks.
+    """
+
+    def __init__(self, blocks=None):
+        """
+        Constructor
+        :param blocks: [optional] a list of TariffBase (or children) objects
+        """
+
+        self.__blocks = []  # in insertion order
+        self.__sorted_keys = []  # (start, end, position) of the blocks, sorted by start, dates in ns since epoch
+
+        # Arrays built from __sorted_keys at the first query after an insertion
+        self.__arrays = None
+
+        if blocks is not None:
+            for tariff_block in blocks:
+                self.add(tariff_block)
+
+    def add(self, tariff_block):
+        """
+        Add a tariff block to the index
+        :param tariff_block: a TariffBase (or children) object
+        :return: /
+        """
+
+        key = (self.to_epoch_ns(tariff_block.startdate), self.to_epoch_ns(tariff_block.enddate), len(self.__blocks))
+        bisect.insort(self.__sorted_keys, key)
+
+        self.__blocks.append(tariff_block)
+        self.__arrays = None
+
+    def get_blocks_in_range(self, start_sel, end_sel):
+        """
+        Return the blocks effective for at least a part of the period [start_sel, end_sel]
+        :param start_sel: a datetime
+        :param end_sel: a datetime
+        :return: a list of TariffBase (or children) objects, in insertion order
+        """
+
+        return [self.__blocks[pos] for pos in self.get_positions_in_range(start_sel, end_sel)]
+
+    def get_blocks_at(self, date_sel):
+        """
+        Return the blocks effective at a given date
+        :param date_sel: a datetime
+        :return: a list of TariffBase (or children) objects, in insertion order
+        """
+
+        return self.get_blocks_in_range(date_sel, date_sel)
+
+    def get_positions_in_range(self, start_sel, end_sel):
+        """
+        Return the insertion positions of the blocks effective for at least a part of the period [start_sel, end_sel]
+        :param start_sel: a datetime
+        :param end_sel: a datetime
+        :return: a sorted int numpy array
+        """
+
+        if len(self.__blocks) == 0:
+            return np.zeros(0, dtype=np.int64)
+
+        (starts, ends, max_ends, positions) = self.__get_arrays()
+
+        start_sel = self.to_epoch_ns(start_sel)
+        end_sel = self.to_epoch_ns(end_sel)
+
+        # The candidates start before the end of the period, and some block before them ends after its start
+        idx_last = np.searchsorted(starts, end_sel, side='right')
+        idx_first = np.searchsorted(max_ends[:idx_last], start_sel, side='left')
+
+        candidates = np.arange(idx_first, idx_last)
+        candidates = candidates[ends[candidates] >= start_sel]
+
+        return np.sort(positions[candidates])
+
+    def __get_arrays(self):
+
+        if self.__arrays is None:
+            keys = np.array(self.__sorted_keys, dtype=np.int64).reshape(-1, 3)
+            starts = keys[:, 0]
+            ends = keys[:, 1]
+            self.__arrays = (starts, ends, np.maximum.accumulate(ends), keys[:, 2])
+
+        return self.__arrays
+
+    @property
+    def blocks(self):
+        """
+        GETTER of the blocks, in insertion order
+        :return: a list of TariffBase (or children) objects
+        """
+
+        return self.__blocks
+
+    def __len__(self):
+        return len(self.__blocks)
+
+    @staticmethod
+    def to_epoch_ns(date_sel):
+        """
+        Convert a date to nanoseconds since epoch, naive dates being taken as UTC
+        :param date_sel: a datetime, pandas Timestamp or numpy datetime64
+        :return: an int
+        """
+
+        return pd.Timestamp(date_sel).value
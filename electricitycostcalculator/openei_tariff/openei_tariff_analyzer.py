@@ -1,16 +1,22 @@
 __author__ = 'Olivier Van Cutsem'
 
-# Import COST CALCULATOR LIB
-from electricitycostcalculator.electricity_rate_manager.tariff_structure import *
-from electricitycostcalculator.electricity_rate_manager.rate_structure import *
-
+import importlib
 import time
 from datetime import datetime
-import requests
 import json
 import pytz
 import os
-from dateutil.parser import parse
+import warnings
+
+# The COST CALCULATOR LIB (and pandas) is only loaded when a tariff is built from the OpenEI data: requesting or reading
+# the OpenEI data doesn't load it. Its structures are still exported by this module, see __getattr__(): as
+# "from openei_tariff_analyzer import *" exports them, it loads the COST CALCULATOR LIB
+LAZY_EXPORTS = [('electricitycostcalculator.electricity_rate_manager.tariff_structure', None),
+                ('electricitycostcalculator.electricity_rate_manager.rate_structure', None),
+                ('electricitycostcalculator.electricity_rate_manager.calendar_structure', ['get_holiday_calendar']),
+                ('electricitycostcalculator.electricity_rate_manager.rate_manager', ['ElectricityRateManager'])]
+
+_lazy_exports = {}  # name -> object, filled by get_lazy_exports()
 
 # ----------- FUNCTIONS SPECIFIC TO OpenEI REQUESTS -------------- #
 THIS_PATH = os.path.dirname(os.path.abspath(__file__)) + '/'
@@ -19,6 +25,10 @@ PDP_DEFAULT_FILENAME = "PDP_events.json"
 
 SUFFIX_REVISED = '_revised'  # this is the suffix we added to the json filename after correctly the OpenEI data manually
 
+US_COUNTRY_CODES = ('US', 'USA')  # the country codes of the United States, in the 'country' field of the OpenEI data
+
+TIER_UNIT = 'kWh'  # the unit of the tiers supported by the BlockRate: consumption in the billing cycle
+
 
 class OpenEI_tariff(object):
 
@@ -75,6 +85,8 @@ class OpenEI_tariff(object):
                 return
 
         # Else, call the OpenEI API
+        import requests
+
         data_filtered = []
         end_reached = False
         while not end_reached:
@@ -238,16 +250,25 @@ class OpenEI_tariff(object):
 
 # --- Inject data from OpenEI_tariff object to the Bill Calculator
 
-def tariff_struct_from_openei_data(openei_tarif_obj, bill_calculator, pdp_events_path=None):
+def tariff_struct_from_openei_data(openei_tarif_obj, bill_calculator, pdp_events_path=None, holiday_calendar=None):
     """
     Analyze the content of an OpenEI request in order to fill a CostCalculator object
     :param openei_tarif_obj: an instance of OpenEI_tariff that already call the API
     :param bill_calculator: an (empty) instance of CostCalculator
+    :param holiday_calendar: [optional] the HolidayCalendar of the tariff. If not specified, it is found from the
+    utility id, see get_openei_holiday_calendar()
     :return: /
     """
 
+    from dateutil.parser import parse
+    from electricitycostcalculator.electricity_rate_manager.tariff_structure import TariffType, TariffElemPeriod, \
+        FixedTariff, TouDemandChargeTariff, TouEnergyChargeTariff
+
     tariff_struct = {}
 
+    if holiday_calendar is None:
+        holiday_calendar = get_openei_holiday_calendar(openei_tarif_obj)
+
     # Analyse each block
     for block_rate in openei_tarif_obj.data_openei:
 
@@ -273,34 +294,34 @@ def tariff_struct_from_openei_data(openei_tarif_obj, bill_calculator, pdp_events
             bill_calculator.add_tariff(FixedTariff(tariff_dates, tariff_fix, period_fix_charge), str(TariffType.FIX_CUSTOM_CHARGE.value))
 
         # --- Demand charges: flat
-        tariff_flatdemand_obj = get_flatdemand_obj_from_openei(block_rate)
+        tariff_flatdemand_obj = get_flatdemand_obj_from_openei(block_rate, holiday_calendar)
 
         if tariff_flatdemand_obj is not None:
             bill_calculator.add_tariff(TouDemandChargeTariff(tariff_dates, tariff_flatdemand_obj),
                                        str(TariffType.DEMAND_CUSTOM_CHARGE_SEASON.value))
 
         # --- Energy charges
-        tariff_energy_obj = get_energyrate_obj_from_openei(block_rate)
+        tariff_energy_obj = get_energyrate_obj_from_openei(block_rate, holiday_calendar)
 
         if tariff_energy_obj is not None:
             bill_calculator.add_tariff(TouEnergyChargeTariff(tariff_dates, tariff_energy_obj), str(TariffType.ENERGY_CUSTOM_CHARGE.value))
 
         # --- Demand charges: tou
-        tariff_toudemand_obj = get_demandrate_obj_from_openei(block_rate)
+        tariff_toudemand_obj = get_demandrate_obj_from_openei(block_rate, holiday_calendar)
 
         if tariff_toudemand_obj is not None:
             bill_calculator.add_tariff(TouDemandChargeTariff(tariff_dates, tariff_toudemand_obj), str(TariffType.DEMAND_CUSTOM_CHARGE_TOU.value))
 
         if openei_tarif_obj.pdp_participate:
             # --- PDP credits for energy - todo: remove the pdp days
-            tariff_pdp_credit_energy_obj = get_pdp_credit_energyrate_obj_from_openei(block_rate)
+            tariff_pdp_credit_energy_obj = get_pdp_credit_energyrate_obj_from_openei(block_rate, holiday_calendar)
 
             if tariff_pdp_credit_energy_obj is not None:
                 bill_calculator.add_tariff(TouEnergyChargeTariff(tariff_dates, tariff_pdp_credit_energy_obj),
                                            str(TariffType.PDP_ENERGY_CREDIT.value))
 
             # --- PDP credits for demand
-            tariff_pdp_credit_demand_obj = get_pdp_credit_demandrate_obj_from_openei(block_rate)
+            tariff_pdp_credit_demand_obj = get_pdp_credit_demandrate_obj_from_openei(block_rate, holiday_calendar)
 
             if tariff_pdp_credit_demand_obj is not None:
                 bill_calculator.add_tariff(TouDemandChargeTariff(tariff_dates, tariff_pdp_credit_demand_obj),
@@ -336,11 +357,65 @@ def tariff_struct_from_openei_data(openei_tarif_obj, bill_calculator, pdp_events
         pdp_data_filter = [event for event in pdp_data if event['utility_id'] == int(openei_tarif_obj.req_param['eia'])]
         for pdp_event in pdp_data_filter:
             pdp_dates = parse(pdp_event['start_date']).replace(tzinfo=pytz.timezone('UTC')), parse(pdp_event['end_date']).replace(tzinfo=pytz.timezone('UTC'))
-            tariff_pdp_obj = get_pdp_energycharge(openei_tarif_obj, pdp_dates[0])
+            tariff_pdp_obj = get_pdp_energycharge(openei_tarif_obj, pdp_dates[0], holiday_calendar)
             if tariff_pdp_obj is not None:
                 bill_calculator.add_tariff(TouEnergyChargeTariff(pdp_dates, tariff_pdp_obj),
                                            str(TariffType.PDP_ENERGY_CHARGE.value))
 
+def get_openei_holiday_calendar(openei_tarif_obj):
+    """
+    Return the HolidayCalendar of the utility of an OpenEI tariff, see get_holiday_calendar(). The OpenEI data only give
+    the country of the utility: the national holidays of this country are used for the utilities that are not known,
+    unless it is the United States, whose holidays depend on the state
+    :param openei_tarif_obj: an instance of OpenEI_tariff that already call the API
+    :return: a HolidayCalendar
+    """
+
+    from electricitycostcalculator.electricity_rate_manager.calendar_structure import get_holiday_calendar, \
+        is_known_utility
+
+    utility_id = openei_tarif_obj.req_param['eia']
+
+    if not is_known_utility(utility_id) and len(openei_tarif_obj.data_openei) > 0:
+        country = openei_tarif_obj.data_openei[0].get('country')  # e.g. 'USA'
+        if country is not None and country not in US_COUNTRY_CODES:
+            return get_holiday_calendar(country=country)
+
+    return get_holiday_calendar(utility_id=utility_id)
+
+def read_tariff_library(filenames, pdp_events_path=None, pdp=True):
+    """
+    Build one ElectricityRateManager per tariff JSON file (e.g. the files of example/tariff_revised), to compare the
+    tariffs, see compare_tariffs(). The utility of each tariff is read from the 'eiaid' field of the file
+    :param filenames: a list of paths to JSON files, following the structure of the OpenEI API data
+    :param pdp_events_path: [optional] the path to the PDP events, see tariff_struct_from_openei_data()
+    :param pdp: [optional] if False, the PDP events and credits are not included
+    :return: a dict mapping the name of each file (without extension) to its ElectricityRateManager. The files that
+    couldn't be read are skipped, with a warning
+    """
+
+    from electricitycostcalculator.electricity_rate_manager.rate_manager import ElectricityRateManager
+
+    tariffs = {}
+    for filename in filenames:
+        openei_tarif_obj = OpenEI_tariff(pdp=pdp)
+        if openei_tarif_obj.read_from_json(filename=filename) != 0 or len(openei_tarif_obj.data_openei) == 0:
+            warnings.warn("The tariff {0} couldn't be read: it is skipped".format(filename), stacklevel=2)
+            continue
+
+        openei_tarif_obj.req_param['eia'] = str(openei_tarif_obj.data_openei[0].get('eiaid', 0))
+
+        rate_manager = ElectricityRateManager()
+        try:
+            tariff_struct_from_openei_data(openei_tarif_obj, rate_manager, pdp_events_path=pdp_events_path)
+        except ValueError as e:  # e.g. a rate that is not supported
+            warnings.warn("The tariff {0} couldn't be read: {1}".format(filename, e), stacklevel=2)
+            continue
+
+        tariffs[os.path.splitext(os.path.basename(filename))[0]] = rate_manager
+
+    return tariffs
+
 def populate_pdp_events_from_json(openei_tarif_obj, pdp_events_path):
     empty = []
     if not os.path.exists(pdp_events_path):
@@ -362,9 +437,10 @@ def update_pdp_json(openei_tarif_obj, pdp_dict, pdp_events_path):
         return True
     return False
 
-def get_energyrate_obj_from_openei(open_ei_block):
+def get_energyrate_obj_from_openei(open_ei_block, holiday_calendar=None):
+
+    from electricitycostcalculator.electricity_rate_manager.rate_structure import TouRateSchedule
 
-    # TODO later: use BlockRate instead of assuming it's a float !
     if 'energyratestructure' not in list(open_ei_block.keys()):
         return None
 
@@ -373,15 +449,17 @@ def get_energyrate_obj_from_openei(open_ei_block):
     weekdays_schedule = open_ei_block['energyweekdayschedule']
     weekends_schedule = open_ei_block['energyweekendschedule']
 
-    rate_struct = read_tou_rates(en_rate_list, weekdays_schedule, weekends_schedule)
+    rate_struct = read_tou_rates(en_rate_list, weekdays_schedule, weekends_schedule, keep_tiers=True)
 
     if rate_struct != {}:
-        return TouRateSchedule(rate_struct)
+        return TouRateSchedule(rate_struct, holiday_calendar)
     else:
         return None
 
 
-def get_flatdemand_obj_from_openei(open_ei_block):
+def get_flatdemand_obj_from_openei(open_ei_block, holiday_calendar=None):
+
+    from electricitycostcalculator.electricity_rate_manager.rate_structure import TouRateSchedule
 
     rate_struct = {}
     if 'flatdemandstructure' in list(open_ei_block.keys()):  # there is a flat demand rate
@@ -391,12 +469,14 @@ def get_flatdemand_obj_from_openei(open_ei_block):
         rate_struct = read_flat_rates(dem_rate_list, dem_time_schedule_month)
 
     if rate_struct != {}:
-        return TouRateSchedule(rate_struct)
+        return TouRateSchedule(rate_struct, holiday_calendar)
     else:
         return None
 
 
-def get_demandrate_obj_from_openei(open_ei_block):
+def get_demandrate_obj_from_openei(open_ei_block, holiday_calendar=None):
+
+    from electricitycostcalculator.electricity_rate_manager.rate_structure import TouRateSchedule
 
     if 'demandratestructure' not in list(open_ei_block.keys()):
         return None
@@ -409,20 +489,33 @@ def get_demandrate_obj_from_openei(open_ei_block):
     rate_struct = read_tou_rates(demand_rate_list, weekdays_schedule, weekends_schedule)
 
     if rate_struct != {}:
-        return TouRateSchedule(rate_struct)
+        return TouRateSchedule(rate_struct, holiday_calendar)
     else:
         return None
 
 
-def read_tou_rates(rate_map, weekdays_schedule, weekends_schedule):
+def read_tou_rates(rate_map, weekdays_schedule, weekends_schedule, keep_tiers=False):
+    """
+
+    :param rate_map: the list of periods of the OpenEI rate structure, each period being a list of tiers
+    :param weekdays_schedule: the OpenEI 12x24 schedule of the weekdays
+    :param weekends_schedule: the OpenEI 12x24 schedule of the weekends
+    :param keep_tiers: [optional] if True, the periods with several tiers are read as BlockRate. Otherwise, only the
+    rate of the first tier is kept.
+    :return:
+    """
+
+    from electricitycostcalculator.electricity_rate_manager.rate_structure import TouRateSchedule
 
     ret = {}
 
+    period_rates = [read_tiered_rate(tiers, keep_tiers) for tiers in rate_map]
+
     for m_i in range(12):
 
         already_added = False
-        daily_weekdays_rate = [rate_map[x][0]['rate'] for x in weekdays_schedule[m_i]]
-        daily_weekends_rate = [rate_map[x][0]['rate'] for x in weekends_schedule[m_i]]
+        daily_weekdays_rate = [period_rates[x] for x in weekdays_schedule[m_i]]
+        daily_weekends_rate = [period_rates[x] for x in weekends_schedule[m_i]]
 
         # Check if this schedule is already present
         for m_group_lab, m_group_data in list(ret.items()):
@@ -449,6 +542,42 @@ def read_tou_rates(rate_map, weekdays_schedule, weekends_schedule):
     return ret
 
 
+def read_tiered_rate(tiers, keep_tiers=True):
+    """
+    Read the tiers of an OpenEI rate period, each tier being a dict with a 'rate', an optional adjustment 'adj' added to
+    the rate and, but for the last one, a 'max' of monthly consumption in TIER_UNIT
+    :param tiers: the list of tiers of the period
+    :param keep_tiers: [optional] if False, only the rate of the first tier is returned
+    :return: a float, or a BlockRate if there are several tiers
+    :raise ValueError: if the maximum of a tier is given in another unit, e.g. per day ('kWh daily') or per kW of demand
+    ('kWh/kW'), which BlockRate doesn't support
+    """
+
+    if not keep_tiers or len(tiers) == 1:
+        return get_tier_rate(tiers[0])
+
+    from electricitycostcalculator.electricity_rate_manager.rate_structure import BlockRate
+
+    for t in tiers[:-1]:
+        if t.get('unit', TIER_UNIT) != TIER_UNIT:
+            raise ValueError("The tiers of consumption in '{0}' are not supported, only '{1}'".format(t['unit'], TIER_UNIT))
+
+    costs = [get_tier_rate(t) for t in tiers[1:]]
+    thresholds = [t['max'] for t in tiers[:-1]]
+
+    return BlockRate(get_tier_rate(tiers[0]), (costs, thresholds))
+
+
+def get_tier_rate(tier):
+    """
+    Return the rate of an OpenEI tier, including its adjustment
+    :param tier: a dict with a 'rate' and an optional 'adj'
+    :return: a float
+    """
+
+    return tier['rate'] + tier.get('adj', 0)
+
+
 def read_flat_rates(rate_map, month_schedule):
     """
 
@@ -456,6 +585,9 @@ def read_flat_rates(rate_map, month_schedule):
     :param month_schedule:
     :return:
     """
+
+    from electricitycostcalculator.electricity_rate_manager.rate_structure import TouRateSchedule
+
     map_month_label = {1: 'winter', 0: 'summer'}
     rate_struct = {}
 
@@ -466,7 +598,7 @@ def read_flat_rates(rate_map, month_schedule):
                                                       'allweek': {
                                                           TouRateSchedule.DAYSLIST_KEY: list(range(7)),
                                                           TouRateSchedule.RATES_KEY: 24 * [
-                                                              rate_map[rate_idx][0]['rate']]
+                                                              get_tier_rate(rate_map[rate_idx][0])]
                                                       }
                                                   }
                                                   }
@@ -475,7 +607,7 @@ def read_flat_rates(rate_map, month_schedule):
 
 # -- PDP manipulation
 
-def get_pdp_energycharge(openei_tarif_obj, date_start_event):
+def get_pdp_energycharge(openei_tarif_obj, date_start_event, holiday_calendar=None):
     """
 
     :param openei_tarif_obj:
@@ -483,6 +615,8 @@ def get_pdp_energycharge(openei_tarif_obj, date_start_event):
     :return:
     """
 
+    from electricitycostcalculator.electricity_rate_manager.rate_structure import TouRateSchedule
+
     # Search the corresponding block in the OpenEI data
     block_l = [data for data in openei_tarif_obj.data_openei if data['startdate'] <= date_start_event <= data['enddate']]
 
@@ -503,18 +637,19 @@ def get_pdp_energycharge(openei_tarif_obj, date_start_event):
                                                       }
                                                   }
                                                   }
-        return TouRateSchedule(rate_struct)
+        return TouRateSchedule(rate_struct, holiday_calendar)
     else:
         return None
 
-def get_pdp_credit_energyrate_obj_from_openei(open_ei_block):
+def get_pdp_credit_energyrate_obj_from_openei(open_ei_block, holiday_calendar=None):
     """
 
     :param block_rate:
     :return:
     """
 
-    # TODO later: use BlockRate instead of assuming it's a float !
+    from electricitycostcalculator.electricity_rate_manager.rate_structure import TouRateSchedule
+
     if 'pdp_credit_energyratestructure' not in list(open_ei_block.keys()):
         return None
 
@@ -523,20 +658,22 @@ def get_pdp_credit_energyrate_obj_from_openei(open_ei_block):
     weekdays_schedule = open_ei_block['energyweekdayschedule']
     weekends_schedule = open_ei_block['energyweekendschedule']
 
-    rate_struct = read_tou_rates(en_rate_list, weekdays_schedule, weekends_schedule)
+    rate_struct = read_tou_rates(en_rate_list, weekdays_schedule, weekends_schedule, keep_tiers=True)
 
     if rate_struct != {}:
-        return TouRateSchedule(rate_struct)
+        return TouRateSchedule(rate_struct, holiday_calendar)
     else:
         return None
 
-def get_pdp_credit_demandrate_obj_from_openei(open_ei_block):
+def get_pdp_credit_demandrate_obj_from_openei(open_ei_block, holiday_calendar=None):
     """
 
     :param block_rate:
     :return:
     """
 
+    from electricitycostcalculator.electricity_rate_manager.rate_structure import TouRateSchedule
+
     if 'pdp_credit_demandratestructure' not in list(open_ei_block.keys()):
         return None
 
@@ -554,6 +691,47 @@ def get_pdp_credit_demandrate_obj_from_openei(open_ei_block):
         rate_struct = read_flat_rates(pdp_demand_credit_list, monthly_schedule)
 
     if rate_struct != {}:
-        return TouRateSchedule(rate_struct)
+        return TouRateSchedule(rate_struct, holiday_calendar)
     else:
         return None
+
+
+# --- Lazy exports of the COST CALCULATOR LIB
+
+
+def get_lazy_exports():
+    """
+    Load the modules of LAZY_EXPORTS, and return the names they export
+    :return: a dict mapping each name to its object
+    """
+
+    if len(_lazy_exports) == 0:
+        exports = {}
+        for (module_name, names) in LAZY_EXPORTS:
+            module = importlib.import_module(module_name)
+            if names is None:
+                names = [name for name in vars(module) if not name.startswith('_')]
+            for name in names:
+                exports[name] = getattr(module, name)
+        _lazy_exports.update(exports)
+
+    return _lazy_exports
+
+
+def __getattr__(name):
+    """
+    Resolve the names of the COST CALCULATOR LIB on first access. "from openei_tariff_analyzer import *" reads __all__
+    from here: it exports the names of this module and of the COST CALCULATOR LIB, as the former "import *" chain did
+    """
+
+    if name == '__all__':
+        return sorted(set(get_lazy_exports().keys()) | {n for n in globals().keys() if not n.startswith('_')})
+
+    if name.startswith('__'):  # e.g. probed by inspect or pickle, without loading the COST CALCULATOR LIB
+        raise AttributeError("module {0!r} has no attribute {1!r}".format(__name__, name))
+
+    exports = get_lazy_exports()
+    if name in exports:
+        return exports[name]
+
+    raise AttributeError("module {0!r} has no attribute {1!r}".format(__name__, name))
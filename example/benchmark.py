@@ -0,0 +1,335 @@
+__author__ = 'Olivier Van Cutsem'
+
+import argparse
+import glob
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from electricitycostcalculator.electricity_rate_manager.rate_manager import ElectricityRateManager
+from electricitycostcalculator.electricity_rate_manager.tariff_structure import TariffElemPeriod
+from electricitycostcalculator.openei_tariff.openei_tariff_analyzer import OpenEI_tariff, tariff_struct_from_openei_data
+
+# ----------- BENCHMARK SUITE -------------- #
+#
+# Times the main entry points of the library on the bundled data (meter.csv and the tariffs of tariff_revised), and
+# saves the results in JSON so that two runs can be compared:
+#
+#   python benchmark.py --output before.json
+#   python benchmark.py --output after.json --baseline before.json
+#
+# The tariffs are read from the local JSON files: no call is made to the OpenEI API.
+
+EXAMPLE_PATH = os.path.abspath(os.path.dirname(__file__)) + '/'
+METER_PATH = EXAMPLE_PATH + 'meter.csv'
+TARIFFS_PATH = EXAMPLE_PATH + 'tariff_revised/'
+PDP_EVENTS_PATH = TARIFFS_PATH + 'PDP_events.json'
+
+TIMEZONE = 'America/Los_Angeles'
+METER_UUID = 'e9c51ce5-4aa1-399c-8172-92073e273a0b'
+
+# The month billed by 'compute_bill.single'
+SINGLE_BILL_PERIOD = (datetime(2017, 7, 1), datetime(2017, 7, 31, 23, 59, 59))
+
+# The horizons of the price signals
+PRICE_START_DATE = datetime(2016, 1, 1)
+PRICE_HORIZONS = [('1d', pd.Timedelta(days=1)),
+                  ('1m', pd.Timedelta(days=31)),
+                  ('1y', pd.Timedelta(days=366)),
+                  ('10y', pd.Timedelta(days=3653))]
+PRICE_TIMESTEPS = [TariffElemPeriod.QUARTERLY, TariffElemPeriod.HOURLY]
+
+# The modules whose import time is measured, each in a fresh interpreter, and the dependencies reported as loaded
+IMPORTED_MODULES = ['electricitycostcalculator',
+                    'electricitycostcalculator.electricity_rate_manager.rate_manager',
+                    'electricitycostcalculator.electricity_rate_manager.fleet_billing',
+                    'electricitycostcalculator.openei_tariff.openei_tariff_analyzer']
+HEAVY_DEPENDENCIES = ['pandas', 'numpy', 'holidays', 'requests', 'scipy', 'pyarrow']
+
+# Run in a fresh interpreter: time the import, or its peak memory under tracemalloc
+IMPORT_SCRIPT = """
+import json, sys, time, tracemalloc
+if sys.argv[2] == 'memory':
+    tracemalloc.start()
+t_start = time.perf_counter()
+__import__(sys.argv[1])
+duration = time.perf_counter() - t_start
+peak_memory = tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else 0
+print(json.dumps({'seconds': duration, 'peak_memory_bytes': peak_memory,
+                  'loaded': [m for m in json.loads(sys.argv[3]) if m in sys.modules]}))
+"""
+
+
+def load_meters():
+    """
+    Read the meter data, in the local time of the tariffs
+    :return: a pandas dataframe of energy consumption (in Wh), one column per meter
+    """
+
+    df = pd.read_csv(METER_PATH, index_col=0)
+    df = df.set_index(pd.to_datetime(df.index, utc=True))
+
+    return df.tz_convert(TIMEZONE).fillna(0)
+
+
+def read_tariff_json(filename):
+    """
+    Read a tariff file, without building its ElectricityRateManager
+    :param filename: the path to a JSON file of tariff_revised
+    :return: an OpenEI_tariff, or None if the file couldn't be read
+    """
+
+    openei_tarif_obj = OpenEI_tariff()
+    if openei_tarif_obj.read_from_json(filename=filename) != 0 or len(openei_tarif_obj.data_openei) == 0:
+        return None
+
+    openei_tarif_obj.req_param['eia'] = str(openei_tarif_obj.data_openei[0].get('eiaid', 0))
+
+    return openei_tarif_obj
+
+
+def build_rate_manager(openei_tarif_obj):
+    """
+    Build the ElectricityRateManager of a tariff read by read_tariff_json()
+    """
+
+    rate_manager = ElectricityRateManager()
+    tariff_struct_from_openei_data(openei_tarif_obj, rate_manager, pdp_events_path=PDP_EVENTS_PATH)
+
+    return rate_manager
+
+
+def measure(func, repeat, setup=None):
+    """
+    Time a function: a first (cold) run, 'repeat' timed runs, then one run under tracemalloc for the peak memory
+    :param func: the function to time, called with the output of setup
+    :param repeat: the number of timed runs after the first one
+    :param setup: [optional] a function called before each run, not timed. Its output is given to func
+    :return: a dict of the measures
+    """
+
+    def run():
+        arg = setup() if setup is not None else None
+        t_start = time.perf_counter()
+        func(arg)
+        return time.perf_counter() - t_start
+
+    first = run()
+    times = [run() for _ in range(repeat)]
+
+    arg = setup() if setup is not None else None
+    tracemalloc.start()
+    try:
+        func(arg)
+        (_, peak_memory) = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {'first_seconds': first,
+            'min_seconds': min(times),
+            'median_seconds': statistics.median(times),
+            'mean_seconds': statistics.mean(times),
+            'repeat': repeat,
+            'peak_memory_bytes': peak_memory}
+
+
+def measure_import(module_name, repeat):
+    """
+    Time the import of a module, each run in a fresh interpreter, then measure its peak memory under tracemalloc
+    :param module_name: the full name of the module
+    :param repeat: the number of timed runs after the first one
+    :return: a dict of the measures, as measure(), with the heavy dependencies loaded by the import
+    """
+
+    # The fresh interpreter finds the library where this one does
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(p for p in sys.path if p))
+
+    def run(mode):
+        output = subprocess.check_output([sys.executable, '-c', IMPORT_SCRIPT, module_name, mode,
+                                          json.dumps(HEAVY_DEPENDENCIES)], env=env)
+        return json.loads(output.decode().strip().splitlines()[-1])
+
+    first = run('time')
+    times = [run('time')['seconds'] for _ in range(repeat)]
+
+    return {'first_seconds': first['seconds'],
+            'min_seconds': min(times),
+            'median_seconds': statistics.median(times),
+            'mean_seconds': statistics.mean(times),
+            'repeat': repeat,
+            'peak_memory_bytes': run('memory')['peak_memory_bytes'],
+            'loaded_dependencies': first['loaded']}
+
+
+def run_import_benchmarks(repeat, name_filter=None):
+    """
+    Measure the import time of the modules of IMPORTED_MODULES
+    :param repeat: the number of timed runs of each import
+    :param name_filter: [optional] only run the benchmarks whose name contains this string
+    :return: a list of dict, one per module
+    """
+
+    results = []
+    if name_filter is not None and name_filter not in 'import':
+        return results
+
+    for module_name in IMPORTED_MODULES:
+        res = {'name': 'import', 'tariff': '', 'params': {'module': module_name}}
+        try:
+            res.update(measure_import(module_name, repeat))
+        except (subprocess.CalledProcessError, ValueError) as e:
+            res['error'] = '{0}: {1}'.format(type(e).__name__, e)
+        results.append(res)
+        print_result(res)
+
+    return results
+
+
+def run_benchmarks(tariff_files, repeat, name_filter=None):
+    """
+    Run all the benchmarks on each tariff
+    :param tariff_files: a list of paths to the tariff JSON files
+    :param repeat: the number of timed runs of each benchmark
+    :param name_filter: [optional] only run the benchmarks whose name contains this string
+    :return: a list of dict, one per benchmark and tariff
+    """
+
+    meters = load_meters()
+    meter = meters[METER_UUID]
+    meter_month = meter[(meter.index >= pd.Timestamp(SINGLE_BILL_PERIOD[0], tz=TIMEZONE))
+                        & (meter.index <= pd.Timestamp(SINGLE_BILL_PERIOD[1], tz=TIMEZONE))]
+
+    results = []
+
+    def add(name, tariff, params, func, setup=None):
+        if name_filter is not None and name_filter not in name:
+            return
+        res = {'name': name, 'tariff': tariff, 'params': params}
+        try:
+            res.update(measure(func, repeat, setup))
+        except Exception as e:
+            res['error'] = '{0}: {1}'.format(type(e).__name__, e)
+        results.append(res)
+        print_result(res)
+
+    for filename in tariff_files:
+        tariff = os.path.splitext(os.path.basename(filename))[0]
+
+        openei_tarif_obj = read_tariff_json(filename)
+        if openei_tarif_obj is None:
+            print("[in run_benchmarks] The tariff {0} couldn't be read".format(filename))  # debug
+            continue
+
+        # Tariff construction, from a fresh copy of the JSON data
+        add('tariff_struct_from_openei_data', tariff, {},
+            lambda tarif_obj: build_rate_manager(tarif_obj),
+            setup=lambda: read_tariff_json(filename))
+
+        rate_manager = build_rate_manager(openei_tarif_obj)
+
+        # Bills
+        add('compute_bill.single', tariff, {'meters': 1, 'points': len(meter_month)},
+            lambda _: rate_manager.compute_bill(meter_month))
+        add('compute_bill.monthly_detailed', tariff, {'meters': 1, 'points': len(meter)},
+            lambda _: rate_manager.compute_bill(meter, monthly_detailed=True))
+        add('compute_bill.multi_meter', tariff, {'meters': len(meters.columns), 'points': len(meters)},
+            lambda _: [rate_manager.compute_bill(meters, column_data=col, monthly_detailed=True) for col in meters.columns])
+        add('compute_bill_per_column', tariff, {'meters': len(meters.columns), 'points': len(meters)},
+            lambda _: rate_manager.compute_bill_per_column(meters, monthly_detailed=True))
+
+        # Price signals, the price cache being cleared before each run
+        for (horizon, duration) in PRICE_HORIZONS:
+            for timestep in PRICE_TIMESTEPS:
+                date_range = (PRICE_START_DATE, PRICE_START_DATE + duration - pd.Timedelta(seconds=1))
+                add('get_electricity_price', tariff, {'horizon': horizon, 'timestep': timestep.value},
+                    lambda _, r=date_range, t=timestep: rate_manager.get_electricity_price(r, t),
+                    setup=rate_manager.price_cache.clear)
+
+    return results
+
+
+def get_metadata(repeat):
+    """
+    The environment of the run
+    """
+
+    return {'date': datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'repeat': repeat}
+
+
+def get_result_key(res):
+    return res['name'], res['tariff'], json.dumps(res['params'], sort_keys=True)
+
+
+def print_result(res, baseline=None):
+    """
+    Print one line per result, with the ratio to the baseline if given
+    """
+
+    params = ' '.join('{0}={1}'.format(k, v) for k, v in sorted(res['params'].items()))
+    line = '{0:32} {1:72.72} {2:24}'.format(res['name'], res['tariff'], params)
+
+    if 'error' in res:
+        print(line + ' ERROR ' + res['error'])
+        return
+
+    line += ' {0:10.2f} ms {1:8.1f} MiB'.format(1000 * res['median_seconds'], res['peak_memory_bytes'] / 2.0**20)
+
+    if 'loaded_dependencies' in res:
+        line += ' [{0}]'.format(', '.join(res['loaded_dependencies']))
+
+    if baseline is not None and 'median_seconds' in baseline and baseline['median_seconds'] > 0:
+        line += '  x{0:.2f}'.format(res['median_seconds'] / baseline['median_seconds'])
+
+    print(line)
+
+
+def compare_results(results, baseline_path):
+    """
+    Print the ratio of the median times of a run to those of a previous run
+    """
+
+    with open(baseline_path, 'r') as baseline_file:
+        baseline = {get_result_key(res): res for res in json.load(baseline_file)['results']}
+
+    print("--- Compared to {0} (ratio of the median times)".format(baseline_path))
+    for res in results:
+        print_result(res, baseline.get(get_result_key(res)))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Benchmark of the electricity rate manager on the bundled data")
+    parser.add_argument('--output', default='benchmark_results.json', help="the JSON file of the results")
+    parser.add_argument('--repeat', type=int, default=5, help="the number of timed runs of each benchmark")
+    parser.add_argument('--tariff', default='', help="only run the tariffs whose file name contains this string")
+    parser.add_argument('--filter', default=None, help="only run the benchmarks whose name contains this string")
+    parser.add_argument('--baseline', default=None, help="a previous JSON file of results to compare with")
+    args = parser.parse_args()
+
+    tariff_files = sorted(f for f in glob.glob(TARIFFS_PATH + 'u*.json') if args.tariff in os.path.basename(f))
+
+    print("--- Running the benchmarks on {0} tariffs ...".format(len(tariff_files)))
+    results = run_import_benchmarks(args.repeat, args.filter)
+    results += run_benchmarks(tariff_files, args.repeat, args.filter)
+
+    with open(args.output, 'w') as output_file:
+        json.dump({'metadata': get_metadata(args.repeat), 'results': results}, output_file, indent=2)
+    print("--- Results saved in {0}".format(args.output))
+
+    if args.baseline is not None:
+        compare_results(results, args.baseline)
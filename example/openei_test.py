@@ -7,18 +7,6 @@ import pandas as pd
 # ----------- TEST DEMO -------------- #
 READ_FROM_JSON = False
 
-# useful functions
-def utc_to_local(data, local_zone="America/Los_Angeles"):
-    '''
-    This method takes in pandas DataFrame and adjusts index according to timezone in which is requested by user
-    '''
-
-    data = data.tz_convert(local_zone)  # accounts for localtime shift
-    # Gets rid of extra offset information so can compare with csv data
-    data = data.tz_localize(None)
-
-    return data
-
 if __name__ == '__main__':
 
     meter_uuid = 'e9c51ce5-4aa1-399c-8172-92073e273a0b'
@@ -33,8 +21,8 @@ if __name__ == '__main__':
     df = df.set_index(pd.to_datetime(df.index, infer_datetime_format=True, utc=True))
     df["date"] = df.index
 
-    data_meter = df[meter_uuid]
-    data_meter = utc_to_local(data_meter, local_zone="America/Los_Angeles")
+    # The tariffs are applied on the local time of the data
+    data_meter = df[meter_uuid].tz_convert("America/Los_Angeles")
 
     #
     ### Reading OpenEI-based tariff rates, and binding it to the ElectricityRateManager
@@ -66,8 +54,8 @@ if __name__ == '__main__':
     tariff_struct_from_openei_data(tariff_openei_apidata, elecrate_manager)  # This analyses the raw data from the openEI request and populate the "CostCalculator" object
 
     # BILLING PERIOD
-    start_date_bill = datetime(2017, 7, 1, hour=0, minute=0, second=0)
-    end_date_bill = datetime(2017, 7, 30, hour=23, minute=59, second=59)
+    start_date_bill = pd.Timestamp(datetime(2017, 7, 1, hour=0, minute=0, second=0), tz="America/Los_Angeles")
+    end_date_bill = pd.Timestamp(datetime(2017, 7, 30, hour=23, minute=59, second=59), tz="America/Los_Angeles")
     mask = (data_meter.index >= start_date_bill) & (data_meter.index <= end_date_bill)
     data_meter = data_meter.loc[mask]
     data_meter = data_meter.fillna(0)
@@ -0,0 +1,130 @@
+__author__ = 'Olivier Van Cutsem'
+
+import glob
+import json
+import os
+
+import pandas as pd
+import pytest
+
+from electricitycostcalculator.electricity_rate_manager.rate_manager import ElectricityRateManager
+from electricitycostcalculator.openei_tariff.openei_tariff_analyzer import OpenEI_tariff, tariff_struct_from_openei_data
+
+# The data bundled with the examples
+EXAMPLE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'example')
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+TARIFF_FILES = sorted(glob.glob(os.path.join(EXAMPLE_DIR, 'tariff_revised', 'u*.json')))
+PDP_EVENTS_PATH = os.path.join(EXAMPLE_DIR, 'tariff_revised', 'PDP_events.json')
+
+# The tariff altered by the tests that need a rate manager of their own
+TARIFF_NAME = 'u14328_Commercial_E-19_TOU_gridlevelSecondary_revised'
+
+# The meter billed in the tests
+METER_ID = 'e9c51ce5-4aa1-399c-8172-92073e273a0b'
+
+# The periods of the expected bills: one month, and several partial months
+BILL_PERIODS = [('2017-07-01 00:00', '2017-07-31 23:59'), ('2016-03-05 00:00', '2016-11-20 12:00')]
+
+
+def get_tariff_name(filename):
+
+    return os.path.splitext(os.path.basename(filename))[0]
+
+
+def load_rate_manager(filename, pdp=True):
+    """
+    Build the ElectricityRateManager of a bundled tariff file, the utility being read from its 'eiaid' field
+    """
+
+    openei_tariff = OpenEI_tariff(pdp=pdp)
+    openei_tariff.read_from_json(filename=filename)
+    openei_tariff.req_param['eia'] = str(openei_tariff.data_openei[0].get('eiaid', 0))
+
+    rate_manager = ElectricityRateManager()
+    tariff_struct_from_openei_data(openei_tariff, rate_manager, pdp_events_path=PDP_EVENTS_PATH if pdp else None)
+
+    return rate_manager
+
+
+def load_expected(name):
+    """
+    Load a JSON file of tests/data, computed by the dictionary-based implementation the library started from
+    """
+
+    with open(os.path.join(DATA_DIR, name + '.json')) as json_file:
+        return json.load(json_file)
+
+
+def decode_runs(runs):
+    """
+    Expand the [[value, count], ...] encoding of the arrays of tests/data, None standing for NaN
+    """
+
+    return [float('nan') if value is None else value for (value, count) in runs for _ in range(count)]
+
+
+@pytest.fixture(scope='session')
+def tariffs():
+    """
+    The bundled tariffs, with the PDP events: a dict mapping each tariff name to its ElectricityRateManager
+    """
+
+    return {get_tariff_name(filename): load_rate_manager(filename) for filename in TARIFF_FILES}
+
+
+@pytest.fixture
+def rate_manager():
+    """
+    A rate manager of its own, without the PDP events, for the tests that alter its tariffs or its state
+    """
+
+    return load_rate_manager(os.path.join(EXAMPLE_DIR, 'tariff_revised', TARIFF_NAME + '.json'), pdp=False)
+
+
+@pytest.fixture(scope='session')
+def meter_data():
+    """
+    The bundled meter data, in Wh, on the naive local time of the tariffs
+    """
+
+    df = pd.read_csv(os.path.join(EXAMPLE_DIR, 'meter.csv'), index_col=0)
+    df = df.set_index(pd.to_datetime(df.index, utc=True))
+
+    return df.tz_convert('America/Los_Angeles').tz_localize(None)
+
+
+@pytest.fixture(scope='session')
+def expected_bills():
+    """
+    The cost of each tariff label of the bills of METER_ID over BILL_PERIODS: tariff name -> period ->
+    {'monthly': {cycle: {label: cost}}, 'aggregated': {label: cost}}
+    """
+
+    return load_expected('expected_bills')
+
+
+def get_meter_series(meter_data, start, end):
+    """
+    Return the data of METER_ID between two dates, without duplicated dates and with the missing values set to 0
+    """
+
+    series = meter_data.loc[start:end, METER_ID]
+
+    return series[~series.index.duplicated()].fillna(0)
+
+
+def get_label_costs(bill):
+    """
+    Return the cost of each tariff label of a bill formatted as the output of ElectricityRateManager.compute_bill()
+    """
+
+    ret = {}
+    for label, data in bill.items():
+        if isinstance(data, dict):
+            ret[label] = sum(data_demand.get('cost', price * data_demand['max-demand'])
+                             for price, data_demand in data.items())
+        else:
+            ret[label] = data[1]
+
+    return ret
@@ -0,0 +1,93 @@
+__author__ = 'Olivier Van Cutsem'
+
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from electricitycostcalculator.electricity_rate_manager import arrow_export
+from electricitycostcalculator.electricity_rate_manager.tariff_structure import TariffElemPeriod
+
+from .conftest import get_meter_series
+
+RANGE_DATE = (datetime(2017, 6, 25), datetime(2017, 7, 5, 23, 45))
+
+
+@pytest.fixture
+def pa():
+    """
+    pyarrow, the tests of the export being skipped if it is not installed (or can't be loaded)
+    """
+
+    return pytest.importorskip('pyarrow', exc_type=ImportError)
+
+
+def test_float32_price_signals(rate_manager):
+
+    prices_64, _ = rate_manager.get_electricity_price(RANGE_DATE, TariffElemPeriod.QUARTERLY)
+    prices_32, _ = rate_manager.get_electricity_price(RANGE_DATE, TariffElemPeriod.QUARTERLY, dtype=np.float32)
+
+    assert (prices_64.dtypes == np.float64).all()
+    assert (prices_32.dtypes == np.float32).all()
+    pd.testing.assert_frame_equal(prices_32, prices_64.astype(np.float32))
+
+
+def test_price_signals_to_record_batch(pa, rate_manager):
+
+    prices, _ = rate_manager.get_electricity_price(RANGE_DATE, TariffElemPeriod.QUARTERLY)
+    batch = arrow_export.price_signals_to_record_batch(prices, tariff='E-19')
+
+    assert batch.schema.names == ['date', 'tariff', 'month'] + list(prices.columns)
+    assert batch.num_rows == len(prices)
+    assert batch.column(1).dictionary.to_pylist() == ['E-19']
+    assert batch.column(2).dictionary.to_pylist() == ['2017-06', '2017-07']
+    assert batch.column(0).to_pandas().tolist() == prices.index.tolist()
+
+    # The prices are wrapped without copy
+    for i, label in enumerate(prices.columns):
+        price_values = prices[label].values
+        assert batch.column(3 + i).buffers()[1].address == price_values.__array_interface__['data'][0]
+        np.testing.assert_array_equal(batch.column(3 + i).to_numpy(), price_values)
+
+
+def test_bill_to_record_batch(pa, tariffs, meter_data):
+
+    data = get_meter_series(meter_data, '2017-06-01 00:00', '2017-07-31 23:59')
+
+    for tariff_name, rate_manager in tariffs.items():
+        bill = rate_manager.compute_bill(data, return_bill=True)
+        table = arrow_export.bill_to_record_batch(bill, tariff=tariff_name, meter='meter').to_pandas()
+
+        assert len(table) == len(bill.lines)
+        assert table['cost'].sum() == pytest.approx(bill.get_total_cost(), rel=1e-12)
+        assert table['cycle'].astype(str).tolist() == [bill.cycles[c] for c in bill.lines['cycle']]
+        assert table['label'].astype(str).tolist() == [bill.labels[l] for l in bill.lines['label']]
+        assert (table['period_mask'].notna() == (bill.lines['period_slots'] > 0)).all()
+
+
+def test_write_parquet_dataset(pa, rate_manager, tmp_path):
+
+    pq = pytest.importorskip('pyarrow.parquet', exc_type=ImportError)
+
+    prices, _ = rate_manager.get_electricity_price(RANGE_DATE, TariffElemPeriod.QUARTERLY)
+    batch = arrow_export.price_signals_to_record_batch(prices, tariff='E-19')
+
+    arrow_export.write_parquet_dataset([batch], str(tmp_path))
+
+    assert sorted(p.name for p in (tmp_path / 'tariff=E-19').iterdir()) == ['month=2017-06', 'month=2017-07']
+
+    table = pq.read_table(str(tmp_path)).to_pandas().sort_values('date')
+    np.testing.assert_array_equal(table[prices.columns[0]].values, prices.iloc[:, 0].values)
+
+
+def test_export_without_pyarrow(rate_manager, monkeypatch):
+
+    monkeypatch.setattr(arrow_export, 'pa', None)
+
+    prices, _ = rate_manager.get_electricity_price(RANGE_DATE, TariffElemPeriod.QUARTERLY)
+
+    with pytest.raises(ImportError, match='pyarrow'):
+        arrow_export.price_signals_to_record_batch(prices)
+    with pytest.raises(ImportError, match='pyarrow'):
+        arrow_export.require_pyarrow('write_parquet_dataset')
@@ -0,0 +1,45 @@
+__author__ = 'Olivier Van Cutsem'
+
+import json
+import os
+import subprocess
+import sys
+
+from .conftest import EXAMPLE_DIR
+
+BENCHMARK_SCRIPT = os.path.join(EXAMPLE_DIR, 'benchmark.py')
+
+
+def run_benchmark(*args):
+    """
+    Run the benchmark suite in a fresh interpreter, from the sources of the repository
+    """
+
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(p for p in [os.path.dirname(EXAMPLE_DIR), env.get('PYTHONPATH')] if p)
+
+    return subprocess.run([sys.executable, BENCHMARK_SCRIPT] + list(args), env=env, check=True,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True).stdout
+
+
+def test_benchmark_results_are_saved_and_compared(tmp_path):
+
+    output_path = str(tmp_path / 'before.json')
+    run_benchmark('--repeat', '1', '--tariff', 'A-6', '--filter', 'compute_bill.single', '--output', output_path)
+
+    with open(output_path) as output_file:
+        output = json.load(output_file)
+
+    assert output['metadata']['repeat'] == 1
+    assert len(output['results']) == 1
+
+    res = output['results'][0]
+    assert res['name'] == 'compute_bill.single' and 'A-6' in res['tariff']
+    assert 'error' not in res
+    assert res['median_seconds'] > 0 and res['peak_memory_bytes'] > 0
+
+    stdout = run_benchmark('--repeat', '1', '--tariff', 'A-6', '--filter', 'compute_bill.single',
+                           '--output', str(tmp_path / 'after.json'), '--baseline', output_path)
+
+    assert 'Compared to {0}'.format(output_path) in stdout
+    assert ' x' in stdout.splitlines()[-1]
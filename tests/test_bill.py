@@ -0,0 +1,38 @@
+__author__ = 'Olivier Van Cutsem'
+
+import pytest
+
+from .conftest import BILL_PERIODS, METER_ID, get_label_costs, get_meter_series
+
+
+def assert_costs_equal(costs, expected_costs):
+
+    assert set(costs.keys()) == set(expected_costs.keys())
+    for label, cost in expected_costs.items():
+        assert costs[label] == pytest.approx(cost, rel=1e-9, abs=1e-9), label
+
+
+@pytest.mark.parametrize('period', BILL_PERIODS)
+def test_compute_bill_monthly_matches_baseline(tariffs, meter_data, expected_bills, period):
+
+    data = get_meter_series(meter_data, *period).to_frame()
+
+    for tariff_name, rate_manager in tariffs.items():
+        expected = expected_bills[tariff_name]['/'.join(period)]['monthly']
+        bill = rate_manager.compute_bill(data, METER_ID, monthly_detailed=True)
+
+        assert list(bill.keys()) == list(expected.keys())
+        for cycle_label, bill_cycle in bill.items():
+            assert_costs_equal(get_label_costs(bill_cycle), expected[cycle_label])
+
+
+@pytest.mark.parametrize('period', BILL_PERIODS)
+def test_compute_bill_aggregated_matches_baseline(tariffs, meter_data, expected_bills, period):
+
+    data = get_meter_series(meter_data, *period).to_frame()
+
+    for tariff_name, rate_manager in tariffs.items():
+        expected = expected_bills[tariff_name]['/'.join(period)]['aggregated']
+
+        assert_costs_equal(get_label_costs(rate_manager.compute_bill(data, METER_ID)), expected)
+
@@ -0,0 +1,56 @@
+__author__ = 'Olivier Van Cutsem'
+
+import json
+
+import pandas as pd
+import pytest
+
+from electricitycostcalculator.electricity_rate_manager.bill_accumulator import BillAccumulator
+
+from .conftest import get_meter_series
+
+
+def get_costs(bill):
+    """
+    Return the cost of each billing cycle and tariff label of a Bill
+    """
+
+    return bill.to_frame().groupby(['cycle', 'label'])['cost'].sum().to_dict()
+
+
+@pytest.mark.parametrize('freq', ['D', '7D'])
+def test_chunked_bill_matches_one_shot_bill(tariffs, meter_data, freq):
+
+    data = get_meter_series(meter_data, '2017-01-20 00:00', '2017-03-20 00:00')
+
+    for tariff_name, rate_manager in tariffs.items():
+        expected = get_costs(rate_manager.compute_bill(data, return_bill=True))
+
+        accumulator = BillAccumulator(rate_manager)
+        chunks = [chunk for (_, chunk) in data.groupby(pd.Grouper(freq=freq)) if len(chunk) > 0]
+        for i, chunk in enumerate(chunks):
+            accumulator.update(chunk)
+            if i == len(chunks) // 2:  # save and restore the state in the middle of a billing cycle
+                state = json.loads(json.dumps(accumulator.get_state()))
+                accumulator = BillAccumulator.from_state(rate_manager, state)
+
+        costs = get_costs(accumulator.bill)
+        assert set(costs.keys()) == set(expected.keys()), tariff_name
+        for key, cost in expected.items():
+            assert costs[key] == pytest.approx(cost, rel=1e-9, abs=1e-6), (tariff_name, key)
+        assert accumulator.nb_rejected == 0
+
+
+def test_late_data_are_rejected(tariffs, meter_data):
+
+    data = get_meter_series(meter_data, '2017-07-01 00:00', '2017-07-10 23:59')
+    rate_manager = next(iter(tariffs.values()))
+
+    accumulator = BillAccumulator(rate_manager)
+    accumulator.update(data)
+    expected = accumulator.bill.get_total_cost()
+
+    accumulator.update(data.iloc[-10:])
+
+    assert accumulator.nb_rejected == 10
+    assert accumulator.bill.get_total_cost() == pytest.approx(expected)
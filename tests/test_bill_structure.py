@@ -0,0 +1,123 @@
+__author__ = 'Olivier Van Cutsem'
+
+import json
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+import pytz
+
+from electricitycostcalculator.electricity_rate_manager.bill_structure import Bill
+from electricitycostcalculator.electricity_rate_manager.rate_manager import ElectricityRateManager
+from electricitycostcalculator.electricity_rate_manager.rate_structure import ChargeType, TouRateSchedule
+from electricitycostcalculator.electricity_rate_manager.tariff_structure import TouDemandChargeTariff
+
+from .conftest import BILL_PERIODS, get_meter_series
+from .test_bill import assert_costs_equal
+
+
+@pytest.mark.parametrize('period', BILL_PERIODS)
+def test_bill_matches_baseline(tariffs, meter_data, expected_bills, period):
+
+    data = get_meter_series(meter_data, *period).to_frame()
+
+    for tariff_name, rate_manager in tariffs.items():
+        expected = expected_bills[tariff_name]['/'.join(period)]
+
+        bill = rate_manager.compute_bill(data, return_bill=True)
+        assert bill.cycles == list(expected['monthly'].keys())
+        costs = bill.to_frame().groupby(['cycle', 'label'])['cost'].sum().to_dict()
+        for cycle_label, expected_costs in expected['monthly'].items():
+            # The labels without data have no line in the bill
+            assert_costs_equal({label: costs.get((cycle_label, label), 0.0) for label in expected_costs.keys()},
+                               expected_costs)
+        assert {label for (_, label) in costs.keys()} <= set(expected['aggregated'].keys())
+
+        bill = bill.aggregate()
+        assert_costs_equal(bill.get_cost_per_label(), expected['aggregated'])
+        assert bill.get_total_cost() == pytest.approx(sum(expected['aggregated'].values()), rel=1e-9, abs=1e-9)
+
+
+def test_to_dict_merges_demand_lines_with_the_same_price():
+
+    type_tariffs_map = {'demand': ChargeType.DEMAND}
+    mask_peak = [False, True, True, False]
+    mask_off_peak = [True, False, False, True]
+
+    bill = Bill.from_tariff_bills(['2017-07'], type_tariffs_map, [
+        ('demand', {'2017-07': {10.0: {'mask': mask_peak, 'max-demand': 5.0,
+                                       'max-demand-date': datetime(2017, 7, 3, 12)}}}),
+        ('demand', {'2017-07': {10.0: {'mask': mask_off_peak, 'max-demand': 7.0,
+                                       'max-demand-date': datetime(2017, 7, 4, 2)}}})])
+
+    assert len(bill) == 2
+
+    data_demand = bill.to_dict()['2017-07']['demand'][10.0]
+    assert data_demand['cost'] == pytest.approx(bill.get_total_cost())
+    assert data_demand['cost'] == pytest.approx(120.0)
+    assert data_demand['max-demand'] == 7.0
+    assert data_demand['max-demand-date'] == datetime(2017, 7, 4, 2)
+    assert data_demand['mask'] == [True, True, True, True]
+
+
+def get_five_minute_demand_tariff():
+    """
+    A demand charge whose periods are defined on 288 slots of 5 minutes, with boundaries that are not multiples of 64
+    """
+
+    daily_rates = [10.0 if 100 <= i < 201 else 2.0 for i in range(288)]
+    rates_schedule = {'allyear': {TouRateSchedule.MONTHLIST_KEY: list(range(1, 13)),
+                                  TouRateSchedule.DAILY_RATE_KEY: {
+                                      'allweek': {TouRateSchedule.DAYSLIST_KEY: list(range(7)),
+                                                  TouRateSchedule.RATES_KEY: daily_rates}}}}
+
+    dates = (datetime(2017, 1, 1, tzinfo=pytz.utc), datetime(2017, 12, 31, 23, 59, tzinfo=pytz.utc))
+
+    return TouDemandChargeTariff(dates, TouRateSchedule(rates_schedule))
+
+
+def test_masks_longer_than_128_slots():
+
+    rate_manager = ElectricityRateManager()
+    rate_manager.add_tariff(get_five_minute_demand_tariff(), 'customer_demand_charge_tou')
+
+    index = pd.date_range('2017-07-30 00:00', '2017-08-02 23:55', freq='5min')
+    data = pd.DataFrame({'meter': np.random.default_rng(2).uniform(0, 1000, len(index))}, index=index)
+
+    bill = rate_manager.compute_bill(data, 'meter', return_bill=True)
+
+    assert bill.lines.dtype['period_mask'].shape == (5,)
+    assert sorted(bill.lines['period_slots'].tolist()) == [288] * 4
+
+    bill_dict = rate_manager.compute_bill(data, 'meter', monthly_detailed=True)
+    assert bill.to_dict() == bill_dict
+    for price, expected_mask in ((10.0, [100 <= i < 201 for i in range(288)]),
+                                 (2.0, [not (100 <= i < 201) for i in range(288)])):
+        for cycle_label in ['2017-07', '2017-08']:
+            assert bill_dict[cycle_label]['customer_demand_charge_tou'][price]['mask'] == expected_mask
+
+    # The state and the concatenation with a bill of narrower masks keep the masks
+    state = json.loads(json.dumps(bill.get_state()))
+    assert Bill.from_state(state, rate_manager.type_tariffs_map).to_dict() == bill_dict
+
+    bill_narrow = Bill.from_tariff_bills(['2017-09'], rate_manager.type_tariffs_map, [
+        ('customer_demand_charge_tou', {'2017-09': {10.0: {'mask': [False, True], 'max-demand': 5.0,
+                                                           'max-demand-date': datetime(2017, 9, 3, 12)}}})])
+    assert bill_narrow.lines.dtype['period_mask'].shape == (Bill.MASK_WORDS,)
+
+    bill_all = Bill.concatenate([bill_narrow, bill])
+    assert bill_all.lines.dtype['period_mask'].shape == (5,)
+    assert bill_all.to_dict() == dict(bill_narrow.to_dict(), **bill_dict)
+    assert bill_all.get_total_cost() == pytest.approx(bill.get_total_cost() + 50.0)
+
+
+@pytest.mark.parametrize('period_slots', [1, 64, 96, 128, 129, 288, 1440])
+def test_encode_mask_round_trip(period_slots):
+
+    mask = (np.random.default_rng(period_slots).uniform(size=period_slots) > 0.5).tolist()
+
+    period_mask = Bill.encode_mask(mask)
+
+    assert len(period_mask) == Bill.get_mask_words(period_slots) == max(Bill.MASK_WORDS, -(-period_slots // 64))
+    assert Bill.decode_mask(period_mask, period_slots) == mask
@@ -0,0 +1,65 @@
+__author__ = 'Olivier Van Cutsem'
+
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+from electricitycostcalculator.electricity_rate_manager.calendar_structure import BillingCycleCalendar
+
+from .conftest import get_meter_series
+
+
+def test_from_read_day():
+
+    billing_cycles = BillingCycleCalendar.from_read_day(datetime(2017, 1, 20), datetime(2017, 4, 5), 17)
+
+    assert list(billing_cycles.boundaries) == [pd.Timestamp('2017-01-17'), pd.Timestamp('2017-02-17'),
+                                               pd.Timestamp('2017-03-17'), pd.Timestamp('2017-04-17')]
+    assert billing_cycles.labels == ['2017-01-17', '2017-02-17', '2017-03-17']
+
+
+def test_from_read_day_after_the_end_of_short_months():
+
+    billing_cycles = BillingCycleCalendar.from_read_day(datetime(2016, 1, 20), datetime(2016, 4, 5), 31)
+
+    assert billing_cycles.labels == ['2015-12-31', '2016-01-31', '2016-02-29', '2016-03-31']
+    assert billing_cycles.boundaries[-1] == pd.Timestamp('2016-04-30')
+
+
+@pytest.mark.parametrize('boundaries', [[datetime(2017, 2, 1), datetime(2017, 1, 1)],
+                                        [datetime(2017, 1, 1), datetime(2017, 2, 1), datetime(2017, 2, 1)]])
+def test_unsorted_boundaries_are_rejected(boundaries):
+
+    with pytest.raises(ValueError):
+        BillingCycleCalendar(boundaries)
+
+
+def test_labels_must_match_the_cycles():
+
+    boundaries = [datetime(2017, 1, 1), datetime(2017, 2, 1), datetime(2017, 3, 1)]
+
+    assert BillingCycleCalendar(boundaries, labels=['jan', 'feb']).labels == ['jan', 'feb']
+    with pytest.raises(ValueError):
+        BillingCycleCalendar(boundaries, labels=['jan'])
+
+
+def test_bill_of_the_billing_cycles(tariffs, meter_data):
+
+    data = get_meter_series(meter_data, '2017-01-20 00:00', '2017-03-20 00:00').to_frame()
+    boundaries = [datetime(2017, 2, 1), datetime(2017, 2, 15, 12), datetime(2017, 3, 1)]
+    billing_cycles = BillingCycleCalendar(boundaries)
+
+    for tariff_name, rate_manager in tariffs.items():
+        bill = rate_manager.compute_bill(data, monthly_detailed=True, billing_cycles=billing_cycles)
+
+        assert list(bill.keys()) == ['2017-02-01', '2017-02-15'], tariff_name
+        for i, cycle_label in enumerate(bill.keys()):
+            data_cycle = data[(data.index >= boundaries[i]) & (data.index < boundaries[i + 1])]
+
+            for label, bill_label in bill[cycle_label].items():
+                if label == 'customer_energy_charge' and bill_label[0] != 0:
+                    assert bill_label[0] == pytest.approx(data_cycle.values.sum() / 1000.0), (tariff_name, label)
+                elif isinstance(bill_label, dict):  # the demand out of the cycles is not billed
+                    for data_demand in bill_label.values():
+                        assert boundaries[i] <= data_demand['max-demand-date'] < boundaries[i + 1], (tariff_name, label)
@@ -0,0 +1,38 @@
+__author__ = 'Olivier Van Cutsem'
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from .conftest import decode_runs, load_expected
+
+
+@pytest.fixture(scope='module')
+def expected_block_prices():
+    """
+    The price of each time-of-use block every 15 minutes around the DST changes of 2017 in California, computed day by
+    day from the daily rates: tariff name -> label -> period -> position of the block -> prices
+    """
+
+    return load_expected('expected_block_prices')
+
+
+def test_get_prices_matches_daily_prices(tariffs, expected_block_prices):
+
+    nb_blocks = 0
+    for tariff_name, expected_labels in expected_block_prices.items():
+        for label, expected_periods in expected_labels.items():
+            l_blocks = tariffs[tariff_name].get_tariff_struct(label)
+
+            for period, expected_positions in expected_periods.items():
+                (start, end) = period.split('/')
+                dates = pd.date_range(start, end, freq='15min', tz='America/Los_Angeles')
+
+                for position, runs in expected_positions.items():
+                    prices = l_blocks[int(position)].get_prices(dates)
+
+                    np.testing.assert_array_equal(prices, np.array(decode_runs(runs)),
+                                                  err_msg=str((tariff_name, label, period, position)))
+                    nb_blocks += 1
+
+    assert nb_blocks > 0
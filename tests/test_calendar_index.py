@@ -0,0 +1,71 @@
+__author__ = 'Olivier Van Cutsem'
+
+import numpy as np
+import pandas as pd
+
+from electricitycostcalculator.electricity_rate_manager.calendar_structure import CalendarIndex, get_holiday_calendar
+
+from .conftest import get_label_costs, get_meter_series
+from .test_bill import assert_costs_equal
+
+
+def assert_features_equal(calendar, local_dates):
+
+    np.testing.assert_array_equal(calendar.months, local_dates.month)
+    np.testing.assert_array_equal(calendar.years, local_dates.year)
+    np.testing.assert_array_equal(calendar.days_of_year, local_dates.dayofyear - 1)
+    np.testing.assert_array_equal(calendar.minutes, local_dates.hour * 60 + local_dates.minute)
+
+
+def test_features_on_the_wall_clock():
+
+    # Both DST changes, from UTC
+    dates = pd.date_range('2017-03-11 00:00', '2017-11-06 00:00', freq='15min', tz='UTC')
+    local_dates = dates.tz_convert('America/Los_Angeles').tz_localize(None)
+
+    assert_features_equal(CalendarIndex.get(dates, 'America/Los_Angeles'), local_dates)
+    assert_features_equal(CalendarIndex.get(dates.tz_convert('America/Los_Angeles')), local_dates)
+    assert_features_equal(CalendarIndex.get(local_dates), local_dates)
+    assert_features_equal(CalendarIndex.get(dates.asi8 // 10**9, 'America/Los_Angeles'), local_dates)
+
+    holiday_calendar = get_holiday_calendar()
+    np.testing.assert_array_equal(CalendarIndex.get(dates, 'America/Los_Angeles').get_day_types(holiday_calendar),
+                                  holiday_calendar.get_day_types(local_dates))
+
+
+def test_calendar_is_shared_by_the_slices_of_an_index():
+
+    dates = pd.date_range('2017-01-01 00:00', '2017-12-31 23:45', freq='15min')
+    calendar = CalendarIndex.get(dates)
+
+    assert CalendarIndex.get(dates) is calendar
+    assert CalendarIndex.get(dates, 'America/Los_Angeles') is calendar  # naive dates are already local
+
+    # A slice of the dates gets a view on the same features
+    calendar_slice = CalendarIndex.get(dates[1000:5000])
+    assert calendar_slice.months.base is calendar.months
+    assert_features_equal(calendar_slice, dates[1000:5000])
+    assert_features_equal(calendar_slice[10:20], dates[1010:1020])
+
+    day_types = calendar.get_day_types(get_holiday_calendar())
+    assert calendar.get_day_types(get_holiday_calendar()) is day_types
+    np.testing.assert_array_equal(calendar_slice.get_day_types(get_holiday_calendar()), day_types[1000:5000])
+
+    # Another index with the same dates has a calendar of its own
+    assert CalendarIndex.get(pd.DatetimeIndex(dates.values.copy())) is not calendar
+
+
+def test_bill_of_timezone_aware_data_matches_baseline(tariffs, meter_data, expected_bills):
+
+    # The dates read from UTC, billed on the wall clock of the tariffs
+    period = ('2017-07-01 00:00', '2017-07-31 23:59')
+    data = get_meter_series(meter_data, *period)
+    data.index = data.index.tz_localize('America/Los_Angeles').tz_convert('UTC').tz_convert('America/Los_Angeles')
+
+    for tariff_name, rate_manager in tariffs.items():
+        expected = expected_bills[tariff_name]['/'.join(period)]['monthly']
+        bill = rate_manager.compute_bill(data.to_frame(), monthly_detailed=True)
+
+        assert list(bill.keys()) == list(expected.keys())
+        for cycle_label, bill_cycle in bill.items():
+            assert_costs_equal(get_label_costs(bill_cycle), expected[cycle_label])
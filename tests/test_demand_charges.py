@@ -0,0 +1,49 @@
+__author__ = 'Olivier Van Cutsem'
+
+import pandas as pd
+import pytest
+
+from .conftest import BILL_PERIODS, load_expected, get_meter_series
+
+
+@pytest.fixture(scope='module')
+def expected_demand_charges():
+    """
+    The bill of each demand charge block over BILL_PERIODS: tariff name -> label -> period -> position of the block ->
+    {cycle: [[price, max-demand, max-demand-date, mask], ...]}
+    """
+
+    return load_expected('expected_demand_charges')
+
+
+@pytest.mark.parametrize('period', BILL_PERIODS)
+def test_demand_charge_blocks_match_baseline(tariffs, meter_data, expected_demand_charges, period):
+
+    data = get_meter_series(meter_data, *period).to_frame()
+    col = data.columns[0]
+
+    nb_blocks = 0
+    for tariff_name, expected_labels in expected_demand_charges.items():
+        for label, expected_periods in expected_labels.items():
+            l_blocks = tariffs[tariff_name].get_tariff_struct(label)
+
+            for position, expected in expected_periods.get('/'.join(period), {}).items():
+                bill = l_blocks[int(position)].compute_bill(data, col)
+
+                assert list(bill.keys()) == list(expected.keys()), (tariff_name, label, position)
+                for cycle_label, bill_cycle in bill.items():
+                    assert sorted(bill_cycle.keys()) == [price for price, _, _, _ in expected[cycle_label]]
+
+                    # The free periods are left out: the dictionary-based implementation kept one entry per price,
+                    # overwritten by each new daily mask of this price (e.g. the off-peak hours of the working days
+                    # and the whole weekend)
+                    result = [[price, data_demand['max-demand'], pd.Timestamp(data_demand['max-demand-date']),
+                               list(data_demand['mask'])] for price, data_demand in sorted(bill_cycle.items())
+                              if price != 0]
+                    expected_cycle = [[price, max_demand, pd.Timestamp(date), mask]
+                                      for (price, max_demand, date, mask) in expected[cycle_label] if price != 0]
+                    assert result == expected_cycle, (tariff_name, label, position, cycle_label)
+
+                nb_blocks += 1
+
+    assert nb_blocks > 0
@@ -0,0 +1,75 @@
+__author__ = 'Olivier Van Cutsem'
+
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+import pytz
+
+from electricitycostcalculator.electricity_rate_manager.rate_structure import TouRateSchedule
+from electricitycostcalculator.electricity_rate_manager.tariff_structure import TouDemandChargeTariff
+
+DEMAND_WINDOW = pd.Timedelta('15min')
+
+
+def get_demand_tariff():
+    """
+    A flat demand charge over 2017, with a demand window of DEMAND_WINDOW
+    """
+
+    rates_schedule = {'allyear': {TouRateSchedule.MONTHLIST_KEY: list(range(1, 13)),
+                                  TouRateSchedule.DAILY_RATE_KEY: {
+                                      'allweek': {TouRateSchedule.DAYSLIST_KEY: list(range(7)),
+                                                  TouRateSchedule.RATES_KEY: [10.0] * 24}}}}
+
+    dates = (datetime(2017, 1, 1, tzinfo=pytz.utc), datetime(2017, 12, 31, 23, 59, tzinfo=pytz.utc))
+
+    return TouDemandChargeTariff(dates, TouRateSchedule(rates_schedule), demand_window=DEMAND_WINDOW)
+
+
+def get_window_demand(series, date, timestep):
+    """
+    The average power (kW) over the demand window ending with a data point, None if some data of the window are missing
+    """
+
+    nb_steps = int(DEMAND_WINDOW / timestep)
+    dates = [date - k * timestep for k in range(nb_steps)]
+    if not all(d in series.index for d in dates) or series[dates].isnull().any():
+        return None
+
+    return series[dates].sum() / 1000.0 * 3600 / DEMAND_WINDOW.total_seconds()
+
+
+@pytest.mark.parametrize('freq', ['1min', '5min'])
+def test_rolling_demand_with_incomplete_windows(freq):
+
+    timestep = pd.Timedelta(freq)
+    index = pd.date_range('2017-07-03 00:00', '2017-07-03 06:00', freq=freq)
+    series = pd.Series(np.random.default_rng(3).uniform(0, 100, len(index)), index=index)
+
+    series.iloc[10] = np.nan  # a missing value
+    series = series.drop(index[40:42])  # and missing dates
+
+    demand = get_demand_tariff().get_demand_values(series.to_frame())
+
+    assert len(demand) == len(series)
+    for date, value in zip(series.index, demand):
+        expected = get_window_demand(series, date, timestep)
+        if expected is None:
+            assert np.isnan(value), date
+        else:
+            assert value == pytest.approx(expected, rel=1e-12), date
+
+    assert np.isnan(demand).sum() > int(DEMAND_WINDOW / timestep)  # the first window and the ones with missing data
+
+
+@pytest.mark.parametrize('freq', ['15min', '1H'])
+def test_demand_of_coarse_data(freq):
+
+    index = pd.date_range('2017-07-03 00:00', '2017-07-03 06:00', freq=freq)
+    df = pd.DataFrame({'meter': np.random.default_rng(4).uniform(0, 100, len(index))}, index=index)
+
+    demand = get_demand_tariff().get_demand_values(df, 'meter')
+
+    np.testing.assert_allclose(demand, df['meter'].values / 1000.0 * 3600 / pd.Timedelta(freq).total_seconds())
@@ -0,0 +1,146 @@
+__author__ = 'Olivier Van Cutsem'
+
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import pytest
+
+from electricitycostcalculator.electricity_rate_manager import fleet_billing
+from electricitycostcalculator.electricity_rate_manager.calendar_structure import BillingCycleCalendar
+from electricitycostcalculator.electricity_rate_manager.fleet_billing import FleetBillingError, compute_fleet_bills
+from electricitycostcalculator.electricity_rate_manager.rate_manager import ElectricityRateManager
+
+FLEET_TARIFFS = ['u14328_Commercial_E-19_TOU_gridlevelSecondary_revised', 'u17609_Commercial_TOU-8_TOU_revised']
+
+
+class FailingRateManager(ElectricityRateManager):
+    """
+    A rate manager whose bills can't be computed, sent to the workers like any other
+    """
+
+    def compute_bill(self, df, *args, **kwargs):
+        raise ValueError('no bill for {0}'.format(df.name))
+
+
+def get_fleet_jobs(tariffs, meter_data):
+    """
+    One job per meter of the bundled data, the tariffs alternating between the meters
+    """
+
+    data = meter_data.loc['2017-06-20 00:00':'2017-08-10 23:59']
+    data = data[~data.index.duplicated()].fillna(0)
+
+    return [(col, data[col], tariffs[FLEET_TARIFFS[i % len(FLEET_TARIFFS)]]) for i, col in enumerate(data.columns)]
+
+
+def assert_fleet_bills_equal(bills, jobs, **kwargs):
+
+    assert set(bills.keys()) == {job_id for (job_id, _, _) in jobs}
+    for (job_id, meter_series, rate_manager) in jobs:
+        expected = rate_manager.compute_bill(meter_series, return_bill=True, **kwargs)
+        assert bills[job_id].get_total_cost() == pytest.approx(expected.get_total_cost(), rel=1e-9), job_id
+        assert bills[job_id].get_cost_per_cycle() == pytest.approx(expected.get_cost_per_cycle(), rel=1e-9), job_id
+
+
+@pytest.mark.parametrize('billing_cycles', [None, BillingCycleCalendar.from_read_day(datetime(2017, 6, 20),
+                                                                                     datetime(2017, 8, 10), 17)])
+def test_fleet_bills_match_compute_bill(tariffs, meter_data, billing_cycles):
+
+    jobs = get_fleet_jobs(tariffs, meter_data)
+    assert len(jobs) == 13
+
+    bills = dict(compute_fleet_bills(jobs, nb_workers=2, return_bill=True, billing_cycles=billing_cycles))
+
+    assert_fleet_bills_equal(bills, jobs, billing_cycles=billing_cycles)
+
+    bills_dict = dict(compute_fleet_bills(jobs[:2], nb_workers=2, monthly_detailed=True, billing_cycles=billing_cycles))
+    for (job_id, meter_series, rate_manager) in jobs[:2]:
+        assert bills_dict[job_id].keys() == rate_manager.compute_bill(meter_series, monthly_detailed=True,
+                                                                      billing_cycles=billing_cycles).keys()
+
+
+def test_fleet_bills_without_shared_memory(tariffs, meter_data, monkeypatch):
+
+    monkeypatch.setattr(fleet_billing, 'shared_memory', None)
+
+    jobs = get_fleet_jobs(tariffs, meter_data)[:4]
+    bills = dict(compute_fleet_bills(jobs, nb_workers=2, return_bill=True))
+
+    assert_fleet_bills_equal(bills, jobs)
+
+
+def test_jobs_in_flight_are_bounded(tariffs, meter_data):
+
+    jobs = get_fleet_jobs(tariffs, meter_data)
+    nb_submitted = [0]
+
+    def generate_jobs():
+        for job in jobs:
+            nb_submitted[0] += 1
+            yield job
+
+    nb_yielded = 0
+    for (job_id, bill) in compute_fleet_bills(generate_jobs(), nb_workers=2, max_in_flight=3):
+        assert nb_submitted[0] - nb_yielded <= 3
+        nb_yielded += 1
+
+    assert nb_yielded == nb_submitted[0] == len(jobs)
+
+
+def test_failing_job_raises(tariffs, meter_data):
+
+    jobs = get_fleet_jobs(tariffs, meter_data)[:4]
+    (job_id, meter_series, _) = jobs[2]
+    jobs[2] = (job_id, meter_series, FailingRateManager())
+
+    with pytest.raises(FleetBillingError) as exc_info:
+        list(compute_fleet_bills(jobs, nb_workers=2))
+
+    assert exc_info.value.job_id == job_id
+    assert isinstance(exc_info.value.error, ValueError)
+    assert 'no bill for {0}'.format(job_id) in str(exc_info.value)
+
+
+def test_failing_job_yields_its_error(tariffs, meter_data):
+
+    jobs = get_fleet_jobs(tariffs, meter_data)[:4]
+    (job_id, meter_series, _) = jobs[2]
+    jobs[2] = (job_id, meter_series, FailingRateManager())
+
+    bills = dict(compute_fleet_bills(jobs, nb_workers=2, on_error='yield', return_bill=True))
+
+    assert isinstance(bills.pop(job_id), ValueError)
+    assert_fleet_bills_equal(bills, jobs[:2] + jobs[3:])
+
+    with pytest.raises(ValueError):
+        list(compute_fleet_bills(jobs, on_error='ignore'))
+
+
+def test_billing_cycles_are_sent_once(tariffs, meter_data, monkeypatch):
+
+    jobs = get_fleet_jobs(tariffs, meter_data)[:4]
+    billing_cycles = BillingCycleCalendar.from_read_day(datetime(2017, 6, 20), datetime(2017, 8, 10), 17)
+
+    # The cycle table of the last dates split is not pickled
+    state_size = len(pickle.dumps(billing_cycles))
+    billing_cycles.get_cycle_bounds(jobs[0][1].index)
+    assert len(pickle.dumps(billing_cycles)) == state_size
+
+    submitted = []
+
+    class RecordingExecutor(ProcessPoolExecutor):
+        def submit(self, fn, *args):
+            submitted.append(args)
+            return super(RecordingExecutor, self).submit(fn, *args)
+
+    monkeypatch.setattr(fleet_billing, 'ProcessPoolExecutor', RecordingExecutor)
+
+    bills = dict(compute_fleet_bills(jobs, nb_workers=2, return_bill=True, billing_cycles=billing_cycles))
+
+    assert_fleet_bills_equal(bills, jobs, billing_cycles=billing_cycles)
+
+    # Each job only carries the descriptor of the same shared block
+    assert len(submitted) == len(jobs)
+    assert not any(isinstance(arg, BillingCycleCalendar) for args in submitted for arg in args)
+    assert len({repr(args[-1]) for args in submitted}) == 1
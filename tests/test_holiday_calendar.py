@@ -0,0 +1,144 @@
+__author__ = 'Olivier Van Cutsem'
+
+import os
+import warnings
+from datetime import date
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from electricitycostcalculator.electricity_rate_manager import calendar_structure
+from electricitycostcalculator.electricity_rate_manager.calendar_structure import UTILITY_HOLIDAY_CALENDARS, \
+    HolidayCalendar, get_holiday_calendar, register_utility_calendar
+from electricitycostcalculator.electricity_rate_manager.rate_manager import ElectricityRateManager
+from electricitycostcalculator.openei_tariff.openei_tariff_analyzer import OpenEI_tariff, tariff_struct_from_openei_data
+
+from .conftest import EXAMPLE_DIR, TARIFF_NAME
+
+
+def test_year_day_types():
+
+    day_types = HolidayCalendar('US', 'CA').get_year_day_types(2017)
+
+    assert len(day_types) == 365
+    assert day_types.dtype == np.uint8
+    assert not day_types.flags.writeable
+
+    assert day_types[0] == HolidayCalendar.HOLIDAY  # New Year's Day, a Sunday
+    assert day_types[1] == HolidayCalendar.HOLIDAY  # New Year's Day (Observed)
+    assert list(day_types[2:9]) == [1, 2, 3, 4, 5, 6, 0]
+    assert day_types[date(2017, 3, 31).timetuple().tm_yday - 1] == HolidayCalendar.HOLIDAY  # Cesar Chavez Day
+    assert day_types[date(2017, 7, 4).timetuple().tm_yday - 1] == HolidayCalendar.HOLIDAY
+    assert day_types[date(2017, 7, 5).timetuple().tm_yday - 1] == 2
+
+    assert len(HolidayCalendar('US', 'CA').get_year_day_types(2016)) == 366
+
+
+def test_state_holidays():
+
+    assert HolidayCalendar('US', 'CA').is_holiday(date(2016, 3, 31))
+    assert not HolidayCalendar('US').is_holiday(date(2016, 3, 31))
+
+    assert HolidayCalendar('US', 'NY').is_holiday(date(2016, 2, 12))  # Lincoln's Birthday
+    assert not HolidayCalendar('US', 'CA').is_holiday(date(2016, 2, 12))
+
+
+def test_get_day_types_matches_get_day_type():
+
+    holiday_calendar = HolidayCalendar('US', 'CA')
+    dates = pd.date_range('2015-12-25', '2018-01-05 23:00', freq='7H')
+
+    expected = np.array([holiday_calendar.get_day_type(d) for d in dates], dtype=np.uint8)
+
+    np.testing.assert_array_equal(holiday_calendar.get_day_types(dates), expected)
+    np.testing.assert_array_equal(holiday_calendar.get_day_types(dates[::-1]), expected[::-1])
+
+
+def test_years_are_kept_in_an_lru_cache():
+
+    holiday_calendar = HolidayCalendar('US', 'CA', max_cached_years=2)
+
+    day_types_2016 = holiday_calendar.get_year_day_types(2016)
+    day_types_2017 = holiday_calendar.get_year_day_types(2017)
+    assert holiday_calendar.get_year_day_types(2016) is day_types_2016  # 2016 becomes the most recently used
+
+    holiday_calendar.get_year_day_types(2018)  # evicts 2017, the least recently used
+
+    assert holiday_calendar.get_year_day_types(2016) is day_types_2016
+    day_types_2017_again = holiday_calendar.get_year_day_types(2017)
+    assert day_types_2017_again is not day_types_2017
+    np.testing.assert_array_equal(day_types_2017_again, day_types_2017)
+
+
+def test_holiday_calendars_are_shared():
+
+    assert get_holiday_calendar(utility_id='14328') is get_holiday_calendar('US', 'CA')
+    assert get_holiday_calendar(utility_id=17609) is get_holiday_calendar()
+    assert get_holiday_calendar('US', 'NY') is get_holiday_calendar('US', 'NY')
+
+
+def test_unknown_utility_uses_the_default_calendar_with_a_warning():
+
+    with pytest.warns(UserWarning, match='utility 99999 is unknown'):
+        assert get_holiday_calendar(utility_id='99999') is get_holiday_calendar()
+
+
+def get_openei_rate_manager(utility_id, country):
+    """
+    Build the rate manager of a bundled tariff as if it was the one of another utility
+    """
+
+    openei_tariff = OpenEI_tariff(pdp=False)
+    openei_tariff.read_from_json(filename=os.path.join(EXAMPLE_DIR, 'tariff_revised', TARIFF_NAME + '.json'))
+    for block_rate in openei_tariff.data_openei:
+        block_rate['eiaid'] = utility_id
+        block_rate['country'] = country
+    openei_tariff.req_param['eia'] = str(utility_id)
+
+    rate_manager = ElectricityRateManager()
+    tariff_struct_from_openei_data(openei_tariff, rate_manager)
+
+    return rate_manager
+
+
+def get_holiday_calendars(rate_manager):
+
+    return {tariff_block.rate_schedule.holiday_calendar for tariff_block in
+            rate_manager.get_tariff_struct('customer_energy_charge')}
+
+
+def test_registered_utility_uses_its_state_holidays(monkeypatch):
+
+    monkeypatch.setattr(calendar_structure, 'UTILITY_HOLIDAY_CALENDARS', dict(UTILITY_HOLIDAY_CALENDARS))
+    register_utility_calendar(13573, 'US', 'NY')  # Niagara Mohawk Power Corp
+
+    with warnings.catch_warnings():
+        warnings.filterwarnings('error', message='The location of the utility')
+        rate_manager = get_openei_rate_manager(13573, 'USA')
+
+    assert get_holiday_calendars(rate_manager) == {get_holiday_calendar('US', 'NY')}
+
+    # Lincoln's Birthday 2016, a Friday, is a holiday in New York only
+    dates = pd.date_range('2016-02-12 12:00', periods=1)
+    tariff_block = rate_manager.get_tariff_struct('customer_energy_charge', (dates[0], dates[0]))[0]
+    assert tariff_block.rate_schedule.holiday_calendar.get_day_types(dates)[0] == HolidayCalendar.HOLIDAY
+
+
+def test_unknown_utility_uses_the_holidays_of_its_country():
+
+    with warnings.catch_warnings():
+        warnings.filterwarnings('error', message='The location of the utility')
+        rate_manager = get_openei_rate_manager(99999, 'CAN')
+
+    holiday_calendars = get_holiday_calendars(rate_manager)
+    assert holiday_calendars == {get_holiday_calendar('CAN')}
+    assert holiday_calendars.pop().is_holiday(date(2017, 7, 3))  # Canada Day (Observed)
+
+
+def test_unknown_us_utility_uses_the_default_calendar_with_a_warning():
+
+    with pytest.warns(UserWarning, match='utility 99999 is unknown'):
+        rate_manager = get_openei_rate_manager(99999, 'USA')
+
+    assert get_holiday_calendars(rate_manager) == {get_holiday_calendar()}
@@ -0,0 +1,57 @@
+__author__ = 'Olivier Van Cutsem'
+
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from .conftest import EXAMPLE_DIR
+
+# The dependencies only needed to call the OpenEI API or to build the tariffs
+HEAVY_DEPENDENCIES = ['requests', 'holidays']
+
+
+def get_loaded_modules(script):
+    """
+    Run a script in a fresh interpreter, and return the names of HEAVY_DEPENDENCIES and of the modules of the package
+    it loaded
+    """
+
+    script += '\nimport json, sys\nprint(json.dumps(sorted(sys.modules.keys())))'
+
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(p for p in [os.path.dirname(EXAMPLE_DIR), env.get('PYTHONPATH')] if p)
+
+    stdout = subprocess.run([sys.executable, '-c', script], env=env, check=True, stdout=subprocess.PIPE,
+                            universal_newlines=True).stdout
+
+    return [m for m in json.loads(stdout.splitlines()[-1])
+            if m.split('.')[0] in HEAVY_DEPENDENCIES + ['electricitycostcalculator']]
+
+
+@pytest.mark.parametrize('module', ['electricitycostcalculator',
+                                    'electricitycostcalculator.openei_tariff.openei_tariff_analyzer',
+                                    'electricitycostcalculator.electricity_rate_manager.rate_manager',
+                                    'electricitycostcalculator.electricity_rate_manager.fleet_billing'])
+def test_import_does_not_load_the_openei_dependencies(module):
+
+    loaded = get_loaded_modules('import ' + module)
+
+    assert not [m for m in loaded if m.split('.')[0] in HEAVY_DEPENDENCIES]
+
+
+def test_sub_packages_are_loaded_on_first_access():
+
+    assert get_loaded_modules('import electricitycostcalculator') == ['electricitycostcalculator']
+
+    loaded = get_loaded_modules('import electricitycostcalculator\n'
+                                'electricitycostcalculator.openei_tariff')
+    assert loaded == ['electricitycostcalculator', 'electricitycostcalculator.openei_tariff']
+
+    # "import *" still exports the tariff structures
+    loaded = get_loaded_modules('from electricitycostcalculator.openei_tariff.openei_tariff_analyzer import *\n'
+                                'assert ElectricityRateManager and TouDemandChargeTariff and OpenEI_tariff')
+    assert 'electricitycostcalculator.electricity_rate_manager.rate_manager' in loaded
+    assert 'requests' not in loaded
@@ -0,0 +1,123 @@
+__author__ = 'Olivier Van Cutsem'
+
+import json
+import threading
+
+import pytest
+
+from electricitycostcalculator.electricity_rate_manager import instrumentation
+from electricitycostcalculator.electricity_rate_manager.instrumentation import Instrumentation
+
+from .conftest import get_meter_series
+
+
+def get_block_bill_count(stats):
+    """
+    The number of tariff blocks billed, over all the labels
+    """
+
+    return sum(count for (stage, _, _), (count, _, _) in stats.get_timers().items()
+               if stage == instrumentation.STAGE_BLOCK_BILL)
+
+
+def test_stages_are_collected_per_label(rate_manager, meter_data):
+
+    data = get_meter_series(meter_data, '2017-06-01 00:00', '2017-07-31 23:59').to_frame()
+    calls = []
+
+    assert not instrumentation.is_enabled()
+    with Instrumentation(callback=lambda *args: calls.append(args)) as stats:
+        assert instrumentation.is_enabled()
+        rate_manager.compute_bill(data)
+    assert not instrumentation.is_enabled()
+
+    timers = stats.get_timers()
+    stages = {stage for (stage, _, _) in timers.keys()}
+    assert {instrumentation.STAGE_BLOCK_LOOKUP, instrumentation.STAGE_BLOCK_BILL,
+            instrumentation.STAGE_BILL_MERGE} <= stages
+
+    labels = {label for (stage, label, _) in timers.keys() if stage == instrumentation.STAGE_BLOCK_BILL}
+    assert labels <= set(rate_manager.type_tariffs_map.keys()) and len(labels) > 1
+
+    assert len(calls) == sum(count for (count, _, _) in timers.values())
+    assert stats.get_total_per_stage()[instrumentation.STAGE_BLOCK_BILL] == pytest.approx(
+        sum(total for (stage, _, _), (_, total, _) in timers.items() if stage == instrumentation.STAGE_BLOCK_BILL))
+
+    # Nothing is collected once the context manager is left
+    rate_manager.compute_bill(data)
+    assert stats.get_timers() == timers
+
+
+def test_collection_is_specific_to_each_thread(rate_manager, meter_data):
+
+    data = get_meter_series(meter_data, '2017-06-01 00:00', '2017-07-31 23:59').to_frame()
+
+    with Instrumentation() as stats:
+        rate_manager.compute_bill(data)
+    nb_blocks = get_block_bill_count(stats)
+    assert nb_blocks > 0
+
+    # Each thread bills the data a different number of times, all at once
+    nb_bills = [1, 3, 2]
+    barrier = threading.Barrier(len(nb_bills) + 1)
+    thread_stats = [None] * len(nb_bills)
+
+    def bill(i):
+        with Instrumentation() as stats_thread:
+            barrier.wait()
+            for _ in range(nb_bills[i]):
+                rate_manager.compute_bill(data)
+        thread_stats[i] = stats_thread
+
+    def bill_without_instrumentation():
+        barrier.wait()
+        for _ in range(2):
+            rate_manager.compute_bill(data)
+
+    threads = [threading.Thread(target=bill, args=(i,)) for i in range(len(nb_bills))]
+    threads.append(threading.Thread(target=bill_without_instrumentation))
+
+    with Instrumentation() as stats_main:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    assert [get_block_bill_count(s) for s in thread_stats] == [n * nb_blocks for n in nb_bills]
+    assert stats_main.get_timers() == {}
+
+
+def test_json_and_prometheus_export(tmp_path):
+
+    stats = Instrumentation()
+    stats.record(instrumentation.STAGE_BLOCK_BILL, 'customer_energy_charge', 'TouEnergyChargeTariff', 0.25)
+    stats.record(instrumentation.STAGE_BLOCK_BILL, 'customer_energy_charge', 'TouEnergyChargeTariff', 0.5)
+    stats.record(instrumentation.STAGE_CALENDAR, '', '', 0.125)
+    stats.add_count('calendar_cache_hit', 'label "with" quotes', '', 3)
+
+    json_path = str(tmp_path / 'stats.json')
+    stats.write_json(json_path)
+    with open(json_path) as json_file:
+        snapshot = json.load(json_file)
+
+    assert snapshot['timers'] == [
+        {'stage': 'block_bill', 'label': 'customer_energy_charge', 'class': 'TouEnergyChargeTariff', 'count': 2,
+         'total_seconds': 0.75, 'max_seconds': 0.5},
+        {'stage': 'calendar', 'label': '', 'class': '', 'count': 1, 'total_seconds': 0.125, 'max_seconds': 0.125}]
+    assert snapshot['counters'] == [{'name': 'calendar_cache_hit', 'label': 'label "with" quotes', 'class': '',
+                                     'count': 3}]
+
+    prom_path = str(tmp_path / 'elecprice.prom')
+    stats.write_prometheus_textfile(prom_path)
+    with open(prom_path) as prom_file:
+        lines = prom_file.read().splitlines()
+
+    assert 'elecprice_stage_seconds_total{stage="block_bill",label="customer_energy_charge",' \
+           'class="TouEnergyChargeTariff"} 0.75' in lines
+    assert 'elecprice_stage_calls_total{stage="calendar",label="",class=""} 1' in lines
+    assert 'elecprice_events_total{name="calendar_cache_hit",label="label \\"with\\" quotes",class=""} 3' in lines
+    assert all(line.startswith('# ') or line.startswith('elecprice_') for line in lines)
+    assert not (tmp_path / 'elecprice.prom.tmp').exists()
+
+    stats.reset()
+    assert stats.get_timers() == {} and stats.get_counters() == {}
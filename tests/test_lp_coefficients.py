@@ -0,0 +1,49 @@
+__author__ = 'Olivier Van Cutsem'
+
+import warnings
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+from electricitycostcalculator.electricity_rate_manager.rate_manager import ElectricityRateManager
+from electricitycostcalculator.electricity_rate_manager.tariff_structure import TariffElemPeriod, TouDemandChargeTariff
+
+from .conftest import METER_ID
+
+
+@pytest.mark.parametrize('range_date', [(datetime(2017, 7, 1), datetime(2017, 7, 31, 23, 45)),
+                                        (datetime(2017, 1, 1), datetime(2017, 3, 31, 23, 45))])
+def test_linear_cost_matches_bill(tariffs, meter_data, range_date):
+
+    series = meter_data[METER_ID]
+    series = series[~series.index.duplicated()]
+    data = series.reindex(pd.date_range(range_date[0], range_date[1], freq='15min')).fillna(0)
+
+    for tariff_name, rate_manager in tariffs.items():
+        coefficients = rate_manager.get_linear_cost_coefficients(range_date, TariffElemPeriod.QUARTERLY)
+        expected = rate_manager.compute_bill(data, return_bill=True).get_total_cost()
+
+        assert coefficients.nb_steps == len(data)
+        assert coefficients.get_cost(data.values) == pytest.approx(expected, rel=1e-9, abs=1e-6), tariff_name
+
+
+def test_demand_window_longer_than_the_timestep_warns(rate_manager):
+
+    tariff_block = rate_manager.get_tariff_struct('customer_demand_charge_tou', (datetime(2017, 7, 1),
+                                                                                 datetime(2017, 7, 1)))[0]
+    rate_manager_30min = ElectricityRateManager()
+    rate_manager_30min.add_tariff(TouDemandChargeTariff((tariff_block.startdate, tariff_block.enddate),
+                                                        tariff_block.rate_schedule,
+                                                        demand_window=TariffElemPeriod.HALFLY),
+                                  'customer_demand_charge_tou')
+
+    range_date = (datetime(2017, 7, 1), datetime(2017, 7, 2, 23, 45))
+
+    with pytest.warns(UserWarning, match="demand window of 'customer_demand_charge_tou' is longer than the timestep"):
+        rate_manager_30min.get_linear_cost_coefficients(range_date, TariffElemPeriod.QUARTERLY)
+
+    with warnings.catch_warnings():
+        warnings.filterwarnings('error', message='The demand window')
+        rate_manager_30min.get_linear_cost_coefficients(range_date, TariffElemPeriod.HOURLY)
+        rate_manager.get_linear_cost_coefficients(range_date, TariffElemPeriod.QUARTERLY)
@@ -0,0 +1,24 @@
+__author__ = 'Olivier Van Cutsem'
+
+import pytest
+
+from .conftest import get_label_costs
+
+
+def test_bill_per_column_matches_bill_of_each_column(tariffs, meter_data):
+
+    data = meter_data.loc['2017-01-20 00:00':'2017-03-10 23:59']
+    data = data[~data.index.duplicated()].fillna(0)
+
+    for tariff_name, rate_manager in tariffs.items():
+        bills = rate_manager.compute_bill_per_column(data, monthly_detailed=True)
+
+        assert list(bills.keys()) == list(data.columns)
+        for col, bill in bills.items():
+            expected = rate_manager.compute_bill(data[[col]], monthly_detailed=True)
+
+            assert list(bill.keys()) == list(expected.keys())
+            for cycle_label, bill_cycle in bill.items():
+                costs = get_label_costs(bill_cycle)
+                for label, cost in get_label_costs(expected[cycle_label]).items():
+                    assert costs[label] == pytest.approx(cost, rel=1e-9, abs=1e-9), (tariff_name, col, label)
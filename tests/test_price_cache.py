@@ -0,0 +1,44 @@
+__author__ = 'Olivier Van Cutsem'
+
+import copy
+from datetime import datetime
+
+from electricitycostcalculator.electricity_rate_manager.tariff_structure import TariffElemPeriod
+
+RANGE_DATE = (datetime(2019, 1, 1), datetime(2019, 3, 31, 23, 45))
+
+
+def test_second_request_hits_the_cache(rate_manager):
+
+    prices, _ = rate_manager.get_electricity_price(RANGE_DATE, TariffElemPeriod.QUARTERLY)
+    assert (rate_manager.price_cache.hits, rate_manager.price_cache.misses) == (0, 1)
+
+    prices_again, _ = rate_manager.get_electricity_price(RANGE_DATE, TariffElemPeriod.QUARTERLY)
+    assert (rate_manager.price_cache.hits, rate_manager.price_cache.misses) == (1, 1)
+
+    assert prices_again.equals(prices)
+    assert not prices_again.values.flags.writeable
+
+
+def test_add_tariff_invalidates_the_cache(rate_manager):
+
+    prices, _ = rate_manager.get_electricity_price(RANGE_DATE, TariffElemPeriod.QUARTERLY)
+    assert len(rate_manager.price_cache) == 1
+
+    version = rate_manager.tariff_version
+    tariff_block = rate_manager.get_tariff_struct('customer_energy_charge')[0]
+    rate_manager.add_tariff(copy.copy(tariff_block), 'customer_energy_charge')
+    assert rate_manager.tariff_version != version
+
+    rate_manager.get_electricity_price(RANGE_DATE, TariffElemPeriod.QUARTERLY)
+    assert (rate_manager.price_cache.hits, rate_manager.price_cache.misses) == (0, 2)
+
+
+def test_uncached_prices_are_writeable(rate_manager):
+
+    rate_manager.price_cache.max_bytes = 0
+
+    prices, _ = rate_manager.get_electricity_price(RANGE_DATE, TariffElemPeriod.QUARTERLY)
+
+    assert len(rate_manager.price_cache) == 0
+    assert prices.values.flags.writeable
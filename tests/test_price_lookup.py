@@ -0,0 +1,62 @@
+__author__ = 'Olivier Van Cutsem'
+
+import numpy as np
+import pandas as pd
+
+from electricitycostcalculator.electricity_rate_manager.calendar_structure import HolidayCalendar
+from electricitycostcalculator.electricity_rate_manager.rate_structure import BlockRate
+from electricitycostcalculator.electricity_rate_manager.tariff_structure import TimeOfUseTariff
+
+from .test_rate_structure import get_dict_rate, get_rate_schedules, get_test_dates
+
+
+def test_get_from_timestamps_matches_dict_lookup(tariffs):
+
+    dates = get_test_dates()
+    day_types = {}  # id of the HolidayCalendar -> day type of each date
+
+    for rate_schedule in get_rate_schedules(tariffs):
+        holiday_calendar = rate_schedule.holiday_calendar
+        if id(holiday_calendar) not in day_types:
+            day_types[id(holiday_calendar)] = [holiday_calendar.get_day_type(date) for date in dates]
+
+        expected = []
+        for date, day in zip(dates, day_types[id(holiday_calendar)]):
+            rate = get_dict_rate(rate_schedule, date, 0 if day == HolidayCalendar.HOLIDAY else day)
+            expected.append(np.nan if rate is None else rate)
+
+        np.testing.assert_array_equal(rate_schedule.get_from_timestamps(dates), np.array(expected))
+
+
+def test_price_from_timestamps_on_a_holiday(tariffs):
+
+    # Veterans Day 2017 is a Saturday: as all the holidays, it takes the rates of the day 0 of the schedules, unlike the
+    # scalar lookup that ignores the holidays
+    holiday = pd.date_range('2017-11-11', '2017-11-11 23:45', freq='15min')
+    sunday = pd.date_range('2017-11-12', '2017-11-12 23:45', freq='15min')
+    dates = holiday.append(sunday)[::-1]  # in any order
+
+    nb_holiday_prices = 0  # the prices of the holiday that differ from the ones of a Saturday
+    for tariff_name, rate_manager in tariffs.items():
+        prices = rate_manager.get_price_from_timestamps(dates)
+
+        for label in rate_manager.type_tariffs_map.keys():
+            l_blocks = rate_manager.get_tariff_struct(label, (dates.min(), dates.max()))
+            if len(l_blocks) == 0:
+                assert np.isnan(prices[label]).all(), (tariff_name, label)
+                continue
+
+            tariff_block = l_blocks[0]
+            for date, price in zip(dates, prices[label]):
+                if date.day == 12:
+                    assert price == tariff_block.get_price_from_timestamp(date.to_pydatetime()), (tariff_name, label)
+                elif isinstance(tariff_block, TimeOfUseTariff):
+                    daily_rate = tariff_block.rate_schedule.get_daily_rate(date)
+                    expected = daily_rate[int((date.hour + date.minute / 60.0) * len(daily_rate) / 24.0)]
+                    if isinstance(expected, BlockRate):
+                        expected = expected.get_rate()
+                    assert price == float(expected), (tariff_name, label)
+                    if price != tariff_block.get_price_from_timestamp(date.to_pydatetime()):
+                        nb_holiday_prices += 1
+
+    assert nb_holiday_prices > 0
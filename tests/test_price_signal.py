@@ -0,0 +1,41 @@
+__author__ = 'Olivier Van Cutsem'
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from electricitycostcalculator.electricity_rate_manager.tariff_structure import TariffElemPeriod
+
+from .conftest import decode_runs, load_expected
+
+
+@pytest.fixture(scope='module')
+def expected_prices():
+    """
+    The price signals of the bundled tariffs over a week of holidays (hourly) and a few days of July (15 minutes):
+    tariff name -> period -> {'dates': [first date, number of dates], 'prices': {label: prices}}
+    """
+
+    return load_expected('expected_prices')
+
+
+@pytest.mark.parametrize('period, timestep', [('2016-12-30 00:00/2017-01-03 23:00', TariffElemPeriod.HOURLY),
+                                              ('2017-07-01 00:00/2017-07-05 23:45', TariffElemPeriod.QUARTERLY)])
+def test_electricity_price_matches_baseline(tariffs, expected_prices, period, timestep):
+
+    range_date = tuple(pd.Timestamp(d).to_pydatetime() for d in period.split('/'))
+
+    for tariff_name, rate_manager in tariffs.items():
+        expected = expected_prices[tariff_name][period]
+        prices, _ = rate_manager.get_electricity_price(range_date, timestep)
+
+        assert prices.index[0] == pd.Timestamp(expected['dates'][0])
+        assert len(prices.index) == expected['dates'][1]
+        assert sorted(prices.columns) == sorted(expected['prices'].keys())
+
+        for label, runs in expected['prices'].items():
+            np.testing.assert_array_equal(prices[label].values, np.array(decode_runs(runs)),
+                                          err_msg=str((tariff_name, label)))
+
+            price_in_range = rate_manager.get_price_in_range(label, range_date, timestep)
+            np.testing.assert_array_equal(np.asarray(price_in_range).ravel(), prices[label].values)
@@ -0,0 +1,68 @@
+__author__ = 'Olivier Van Cutsem'
+
+import numpy as np
+import pandas as pd
+
+from electricitycostcalculator.electricity_rate_manager.rate_structure import BlockRate, TouRateSchedule
+
+
+def get_dict_rate(rate_schedule, date, day):
+    """
+    The rate of a date found by walking the dict of the schedule, as TouRateSchedule did before being compiled
+    """
+
+    for m_data in rate_schedule.main_structure.values():
+        if date.month in m_data[TouRateSchedule.MONTHLIST_KEY]:
+            for d_data in m_data[TouRateSchedule.DAILY_RATE_KEY].values():
+                if day in d_data[TouRateSchedule.DAYSLIST_KEY]:
+                    rates = d_data[TouRateSchedule.RATES_KEY]
+                    if type(rates) is list:
+                        rates = rates[int((date.hour + date.minute / 60.0) * len(rates) / 24.0)]
+                    if isinstance(rates, BlockRate):
+                        rates = rates.get_rate()
+                    return None if rates is None else float(rates)
+
+    return None
+
+
+def get_rate_schedules(tariffs):
+    """
+    Return the distinct rate schedules of the time-of-use tariff blocks of the bundled tariffs
+    """
+
+    rate_schedules = {}
+    for rate_manager in tariffs.values():
+        for label in rate_manager.type_tariffs_map.keys():
+            for tariff_block in rate_manager.get_tariff_struct(label):
+                if hasattr(tariff_block, 'rate_schedule'):
+                    rate_schedule = tariff_block.rate_schedule
+                    rate_schedules.setdefault(repr(rate_schedule.main_structure), rate_schedule)
+
+    return list(rate_schedules.values())
+
+
+def get_test_dates():
+    """
+    Random dates over two years, and every hour of the holidays of 2017
+    """
+
+    rng = np.random.default_rng(0)
+    start = pd.Timestamp('2016-01-01').value
+    end = pd.Timestamp('2018-01-01').value
+    dates = pd.to_datetime(np.sort(rng.integers(start, end, 500)) // (60 * 10**9) * (60 * 10**9))  # minutes
+
+    holidays = pd.date_range('2017-01-02', '2017-01-02 23:00', freq='H').append(
+        pd.date_range('2017-07-04', '2017-07-04 23:00', freq='H'))
+
+    return pd.DatetimeIndex(np.sort(np.concatenate([dates.values, holidays.values])))
+
+
+def test_get_from_timestamp_matches_dict_lookup(tariffs):
+
+    dates = get_test_dates()
+
+    for rate_schedule in get_rate_schedules(tariffs):
+        for date in dates[::5]:
+            assert rate_schedule.get_from_timestamp(date.to_pydatetime()) == get_dict_rate(rate_schedule, date,
+                                                                                          date.weekday())
+
@@ -0,0 +1,34 @@
+__author__ = 'Olivier Van Cutsem'
+
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from electricitycostcalculator.electricity_rate_manager.calendar_structure import BillingCycleCalendar
+
+from .conftest import get_meter_series
+
+NB_SCENARIOS = 4
+
+
+@pytest.mark.parametrize('billing_cycles', [None,
+                                            BillingCycleCalendar([datetime(2016, 4, 17), datetime(2016, 5, 20, 13),
+                                                                  datetime(2016, 7, 3), datetime(2016, 9, 9)])])
+def test_scenario_costs_match_bills(tariffs, meter_data, billing_cycles):
+
+    data = get_meter_series(meter_data, '2016-03-05 00:00', '2016-11-20 12:00')
+    scenarios = data.values[None, :] * np.random.default_rng(1).uniform(0, 2, size=(NB_SCENARIOS, len(data)))
+
+    for tariff_name, rate_manager in tariffs.items():
+        total_costs, label_costs = rate_manager.compute_scenario_costs(data.index, scenarios,
+                                                                       billing_cycles=billing_cycles)
+
+        for i in range(NB_SCENARIOS):
+            bill = rate_manager.compute_bill(pd.Series(scenarios[i], index=data.index), return_bill=True,
+                                             billing_cycles=billing_cycles)
+
+            assert total_costs[i] == pytest.approx(bill.get_total_cost(), rel=1e-9, abs=1e-6), tariff_name
+            for label, cost in bill.get_cost_per_label().items():
+                assert label_costs[label][i] == pytest.approx(cost, rel=1e-9, abs=1e-6), (tariff_name, label)
@@ -0,0 +1,97 @@
+__author__ = 'Olivier Van Cutsem'
+
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytz
+
+from electricitycostcalculator.electricity_rate_manager.tariff_structure import FixedTariff, TariffBlockIndex
+
+
+def get_overlapping_blocks(nb_blocks):
+    """
+    Blocks of random lengths, overlapping and nested, in no particular order
+    """
+
+    rng = np.random.default_rng(5)
+    origin = datetime(2016, 1, 1, tzinfo=pytz.utc)
+
+    blocks = []
+    for i in range(nb_blocks):
+        start = origin + timedelta(days=int(rng.integers(0, 700)))
+        end = start + timedelta(days=int(rng.integers(0, 200)), hours=23, minutes=59)
+        blocks.append(FixedTariff((start, end), float(i)))
+
+    # Some blocks share their dates
+    blocks.append(FixedTariff((blocks[0].startdate, blocks[0].enddate), -1.0))
+    blocks.append(FixedTariff((blocks[1].startdate, blocks[2].enddate), -2.0))
+
+    return blocks
+
+
+def get_overlapping_positions(blocks, start_sel, end_sel):
+    """
+    The blocks effective for a part of a period, by scanning all the blocks
+    """
+
+    return [pos for pos, b in enumerate(blocks) if (b.startdate <= start_sel <= b.enddate) or
+            (start_sel <= b.startdate <= end_sel)]
+
+
+def test_range_queries_match_a_scan():
+
+    blocks = get_overlapping_blocks(60)
+    index = TariffBlockIndex(blocks)
+
+    assert len(index) == len(blocks)
+    assert index.blocks == blocks
+
+    rng = np.random.default_rng(6)
+    origin = datetime(2015, 10, 1, tzinfo=pytz.utc)
+    for _ in range(300):
+        start_sel = origin + timedelta(hours=int(rng.integers(0, 24 * 1000)))
+        end_sel = start_sel + timedelta(hours=int(rng.integers(0, 24 * 90)))
+
+        expected = get_overlapping_positions(blocks, start_sel, end_sel)
+
+        assert index.get_positions_in_range(start_sel, end_sel).tolist() == expected
+        assert index.get_blocks_in_range(start_sel, end_sel) == [blocks[pos] for pos in expected]
+        assert index.get_blocks_at(start_sel) == [blocks[pos] for pos in
+                                                  get_overlapping_positions(blocks, start_sel, start_sel)]
+
+    # The bounds of the blocks are included, and naive dates are taken as UTC
+    for b_i in [0, 1, len(blocks) - 1]:
+        for date_sel in [blocks[b_i].startdate, blocks[b_i].enddate]:
+            assert blocks[b_i] in index.get_blocks_at(date_sel)
+            assert blocks[b_i] in index.get_blocks_at(date_sel.replace(tzinfo=None))
+
+
+def test_blocks_added_after_a_query():
+
+    blocks = get_overlapping_blocks(20)
+    index = TariffBlockIndex(blocks[:10])
+
+    start_sel = datetime(2016, 6, 1, tzinfo=pytz.utc)
+    end_sel = datetime(2017, 6, 1, tzinfo=pytz.utc)
+    assert index.get_blocks_in_range(start_sel, end_sel) == [blocks[pos] for pos in
+                                                             get_overlapping_positions(blocks[:10], start_sel, end_sel)]
+
+    for tariff_block in blocks[10:]:
+        index.add(tariff_block)
+
+    assert index.get_blocks_in_range(start_sel, end_sel) == [blocks[pos] for pos in
+                                                             get_overlapping_positions(blocks, start_sel, end_sel)]
+
+
+def test_get_tariff_struct_matches_a_scan(tariffs):
+
+    for tariff_name, rate_manager in tariffs.items():
+        for label in rate_manager.type_tariffs_map.keys():
+            l_blocks = rate_manager.get_tariff_struct(label)
+            for (start_sel, end_sel) in [(datetime(2016, 3, 5), datetime(2016, 11, 20, 12)),
+                                         (datetime(2017, 7, 4, 12), datetime(2017, 7, 4, 12)),
+                                         (datetime(2019, 1, 1), datetime(2030, 1, 1))]:
+                expected = get_overlapping_positions(l_blocks, start_sel.replace(tzinfo=pytz.utc),
+                                                     end_sel.replace(tzinfo=pytz.utc))
+                assert rate_manager.get_tariff_struct(label, (start_sel, end_sel)) == [l_blocks[pos] for pos in
+                                                                                        expected], tariff_name
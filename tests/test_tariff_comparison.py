@@ -0,0 +1,106 @@
+__author__ = 'Olivier Van Cutsem'
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from electricitycostcalculator.electricity_rate_manager import tariff_comparison
+from electricitycostcalculator.electricity_rate_manager.fleet_billing import compute_fleet_bills
+from electricitycostcalculator.electricity_rate_manager.tariff_comparison import compare_tariffs
+from electricitycostcalculator.openei_tariff.openei_tariff_analyzer import read_tariff_library
+
+from .conftest import TARIFF_FILES, get_tariff_name
+
+
+def get_meters(meter_data):
+    """
+    A few meters of the bundled data, over a month
+    """
+
+    data = meter_data.loc['2017-07-01 00:00':'2017-07-31 23:59']
+
+    return data[~data.index.duplicated()].fillna(0).iloc[:, :4]
+
+
+def test_eligibility_and_ranking(tariffs, meter_data):
+
+    meters = get_meters(meter_data)
+
+    table = compare_tariffs(tariffs, meters, nb_workers=0)
+
+    assert len(table) == len(tariffs) * meters.shape[1]
+    assert list(table['meter'].unique()) == list(meters.columns)
+
+    # The average power of each time step, in kW
+    nb_steps_per_hour = pd.Timedelta(hours=1) / (meters.index[1] - meters.index[0])
+
+    nb_eligible = 0
+    for meter_id, table_meter in table.groupby('meter', sort=False):
+        peak_kw = meters[meter_id].max() * nb_steps_per_hour / 1000.0
+
+        for row in table_meter.itertuples():
+            rate_manager = tariffs[row.tariff]
+            eligible = rate_manager.tariff_min_kw <= peak_kw <= rate_manager.tariff_max_kw
+            assert row.eligible == eligible, (meter_id, row.tariff)
+
+            if eligible:
+                expected = rate_manager.compute_bill(meters[meter_id], return_bill=True).get_total_cost()
+                assert row.total_cost == pytest.approx(expected, rel=1e-9), (meter_id, row.tariff)
+                assert row.total_cost == pytest.approx(row.fixed_cost + row.energy_cost + row.demand_cost, rel=1e-9)
+                nb_eligible += 1
+            else:
+                assert 'peak demand' in row.reason
+                assert np.isnan(row.total_cost) and pd.isna(row.rank)
+
+        # The eligible tariffs first, from the cheapest one
+        eligible_costs = table_meter.loc[table_meter['eligible'], 'total_cost'].tolist()
+        assert eligible_costs == sorted(eligible_costs)
+        assert table_meter['rank'].tolist()[:len(eligible_costs)] == list(range(1, len(eligible_costs) + 1))
+        assert not table_meter['eligible'].iloc[len(eligible_costs):].any()
+
+    assert 0 < nb_eligible < len(table)
+
+    # Without the eligibility check, all the tariffs are billed
+    assert compare_tariffs(tariffs, meters, nb_workers=0, check_eligibility=False)['eligible'].all()
+
+
+def test_parallel_comparison_matches_serial_comparison(tariffs, meter_data):
+
+    meters = get_meters(meter_data)
+
+    table_serial = compare_tariffs(tariffs, meters, nb_workers=0)
+    table_parallel = compare_tariffs(tariffs, meters, nb_workers=2)
+
+    pd.testing.assert_frame_equal(table_parallel.drop(columns=['total_cost', 'fixed_cost', 'energy_cost', 'demand_cost']),
+                                  table_serial.drop(columns=['total_cost', 'fixed_cost', 'energy_cost', 'demand_cost']))
+    for col in ['total_cost', 'fixed_cost', 'energy_cost', 'demand_cost']:
+        np.testing.assert_allclose(table_parallel[col].values, table_serial[col].values, rtol=1e-9)
+
+
+def test_comparison_is_parallel_by_default(tariffs, meter_data, monkeypatch):
+
+    meters = get_meters(meter_data).iloc[:, :2]
+    calls = []
+
+    def record_fleet_bills(jobs, **kwargs):
+        calls.append(kwargs)
+        return compute_fleet_bills(jobs, **kwargs)
+
+    monkeypatch.setattr(tariff_comparison, 'compute_fleet_bills', record_fleet_bills)
+
+    table = compare_tariffs(tariffs, meters)
+
+    assert len(calls) == 1 and calls[0]['nb_workers'] is None
+    pd.testing.assert_frame_equal(table[['meter', 'tariff', 'eligible', 'rank']],
+                                  compare_tariffs(tariffs, meters, nb_workers=0)[['meter', 'tariff', 'eligible', 'rank']])
+
+
+def test_unreadable_tariffs_are_skipped_with_a_warning(tmp_path):
+
+    filename = tmp_path / 'broken_tariff.json'
+    filename.write_text('{not json')
+
+    with pytest.warns(UserWarning, match='broken_tariff.json'):
+        tariffs = read_tariff_library([TARIFF_FILES[0], str(filename)])
+
+    assert list(tariffs.keys()) == [get_tariff_name(TARIFF_FILES[0])]
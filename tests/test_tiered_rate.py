@@ -0,0 +1,115 @@
+__author__ = 'Olivier Van Cutsem'
+
+from datetime import datetime
+
+import pandas as pd
+import pytest
+import pytz
+
+from electricitycostcalculator.electricity_rate_manager.rate_structure import BlockRate, TouRateSchedule
+from electricitycostcalculator.electricity_rate_manager.tariff_structure import TouEnergyChargeTariff
+from electricitycostcalculator.openei_tariff.openei_tariff_analyzer import read_tiered_rate
+
+RATES = [0.1, 0.2, 0.3]
+THRESHOLDS = [100.1, 250.3]  # kWh, not multiples of the consumption of a data point
+
+
+def get_tiered_tariff():
+    """
+    An energy charge with the same tiered rate at all times, over 2017
+    """
+
+    rates_schedule = {'allyear': {TouRateSchedule.MONTHLIST_KEY: list(range(1, 13)),
+                                  TouRateSchedule.DAILY_RATE_KEY: {
+                                      'allweek': {TouRateSchedule.DAYSLIST_KEY: list(range(7)),
+                                                  TouRateSchedule.RATES_KEY: BlockRate(RATES[0],
+                                                                                       (RATES[1:], THRESHOLDS))}}}}
+
+    dates = (datetime(2017, 1, 1, tzinfo=pytz.utc), datetime(2017, 12, 31, 23, 59, tzinfo=pytz.utc))
+
+    return TouEnergyChargeTariff(dates, TouRateSchedule(rates_schedule))
+
+
+def get_tiered_cost(consumption):
+    """
+    The cost of a sequence of consumptions (kWh), each one being split between the tiers it spans
+    """
+
+    bounds = THRESHOLDS + [float('inf')]
+
+    cost = 0.0
+    acc = 0.0
+    for energy in consumption:
+        while energy > 0:
+            tier = min(i for i in range(len(bounds)) if acc < bounds[i])
+            part = min(energy, bounds[tier] - acc)
+            cost += part * RATES[tier]
+            acc += part
+            energy -= part
+
+    return cost
+
+
+def get_data(start, end):
+    """
+    A consumption of 0.4 kWh every 15 minutes, and 1.3 kWh every 7 hours, in Wh
+    """
+
+    index = pd.date_range(start, end, freq='15min')
+    values = [1300.0 if i % 28 == 0 else 400.0 for i in range(len(index))]
+
+    return pd.DataFrame({'meter': values}, index=index)
+
+
+def test_tier_boundaries_within_a_billing_month():
+
+    data = get_data('2017-07-01 00:00', '2017-07-31 23:45')
+
+    bill = get_tiered_tariff().compute_bill(data, 'meter')
+
+    assert list(bill.keys()) == ['2017-07']
+    energy, cost = bill['2017-07']
+    assert energy == pytest.approx(data['meter'].sum() / 1000.0)
+    assert energy > THRESHOLDS[-1]
+    assert cost == pytest.approx(get_tiered_cost(data['meter'].values / 1000.0), rel=1e-12)
+
+    # Below the first threshold, only the first rate applies
+    data_day = data.loc['2017-07-01']
+    energy, cost = get_tiered_tariff().compute_bill(data_day, 'meter')['2017-07']
+    assert energy < THRESHOLDS[0]
+    assert cost == pytest.approx(energy * RATES[0], rel=1e-12)
+
+
+def test_tiers_reset_at_the_billing_cycle_boundary():
+
+    data = get_data('2017-07-20 00:00', '2017-08-10 23:45')
+
+    bill = get_tiered_tariff().compute_bill(data, 'meter')
+
+    assert list(bill.keys()) == ['2017-07', '2017-08']
+    for cycle_label, data_cycle in (('2017-07', data.loc['2017-07']), ('2017-08', data.loc['2017-08'])):
+        energy, cost = bill[cycle_label]
+        assert energy > THRESHOLDS[0]
+        assert cost == pytest.approx(get_tiered_cost(data_cycle['meter'].values / 1000.0), rel=1e-12), cycle_label
+
+
+def test_read_tiered_rate_adds_the_adjustments():
+
+    tiers = [{'max': 100.1, 'unit': 'kWh', 'rate': 0.09, 'adj': 0.01}, {'max': 250.3, 'rate': 0.2},
+             {'rate': 0.27, 'adj': 0.03}]
+
+    block_rate = read_tiered_rate(tiers)
+
+    assert block_rate.rates == pytest.approx(RATES)
+    assert block_rate.thresholds[1:-1] == THRESHOLDS
+    assert read_tiered_rate(tiers, keep_tiers=False) == pytest.approx(RATES[0])
+    assert read_tiered_rate([{'rate': 0.09, 'adj': 0.01}]) == pytest.approx(RATES[0])
+
+
+@pytest.mark.parametrize('unit', ['kWh daily', 'kWh/kW'])
+def test_read_tiered_rate_rejects_other_units(unit):
+
+    tiers = [{'max': 100.1, 'unit': unit, 'rate': 0.1}, {'rate': 0.2}]
+
+    with pytest.raises(ValueError, match=unit):
+        read_tiered_rate(tiers)